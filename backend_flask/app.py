@@ -1,17 +1,17 @@
 import mysql.connector
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 import os
 import datetime
+import functools
+import json
 import logging
 import time
 
 logging.basicConfig(level=logging.INFO)
 
 try:
-    from db_config import get_connection
+    from db_config import get_connection, get_read_connection, pool_stats, replica_stats
 except ImportError:
     print("="*50)
     print("❌ خطأ فادح: لم يتم العثور على ملف 'db_config.py'.")
@@ -19,29 +19,315 @@ except ImportError:
     print("="*50)
     exit(1)
 
+from seat_index import seat_index, slot_key, normalize_slot, normalize_text
+import queries
+import seat_engine as seat_engine_module
+from seat_engine import seat_engine
+from seat_segments import seat_segments
+from sticky_reads import (sticky_reads, user_sticky_keys, slot_sticky_key, train_sticky_key,
+                          time_sticky_key)
+from booking_rollups import booking_rollups
+from ticket_archive import ticket_archive, merge_newest_first
+from timetable import timetable
+from ticket_verifier import ticket_verifier
+from ticket_tokens import ticket_tokens, issue_ticket_token
+from password_hasher import password_hasher, HasherBusyError
+from rate_limiter import login_limiter
+from session_tokens import session_tokens
+from signing import debug_mode
+import seat_events as seat_event_stream
+from seat_events import seat_events, TooManySubscribersError
+from booking_writer import booking_writer, WriterUnavailableError
+import metrics
+from event_log import log_event, log_error, log_warning
+from request_profiler import request_profiler
+from json_codec import codec as json_codec
+from priority_cards import priority_cards, CardTooLargeError, UnsupportedCardError
+
 
 
 app = Flask(__name__)
 CORS(app)
 
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['UPLOAD_FOLDER'] = priority_cards.root
+# حد لجسم الطلب كاملاً (صورة البطاقة وحقول النموذج)؛ ما يتجاوزه يُرفض بـ 413 قبل قراءته
+app.config['MAX_CONTENT_LENGTH'] = priority_cards.max_bytes + 1024 * 1024
+priority_cards.sweep_staging()
+
+seat_events.attach(seat_index)
+metrics.register_statements(queries)
+metrics.register_statements(seat_engine_module)
+# يغلّف التطبيق كاملاً (بما فيه التوجيه وبناء الاستجابة)؛ لا يعمل إلا بترويسة أو عينة
+request_profiler.wrap(app)
+
+BOOK_BATCH_MAX = int(os.environ.get("BOOK_BATCH_MAX", 50))
+CANCEL_BATCH_MAX = int(os.environ.get("CANCEL_BATCH_MAX", 500))
 
+# عند التفعيل تُرفض الطلبات المحمية التي لا تحمل رمز دخول (العملاء القدامى لا يرسلونه)
+AUTH_REQUIRED = os.environ.get("AUTH_REQUIRED", "false").lower() == "true"
 
-def check_db_connection():
-    """التحقق من اتصال قاعدة البيانات عند بدء تشغيل الخادم."""
+
+def database_ready():
+    """فحص سريع لقاعدة البيانات عبر تجمع الاتصالات؛ يعيد (جاهز، سبب الفشل)."""
     try:
         conn = get_connection()
-        if conn.is_connected():
-            print("✅ نجح الاتصال بقاعدة البيانات!")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        finally:
             conn.close()
-            return True
-        return False
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+
+@app.route("/healthz/live", methods=["GET"])
+def liveness():
+    # العملية تعمل وتستجيب؛ لا نلمس قاعدة البيانات حتى لا يُعاد تشغيل العمال بسبب عطل خارجي
+    return jsonify({"status": "alive", "pid": os.getpid()})
+
+
+@app.route("/healthz/ready", methods=["GET"])
+def readiness():
+    ready, error = database_ready()
+    body = {"status": "ready" if ready else "unavailable", "pid": os.getpid(), "pool": pool_stats()}
+    if not ready:
+        body["error"] = error
+        return jsonify(body), 503
+    return jsonify(body)
+
+
+@app.route("/pool_stats", methods=["GET"])
+def get_pool_stats():
+    return jsonify(pool_stats())
+
+
+@app.route("/db/replicas", methods=["GET"])
+def get_replica_stats():
+    return jsonify({**replica_stats(), "sticky": sticky_reads.stats()})
+
+
+def read_connection(*sticky_keys):
+    """اتصال لمعالجات القراءة فقط: نسخة متماثلة، أو الأساسية إن كُتب أحد المفاتيح قبل لحظات."""
+    return get_read_connection(sticky=sticky_reads.sticky(*sticky_keys))
+
+
+def trip_sticky_keys(key):
+    """مفاتيح القراءة التي يغيّرها حجز أو إلغاء على slot واحد."""
+    keys = [slot_sticky_key(key), time_sticky_key(key[0])]
+    journey = seat_segments.journey(key)
+    if journey is not None:
+        keys.append(train_sticky_key(journey[0]))
+    return keys
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        elapsed = time.perf_counter() - started
+        metrics.http_request_duration.observe(elapsed, route, request.method, str(response.status_code))
+        log_event("request", route=route, method=request.method, status=response.status_code,
+                  duration_ms=round(elapsed * 1000, 2))
+    return response
+
+
+@app.teardown_request
+def record_request_exception(error):
+    if error is not None:
+        metrics.http_exceptions.inc(request.url_rule.rule if request.url_rule else "unmatched")
+        log_error("unhandled_exception", error, path=request.path)
+
+
+def pool_metric_lines():
+    stats = pool_stats()
+    lines = metrics.render_gauges("db_pool_connections", "Connection pool state.", {
+        "in_use": stats["in_use"], "idle": stats["idle"], "opened": stats["opened"], "waiting": stats["waiting"],
+    })
+    lines += metrics.render_gauges("db_pool_events_total", "Pool timeouts, recycles and failed pings.", {
+        "timeouts": stats["timeouts"], "recycled": stats["recycled"], "failed_pings": stats["failed_pings"],
+    })
+    # المدرج محفوظ في التجمع بالملي ثانية؛ يُعرض بالثواني كبقية المقاييس
+    wait = stats["checkout_wait_ms"]
+    lines += ["# HELP db_connection_acquire_seconds Time spent waiting for a pooled connection.",
+              "# TYPE db_connection_acquire_seconds histogram"]
+    for bound, count in wait["buckets"].items():
+        le = bound if bound == "+Inf" else repr(float(bound) / 1000)
+        lines.append(f'db_connection_acquire_seconds_bucket{{le="{le}"}} {count}')
+    lines.append(f"db_connection_acquire_seconds_sum {round(wait['sum'] / 1000, 6)}")
+    lines.append(f"db_connection_acquire_seconds_count {wait['count']}")
+    replicas = replica_stats()
+    lines += metrics.render_gauges("db_reads_total", "Read-only queries by destination.", {
+        "primary": replicas["primary_reads"], **{replica["name"]: replica["reads"] for replica in replicas["replicas"]},
+    })
+    lines += metrics.render_gauges("db_read_fallbacks_total", "Reads sent to the primary with no healthy replica.", {
+        None: replicas["fallbacks"],
+    })
+    lines += metrics.render_gauges("db_replica_healthy", "1 while the replica receives reads.", {
+        replica["name"]: int(replica["healthy"]) for replica in replicas["replicas"]
+    })
+    # تأخر غير معروف (النسخ متوقف أو لا اتصال) يظهر -1
+    lines += metrics.render_gauges("db_replica_lag_seconds", "Last measured replication lag.", {
+        replica["name"]: -1 if replica["lag"] is None else replica["lag"] for replica in replicas["replicas"]
+    })
+    lines += metrics.render_gauges("db_replica_ejections_total", "Times the replica was taken out of rotation.", {
+        replica["name"]: replica["ejections"] for replica in replicas["replicas"]
+    })
+    return lines
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    lines = pool_metric_lines()
+    lines += metrics.render_gauges("seat_index", "Seat occupancy index.", seat_index.stats())
+    lines += metrics.render_gauges("ticket_verifier", "Gate verification map.", {
+        name: value for name, value in ticket_verifier.stats().items() if name != "day"
+    })
+    writer = booking_writer.stats()
+    lines += metrics.render_gauges("booking_writer", "Write-behind booking queue.", {
+        name: writer[name] for name in ("queue_depth", "accepted", "flushed", "batches", "conflicts", "journal_bytes")
+    })
+    lines += metrics.render_gauges("seat_event_subscribers", "Open seat-map streams.",
+                                   {None: seat_events.stats()["subscribers"]})
+    return Response(metrics.render(lines), mimetype="text/plain; version=0.0.4")
+
+
+def load_booked_seats(key, primary=False):
+    """قراءة المقاعد المحجوزة (والمحجوزة مؤقتاً) لرحلة واحدة من جدول seat_claims.
+    primary: يتجاوز النسخ المتماثلة (فحص اتساق الفهرس)."""
+    conn = get_connection() if primary else read_connection(slot_sticky_key(key))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(queries.SLOT_SEAT_CLAIMS, tuple(key))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def load_train_legs(train, primary=False):
+    """أجزاء القطار المحجوزة لكل مقعد، لمخزون seat_segments."""
+    conn = get_connection() if primary else read_connection(train_sticky_key(train))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(queries.TRAIN_LEG_CLAIMS, tuple(train))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def with_overlapping_legs(key, booked_seats_list):
+    """يضيف إلى مقاعد المقطع نفسه المقاعدَ المحجوزة لمقاطع تتداخل معه على المسار."""
+    journey = seat_segments.journey(key)
+    if journey is None:
+        return booked_seats_list
+    listed = set(booked_seats_list)
+    return booked_seats_list + [seat for seat in seat_segments.taken(journey, load_train_legs) if seat not in listed]
+
+
+@app.route("/seat_index/stats", methods=["GET"])
+def get_seat_index_stats():
+    return jsonify(seat_index.stats())
+
+
+@app.route("/seat_segments/stats", methods=["GET"])
+def get_seat_segments_stats():
+    return jsonify(seat_segments.stats())
+
+
+@app.route("/seat_engine/stats", methods=["GET"])
+def get_seat_engine_stats():
+    return jsonify(seat_engine.stats())
+
+
+def with_principal(*roles, required=False):
+    """يحدد هوية الطالب من رمز Authorization: Bearer في الذاكرة ويضعها في g.principal.
+
+    required=True يرفض الطلب بلا رمز حتى لو كان AUTH_REQUIRED معطلاً (مسارات الموظفين الحساسة).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.principal = None
+            header = request.headers.get('Authorization', '')
+            if header.startswith('Bearer '):
+                principal = session_tokens.authenticate(header[7:].strip())
+                if principal is None:
+                    return jsonify({"success": False, "message": "انتهت الجلسة، يرجى تسجيل الدخول من جديد"}), 401
+                if roles and principal['role'] not in roles:
+                    return jsonify({"success": False, "message": "غير مصرح لك بهذا الإجراء"}), 403
+                g.principal = principal
+            elif required or AUTH_REQUIRED:
+                return jsonify({"success": False, "message": "يرجى تسجيل الدخول"}), 401
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@app.route("/seat_index/check", methods=["POST"])
+@with_principal("employee", required=True)
+def check_seat_index():
+    try:
+        seat_index.evict_past()
+        return jsonify({"success": True, **seat_index.check(functools.partial(load_booked_seats, primary=True))})
     except Exception as e:
-        print(f"❌ فشل الاتصال بقاعدة البيانات عند بدء التشغيل: {e}")
-        return False
+        log_error("seat_index_check_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+def start_session(principal):
+    """إنشاء جلسة بعد نجاح الدخول؛ عند الفشل يكتمل الدخول بدون رموز كما في السابق."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        tokens = session_tokens.create_session(cursor, principal)
+        conn.commit()
+        return tokens
+    except Exception as e:
+        log_warning("session_create_failed", error=str(e))
+        return {}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def too_many_attempts(retry_after):
+    response = jsonify({"success": False, "message": "محاولات كثيرة، يرجى المحاولة لاحقاً"})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+
+def server_busy():
+    return jsonify({"success": False, "message": "الخادم مشغول، يرجى المحاولة لاحقاً"}), 503
+
+
+def write_behind_unsupported():
+    # هذه المسارات تأخذ أرقام تذاكرها من AUTO_INCREMENT وتحجز المقعد في MySQL مباشرة، فلا يراها
+    # دفتر booking_writer ولا تسلسل أرقامه؛ تُغلق ما دام وضع الكتابة المؤجلة مفعلاً
+    return jsonify({"success": False, "message": "هذه العملية غير متاحة في وضع الحجز المؤجل"}), 503
+
+
+def store_rehashed_password(query, params):
+    """حفظ تجزئة جديدة بعد تغيير إعدادات التجزئة؛ الفشل لا يمنع تسجيل الدخول."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        conn.commit()
+    except Exception as e:
+        log_warning("password_rehash_failed", error=str(e))
+    finally:
+        cursor.close()
+        conn.close()
 
 
 @app.route("/login", methods=["POST"])
@@ -53,48 +339,108 @@ def login():
     if not username or not password:
         return jsonify({"success": False, "message": "اسم المستخدم وكلمة المرور مطلوبان"}), 400
 
-    print("Received user login data:", data)
-    logging.info(f"Attempting passenger login for username: {username}")
+
+    # يُرفض الطلب قبل أي تجزئة إذا تجاوز الحساب أو العنوان الحد المسموح
+    allowed, retry_after = login_limiter.allow(f"ip:{request.remote_addr}", f"account:{normalize_text(username)}")
+    if not allowed:
+        log_warning("login_rate_limited", username=username, ip=request.remote_addr)
+        return too_many_attempts(retry_after)
 
     conn = get_connection()
     cursor = conn.cursor(dictionary=True)
     try:
-        cursor.execute("""
-            SELECT name, username, password
-            FROM users
-            WHERE TRIM(LOWER(username)) = TRIM(LOWER(%s))
-        """, (username,))
+        cursor.execute(queries.USER_LOGIN, (normalize_text(username),))
         user = cursor.fetchone()
+    except Exception as e:
+        log_error("login_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        # الاتصال يعود إلى التجمع قبل التجزئة البطيئة
+        cursor.close()
+        conn.close()
 
-        if user:
-            logging.info(f"Passenger found: {user['username']}")
-            stored_hash = user['password']
-            
-            if check_password_hash(stored_hash, password):
-                logging.info(f"Password match for passenger: {username}")
-                full_name = user['name'] if user['name'] is not None else user['username']
-                print(f"Login successful, determined full name: {full_name}")
-
-                return jsonify({"success": True, "user": {"full_name": full_name, "username": user['username']}})
-            else:
-                logging.warning(f"Login failed for {username}: Password mismatch")
-                return jsonify({"success": False, "message": "اسم المستخدم أو كلمة المرور غير صحيحة"}), 401
-        else:
-            logging.warning(f"Login failed: User {username} not found")
-            return jsonify({"success": False, "message": "اسم المستخدم أو كلمة المرور غير صحيحة"}), 401
+    if not user:
+        log_warning("login_failed", username=username, reason="unknown_user")
+        return jsonify({"success": False, "message": "اسم المستخدم أو كلمة المرور غير صحيحة"}), 401
+
+    try:
+        matches, new_hash = password_hasher.verify(user['password'], password)
+    except HasherBusyError as e:
+        log_warning("login_shed", username=username, error=str(e))
+        return server_busy()
+
+    if not matches:
+        log_warning("login_failed", username=username, reason="password_mismatch")
+        return jsonify({"success": False, "message": "اسم المستخدم أو كلمة المرور غير صحيحة"}), 401
+
+    if new_hash:
+        store_rehashed_password("UPDATE users SET password = %s WHERE id = %s", (new_hash, user['id']))
+
+    full_name = user['name'] if user['name'] is not None else user['username']
+    log_event("login_succeeded", user_id=user['id'])
+
+    tokens = start_session({"role": "passenger", "id": user['id'], "name": full_name})
+    return jsonify({"success": True, "user": {"id": user['id'], "full_name": full_name, "username": user['username']}, **tokens})
+
+
+@app.route("/auth/refresh", methods=["POST"])
+def refresh_session():
+    data = request.get_json()
+    refresh_token = data.get("refresh_token")
+    if not refresh_token:
+        return jsonify({"success": False, "message": "Missing refresh_token"}), 400
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        tokens = session_tokens.refresh(cursor, refresh_token)
+        conn.commit()
+        if not tokens:
+            return jsonify({"success": False, "message": "انتهت الجلسة، يرجى تسجيل الدخول من جديد"}), 401
+        return jsonify({"success": True, **tokens})
+    except Exception as e:
+        log_error("session_refresh_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@app.route("/auth/logout", methods=["POST"])
+def logout():
+    data = request.get_json(silent=True) or {}
+    session_id = session_tokens.session_id_of_refresh(data.get("refresh_token", ""))
+
+    header = request.headers.get('Authorization', '')
+    if not session_id and header.startswith('Bearer '):
+        principal = session_tokens.authenticate(header[7:].strip())
+        session_id = principal['sid'] if principal else None
+
+    if not session_id:
+        return jsonify({"success": False, "message": "Missing refresh_token"}), 400
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        session_tokens.revoke(cursor, session_id)
+        conn.commit()
+        return jsonify({"success": True})
     except Exception as e:
-        print("Login error:", e)
-        logging.error(f"Passenger login error: {e}", exc_info=True)
+        log_error("logout_error", e)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         cursor.close()
         conn.close()
 
 
+@app.route("/auth/stats", methods=["GET"])
+def get_auth_stats():
+    return jsonify(session_tokens.stats())
+
+
 @app.route("/register", methods=["POST"])
 def register():
     data = request.form
-    print("Received registration data:", data)
     priority_card = request.files.get('priority_card')
 
     required_fields = ["id", "name", "password", "username", "email", "birth_date", "resettle", "address", "phone"]
@@ -106,59 +452,78 @@ def register():
     if not priority_card:
         return jsonify({"success": False, "message": "صورة بطاقة الأولوية مطلوبة"}), 400
 
-    hashed_password = generate_password_hash(data["password"])
+    allowed, retry_after = login_limiter.allow(f"ip:{request.remote_addr}")
+    if not allowed:
+        return too_many_attempts(retry_after)
 
-    conn = get_connection()
-    cursor = conn.cursor()
+    birth_date_str = data["birth_date"]
     try:
-        filename = secure_filename(f"{data.get('id')}_{priority_card.filename}")
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        priority_card.save(file_path)
+        formatted_birth_date = datetime.datetime.strptime(birth_date_str.strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        log_warning("register_bad_birth_date", birth_date=birth_date_str)
+        return jsonify({"success": False, "message": "صيغة التاريخ غير صالحة. يجب أن تكون س-ش-ي (YYYY-MM-DD)."}), 400
 
-        birth_date_str = data["birth_date"]
-        
-        try:
-            formatted_birth_date = datetime.datetime.strptime(birth_date_str.strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
-        except ValueError as ve:
-            print(f"Date conversion failed for {birth_date_str}: {ve}")
-            return jsonify({"success": False, "message": "صيغة التاريخ غير صالحة. يجب أن تكون س-ش-ي (YYYY-MM-DD)."}), 400
+    try:
+        hashed_password = password_hasher.hash(data["password"])
+    except HasherBusyError as e:
+        log_warning("register_shed", error=str(e))
+        return server_busy()
 
-        resettle_data = data.get("resettle")
+    # الصورة تُنسخ إلى منطقة مؤقتة قبل أخذ اتصال من التجمع، فلا يحجز رفع بطيء اتصالاً
+    try:
+        card = priority_cards.stage(priority_card)
+    except CardTooLargeError:
+        return jsonify({"success": False, "message": "حجم صورة بطاقة الأولوية أكبر من المسموح"}), 413
+    except UnsupportedCardError:
+        return jsonify({"success": False, "message": "صيغة صورة بطاقة الأولوية غير مدعومة"}), 415
 
+    conn = get_connection()
+    cursor = conn.cursor()
+    registered = False
+    try:
         cursor.execute("""
             INSERT INTO users (
                 id, name, date_of_birth, resettle_date, address, 
-                username, password, email, phone, priority_card_path
+                username, username_key, password, email, phone, priority_card_path
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """, (
             data.get("id"),
             data.get("name"),
             formatted_birth_date,
-            resettle_data,
+            data.get("resettle"),
             data.get("address"),
             data.get("username"),
+            normalize_text(data.get("username")),
             hashed_password,
             data.get("email"),
             data.get("phone"),
-            file_path
+            card.final_path
         ))
         conn.commit()
-        return jsonify({"success": True, "message": "تم التسجيل بنجاح. يرجى تسجيل الدخول."})
+        registered = True
     except Exception as e:
-        print("Registration error:", e)
+        log_error("register_error", e)
         if '1062' in str(e):
             return jsonify({"success": False, "message": "فشل التسجيل. اسم المستخدم أو البريد الإلكتروني أو الهوية مستخدمة بالفعل."}), 409
         return jsonify({"success": False, "message": f"فشل التسجيل. ({str(e)})"}), 500
     finally:
         cursor.close()
         conn.close()
+        if not registered:
+            priority_cards.discard(card)
+
+    # الملف يُنقل إلى مكانه النهائي بعد نجاح الإدراج فقط، فلا تبقى صور يتيمة عند الرفض
+    try:
+        priority_cards.commit(card)
+    except Exception as e:
+        log_error("priority_card_commit_failed", e, user_id=data.get("id"))
+    return jsonify({"success": True, "message": "تم التسجيل بنجاح. يرجى تسجيل الدخول."})
 
 
 @app.route("/employee_register", methods=["POST"])
 def employee_register():
     data = request.get_json()
-    print("Received employee registration data:", data)
 
     employee_id = data.get("employee_id")
     employee_name = data.get("name")
@@ -170,7 +535,15 @@ def employee_register():
     if not all([employee_id, employee_name, employee_username, password]):
         return jsonify({"success": False, "message": "يرجى تقديم كافة البيانات المطلوبة (الرقم الوظيفي، الاسم، اسم المستخدم، كلمة المرور)"}), 400
 
-    hashed_password = generate_password_hash(password)
+    allowed, retry_after = login_limiter.allow(f"ip:{request.remote_addr}")
+    if not allowed:
+        return too_many_attempts(retry_after)
+
+    try:
+        hashed_password = password_hasher.hash(password)
+    except HasherBusyError as e:
+        log_warning("employee_register_shed", error=str(e))
+        return server_busy()
 
     conn = get_connection()
     cursor = conn.cursor()
@@ -180,15 +553,17 @@ def employee_register():
                 employee_id,
                 name,
                 username,
+                username_key,
                 password,
                 email,
                 phone
             )
-            VALUES (%s, %s, %s, %s, %s, %s)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
         """, (
             employee_id,
             employee_name,
             employee_username,
+            normalize_text(employee_username),
             hashed_password,
             employee_email,
             employee_phone
@@ -196,7 +571,7 @@ def employee_register():
         conn.commit()
         return jsonify({"success": True, "message": "تم تسجيل حساب الموظف بنجاح."})
     except Exception as e:
-        print("Employee registration error:", e)
+        log_error("employee_register_error", e)
         if '1062' in str(e):
             return jsonify({"success": False, "message": "فشل التسجيل. الرقم الوظيفي أو اسم المستخدم أو البريد الإلكتروني مستخدمة بالفعل."}), 409
         return jsonify({"success": False, "message": f"فشل تسجيل الموظف. ({str(e)})"}), 500
@@ -215,53 +590,65 @@ def employee_login():
     if not employee_credential or not password:
         return jsonify({"success": False, "message": "الرقم الوظيفي/اسم المستخدم وكلمة المرور مطلوبان"}), 400
 
-    print("Received employee login data:", data)
-    logging.info(f"Attempting login for credential: {employee_credential}")
+    credential_key = normalize_text(employee_credential)
+    allowed, retry_after = login_limiter.allow(f"ip:{request.remote_addr}", f"employee:{credential_key}")
+    if not allowed:
+        log_warning("employee_login_rate_limited", credential=employee_credential, ip=request.remote_addr)
+        return too_many_attempts(retry_after)
 
     conn = get_connection()
     cursor = conn.cursor(dictionary=True)
     try:
-        query = """
-            SELECT employee_id, name, password
-            FROM employee
-            WHERE TRIM(LOWER(CAST(employee_id AS CHAR))) = TRIM(LOWER(%s))
-            OR TRIM(LOWER(username)) = TRIM(LOWER(%s))
-        """
-        cursor.execute(query, (employee_credential, employee_credential))
-        employee = cursor.fetchone()
-
-        if employee:
-            logging.info(f"Employee found: {employee['employee_id']}, Name: {employee['name']}")
-            stored_hash = employee["password"]
-
-            if check_password_hash(stored_hash, password):
-                logging.info(f"Password match for {employee_credential}")
-                return jsonify({
-                    "success": True,
-                    "employee": {
-                        "name": employee["name"],
-                        "employee_id": employee["employee_id"]
-                    }
-                })
-            else:
-                logging.warning(f"Login failed for {employee_credential}: Password mismatch")
-                return jsonify({"success": False, "message": "الرقم الوظيفي/اسم المستخدم أو كلمة المرور غير صحيحة"}), 401
-        else:
-            logging.warning(f"Login failed: Employee {employee_credential} not found")
-            return jsonify({"success": False, "message": "الرقم الوظيفي/اسم المستخدم غير موجود"}), 401
-
+        employee = None
+        # الرقم الوظيفي يُطابَق على المفتاح الأساسي مباشرة بدلاً من CAST(... AS CHAR)
+        if credential_key.isdigit():
+            cursor.execute(queries.EMPLOYEE_LOGIN_BY_ID, (int(credential_key),))
+            employee = cursor.fetchone()
+        if not employee:
+            cursor.execute(queries.EMPLOYEE_LOGIN_BY_USERNAME, (credential_key,))
+            employee = cursor.fetchone()
     except Exception as e:
-        print("Employee login error:", e)
-        logging.error(f"Employee login error: {e}", exc_info=True)
+        log_error("employee_login_error", e)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         cursor.close()
         conn.close()
+
+    if not employee:
+        log_warning("employee_login_failed", credential=employee_credential, reason="unknown_employee")
+        return jsonify({"success": False, "message": "الرقم الوظيفي/اسم المستخدم غير موجود"}), 401
+
+    try:
+        matches, new_hash = password_hasher.verify(employee["password"], password)
+    except HasherBusyError as e:
+        log_warning("employee_login_shed", credential=employee_credential, error=str(e))
+        return server_busy()
+
+    if not matches:
+        log_warning("employee_login_failed", credential=employee_credential, reason="password_mismatch")
+        return jsonify({"success": False, "message": "الرقم الوظيفي/اسم المستخدم أو كلمة المرور غير صحيحة"}), 401
+
+    if new_hash:
+        store_rehashed_password(
+            "UPDATE employee SET password = %s WHERE employee_id = %s",
+            (new_hash, employee["employee_id"])
+        )
+
+    log_event("employee_login_succeeded", employee_id=employee["employee_id"])
+    tokens = start_session({"role": "employee", "id": employee["employee_id"], "name": employee["name"]})
+    return jsonify({
+        "success": True,
+        "employee": {
+            "name": employee["name"],
+            "employee_id": employee["employee_id"]
+        },
+        **tokens
+    })
         
 
 @app.route("/passenger/name_by_id/<passenger_id>", methods=["GET"])
 def get_passenger_name_by_id(passenger_id):
-    conn = get_connection()
+    conn = read_connection(*user_sticky_keys(passenger_id))
     cursor = conn.cursor(dictionary=True)
     
     try:
@@ -277,7 +664,7 @@ def get_passenger_name_by_id(passenger_id):
             return jsonify({"success": False, "message": "لم يتم العثور على راكب بهذا الرقم أو بياناته ناقصة."}), 404
 
     except Exception as e:
-        print(f"Error fetching passenger name: {e}")
+        log_error("passenger_name_error", e)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         cursor.close()
@@ -285,46 +672,59 @@ def get_passenger_name_by_id(passenger_id):
 
 
 
+@app.route("/passenger/<passenger_id>/priority_card", methods=["GET"])
+@with_principal("employee", required=True)
+def get_priority_card(passenger_id):
+    """صورة بطاقة الأولوية للوحة الموظف؛ ?size=thumbnail يعيد الصورة المصغرة إن كانت جاهزة."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT priority_card_path FROM users WHERE id = %s", (passenger_id,))
+        row = cursor.fetchone()
+    except Exception as e:
+        log_error("priority_card_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+    root = os.path.realpath(priority_cards.root)
+    path = os.path.realpath(row[0]) if row and row[0] else None
+    if not path or not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return jsonify({"success": False, "message": "لا توجد صورة بطاقة أولوية لهذا الراكب"}), 404
+
+    if request.args.get('size') == 'thumbnail':
+        thumbnail = priority_cards.thumbnail_path(path)
+        if os.path.isfile(thumbnail):
+            return send_file(thumbnail, mimetype="image/jpeg", max_age=86400)
+        # لم تُنشأ بعد (أو تخطاها الطابور الممتلئ): تُطلب الآن وتُعاد الصورة الأصلية هذه المرة
+        priority_cards.request_thumbnail(path)
+    return send_file(path, max_age=86400)
+
+
+@app.route("/priority_cards/stats", methods=["GET"])
+def get_priority_card_stats():
+    return jsonify(priority_cards.stats())
+
+
 @app.route("/bookings/active/<passenger_id>", methods=["GET"])
 def get_active_bookings_for_employee(passenger_id):
     conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
     
     try:
-        cursor.execute("SELECT name FROM users WHERE id = %s", (passenger_id,))
-        user = cursor.fetchone()
+        cursor.execute(queries.EMPLOYEE_ACTIVE_BOOKINGS, (passenger_id, passenger_id))
+        rows = cursor.fetchall()
         
-        if not user:
+        if not rows:
             return jsonify({"success": False, "message": "لم يتم العثور على راكب بهذا الرقم.", "bookings": []}), 404
 
-        passenger_name = user['name']
-
-        query = """
-            SELECT *, id_ticket AS id_ticket 
-            FROM tickets
-            WHERE TRIM(LOWER(name)) = TRIM(LOWER(%s))
-            AND paid = 1
-            AND date_ticket_time > NOW()
-            ORDER BY date_ticket_time ASC
-        """
-        
-        cursor.execute(query, (passenger_name,))
-        bookings = cursor.fetchall()
-        
-        for booking in bookings:
-            if isinstance(booking.get('date_ticket_time'), datetime.datetime):
-                booking['date_ticket_time'] = booking['date_ticket_time'].strftime("%Y-%m-%d %H:%M:%S")
-            
-            booking['vip'] = 1 if booking.get('vip') else 0
-            
-            for key in ['line', 'departure_station', 'arrival_station']:
-                if booking.get(key) is not None:
-                    booking[key] = str(booking[key]).strip()
-
-        return jsonify({"success": True, "bookings": bookings})
+        # العمود الأول passenger_id؛ راكب بلا حجوزات يعود بصف واحد تذكرته NULL
+        bookings = [dict(zip(queries.BOOKING_FIELDS, row[1:])) for row in rows if row[1] is not None]
+        return json_body(json_codec.dumps({"success": True, "bookings": bookings}))
 
     except Exception as e:
-        print(f"Error fetching active bookings for employee: {e}")
+        log_error("employee_active_bookings_error", e)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         cursor.close()
@@ -332,34 +732,135 @@ def get_active_bookings_for_employee(passenger_id):
 
 @app.route("/bookings/cancel/<booking_id>", methods=["POST"])
 def cancel_booking(booking_id):
+    if not booking_writer.wait_flushed(booking_id):
+        return server_busy()
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT paid FROM tickets WHERE id_ticket = %s AND paid = 1", (booking_id,))
+        cursor.execute("""
+            SELECT date_ticket_time, line, departure_station, arrival_station, vip, seat_number, user_id, name_key
+            FROM tickets WHERE id_ticket = %s AND paid = 1
+        """, (booking_id,))
         ticket = cursor.fetchone()
 
         if not ticket:
             return jsonify({"success": False, "message": "التذكرة غير موجودة أو تم إلغاؤها بالفعل"}), 404
 
         cursor.execute("UPDATE tickets SET paid = 0 WHERE id_ticket = %s", (booking_id,))
+        cancelled = cursor.rowcount
+        seat_engine.release(cursor, booking_id)
+        seat_segments.release(cursor, booking_id)
+        if cancelled > 0:
+            booking_rollups.cancelled(cursor, [(booking_id, slot_key(*ticket[:5]))])
         conn.commit()
         
-        if cursor.rowcount > 0:
+        if cancelled > 0:
+            sticky_reads.mark(*user_sticky_keys(ticket[6], ticket[7]), *trip_sticky_keys(slot_key(*ticket[:5])))
+            booking_writer.release_seat(slot_key(*ticket[:5]), ticket[5])
+            seat_index.mark_free(slot_key(*ticket[:5]), ticket[5])
+            seat_segments.mark_free(slot_key(*ticket[:5]), ticket[5])
+            ticket_verifier.mark_cancelled(booking_id)
+            ticket_tokens.revoke(booking_id, ticket[0])
             return jsonify({"success": True, "message": "تم إلغاء الحجز بنجاح"})
         else:
             return jsonify({"success": False, "message": "لم يتم العثور على الحجز لإلغائه"}), 404
 
     except Exception as e:
-        print(f"Error cancelling booking: {e}")
+        log_error("cancel_error", e, ticket_id=booking_id)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         cursor.close()
         conn.close()
         
 
+@app.route("/bookings/cancel/batch", methods=["POST"])
+@with_principal("passenger", "employee")
+def cancel_bookings_batch():
+    """إلغاء عدة حجوزات في معاملة واحدة: {"ticket_ids": [...]} أو رحلة كاملة
+    {"time", "line", "departure_station"?, "arrival_station"?} (للموظفين عند سحب القطار)."""
+    data = request.get_json()
+    ticket_ids = data.get("ticket_ids")
+    time_slot = data.get("time")
+    line = data.get("line")
+    departure_station = data.get("departure_station")
+    arrival_station = data.get("arrival_station")
+    principal = g.principal
+
+    if ticket_ids is not None:
+        if not isinstance(ticket_ids, list) or not ticket_ids:
+            return jsonify({"success": False, "message": "لم يتم إرسال أي حجوزات"}), 400
+        if len(ticket_ids) > CANCEL_BATCH_MAX:
+            return jsonify({"success": False, "message": f"الحد الأقصى {CANCEL_BATCH_MAX} حجزاً في الطلب"}), 400
+        try:
+            ticket_ids = [int(ticket_id) for ticket_id in ticket_ids]
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "أرقام الحجوزات غير صالحة"}), 400
+        for ticket_id in ticket_ids:
+            if not booking_writer.wait_flushed(ticket_id):
+                return server_busy()
+        if principal and principal['role'] == 'passenger':
+            # الراكب يلغي حجوزاته فقط؛ التذاكر الأخرى تظهر كأنها غير موجودة
+            query, params = queries.cancellable_by_ids(len(ticket_ids), by_user=True), (*ticket_ids, principal['id'])
+        else:
+            query, params = queries.cancellable_by_ids(len(ticket_ids)), tuple(ticket_ids)
+    elif time_slot and line:
+        # إلغاء رحلة كاملة للموظفين فقط، حتى لو كان AUTH_REQUIRED معطلاً
+        if not principal or principal['role'] != 'employee':
+            return jsonify({"success": False, "message": "غير مصرح لك بهذا الإجراء"}), 403
+        if not booking_writer.drain():
+            return server_busy()
+        key = slot_key(time_slot, line, departure_station or "", arrival_station or "", 0)
+        if departure_station and arrival_station:
+            query, params = queries.CANCELLABLE_BY_SEGMENT, key[:4]
+        else:
+            query, params = queries.CANCELLABLE_BY_SLOT, key[:2]
+    else:
+        return jsonify({"success": False, "message": "يرجى إرسال أرقام الحجوزات أو تفاصيل الرحلة"}), 400
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        tickets = cursor.fetchall()
+
+        cancelled_ids = [ticket[0] for ticket in tickets]
+        if cancelled_ids:
+            placeholders = ", ".join(["%s"] * len(cancelled_ids))
+            cursor.execute("UPDATE tickets SET paid = 0 WHERE id_ticket IN (" + placeholders + ")",
+                           tuple(cancelled_ids))
+            seat_engine.release_many(cursor, cancelled_ids)
+            seat_segments.release_many(cursor, cancelled_ids)
+            booking_rollups.cancelled(cursor, [(ticket[0], slot_key(*ticket[1:6])) for ticket in tickets])
+        conn.commit()
+
+        for ticket in tickets:
+            sticky_reads.mark(*user_sticky_keys(ticket[7], ticket[8]), *trip_sticky_keys(slot_key(*ticket[1:6])))
+            booking_writer.release_seat(slot_key(*ticket[1:6]), ticket[6])
+            seat_index.mark_free(slot_key(*ticket[1:6]), ticket[6])
+            seat_segments.mark_free(slot_key(*ticket[1:6]), ticket[6])
+            ticket_verifier.mark_cancelled(ticket[0])
+            ticket_tokens.revoke(ticket[0], ticket[1])
+
+        if ticket_ids is not None:
+            done = set(cancelled_ids)
+            results = [{"ticket_id": ticket_id, "status": "cancelled" if ticket_id in done else "not_found"}
+                       for ticket_id in ticket_ids]
+        else:
+            results = [{"ticket_id": ticket_id, "status": "cancelled"} for ticket_id in cancelled_ids]
+        return jsonify({"success": True, "cancelled": len(cancelled_ids), "results": results})
+    except Exception as e:
+        log_error("cancel_batch_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
 @app.route("/booking/update/<booking_id>", methods=["POST"])
 def update_booking(booking_id):
     data = request.get_json()
+    if not booking_writer.wait_flushed(booking_id):
+        return server_busy()
     
     line = data.get("line")
     departure_station = data.get("departure_station")
@@ -372,8 +873,13 @@ def update_booking(booking_id):
 
     conn = get_connection()
     cursor = conn.cursor()
+    claimed_seat = None
     try:
-        cursor.execute("SELECT seat_number, vip FROM tickets WHERE id_ticket = %s AND paid = 1", (booking_id,))
+        cursor.execute("""
+            SELECT seat_number, vip, date_ticket_time, line, departure_station, arrival_station, name,
+                   user_id, name_key
+            FROM tickets WHERE id_ticket = %s AND paid = 1
+        """, (booking_id,))
         original_ticket = cursor.fetchone()
         
         if not original_ticket:
@@ -381,18 +887,25 @@ def update_booking(booking_id):
 
         original_seat = original_ticket[0]
         current_vip_value = original_ticket[1]
-        
-        if new_seat_number.strip() != original_seat.strip():
-            cursor.execute("""
-                SELECT COUNT(*) FROM tickets 
-                WHERE date_ticket_time = %s 
-                AND seat_number = %s 
-                AND paid = 1
-                AND vip = %s 
-            """, (time, new_seat_number, current_vip_value))
-            
-            if cursor.fetchone()[0] > 0:
+        new_key = slot_key(time, line, departure_station, arrival_station, current_vip_value)
+        original_key = slot_key(*original_ticket[2:6], current_vip_value)
+
+        if (new_key, str(new_seat_number).strip()) != (original_key, str(original_seat).strip()):
+            # حجز مؤجل مقبول لم يصل إلى MySQL بعد لا تراه seat_claims؛ الدفتر يمنع النقل إلى مقعده
+            if not booking_writer.claim_seat(new_key, new_seat_number):
                 return jsonify({"success": False, "message": f"المقعد {new_seat_number} محجوز بالفعل."}), 409
+            claimed_seat = (new_key, new_seat_number)
+
+        if not seat_engine.move(cursor, booking_id, new_key, new_seat_number):
+            conn.rollback()
+            return jsonify({"success": False, "message": f"المقعد {new_seat_number} محجوز بالفعل."}), 409
+
+        # أجزاء الرحلة القديمة تُحرر أولاً حتى لا تتعارض مع الجديدة على المقعد نفسه
+        seat_segments.release(cursor, booking_id)
+        journey = seat_segments.journey(new_key)
+        if journey is not None and not seat_segments.claim(cursor, journey, new_seat_number, booking_id):
+            conn.rollback()
+            return jsonify({"success": False, "message": f"المقعد {new_seat_number} محجوز في جزء من الرحلة."}), 409
         
         cursor.execute("""
             UPDATE tickets 
@@ -400,18 +913,46 @@ def update_booking(booking_id):
                 line = %s,
                 departure_station = %s,
                 arrival_station = %s,
+                line_key = %s,
+                departure_key = %s,
+                arrival_key = %s,
                 date_ticket_time = %s,
                 seat_number = %s 
             WHERE id_ticket = %s AND paid = 1
-        """, (line, departure_station, arrival_station, time, new_seat_number, booking_id))
+        """, (
+            line, departure_station, arrival_station,
+            new_key[1], new_key[2], new_key[3],
+            time, new_seat_number, booking_id
+        ))
+        booking_rollups.moved(cursor, booking_id, original_key, new_key)
         
         conn.commit()
-        return jsonify({"success": True, "message": "تم التحديث بنجاح."})
+        if claimed_seat:
+            claimed_seat = None
+            booking_writer.release_seat(original_key, original_seat)
+        sticky_reads.mark(*user_sticky_keys(original_ticket[7], original_ticket[8]),
+                          *trip_sticky_keys(original_key), *trip_sticky_keys(new_key))
+        seat_index.mark_free(original_key, original_seat)
+        seat_index.mark_taken(new_key, new_seat_number)
+        seat_segments.mark_free(original_key, original_seat)
+        seat_segments.mark_taken(new_key, new_seat_number)
+        ticket_verifier.record({
+            "id_ticket": booking_id, "name": original_ticket[6], "seat_number": new_seat_number,
+            "date_ticket_time": new_key[0], "paid": 1
+        })
+        ticket_tokens.revoke(booking_id, original_ticket[2])
+        qr_payload = issue_ticket_token(
+            booking_id, original_ticket[6], new_seat_number, new_key, line, departure_station, arrival_station
+        )
+        return jsonify({"success": True, "message": "تم التحديث بنجاح.", "qr_payload": qr_payload})
 
     except Exception as e:
-        print(f"Update error: {e}")
+        log_error("update_error", e, ticket_id=booking_id)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
+        if claimed_seat:
+            # النقل لم يكتمل؛ المقعد الجديد يعود متاحاً للحجز المؤجل
+            booking_writer.release_seat(*claimed_seat)
         cursor.close()
         conn.close()
         
@@ -428,26 +969,15 @@ def get_times():
         interval_minutes = 5
 
     show_all_day = request.args.get('all_day', 'false').lower() == 'true'
-    
-    start_of_day = datetime.datetime(now.year, now.month, now.day, 0, 0, 0)
-    end_of_day = datetime.datetime(now.year, now.month, now.day, 23, 59, 0)
-    
-    current_time = start_of_day
-    times = []
-
-    while current_time <= end_of_day:
-        times.append(current_time.strftime("%Y-%m-%d %H:%M:%S"))
-        current_time += datetime.timedelta(minutes=interval_minutes)
+    line = request.args.get('line')
 
-    if show_all_day:
-        return jsonify(times)
+    times, etag, max_age = timetable.times(now, interval_minutes, line, show_all_day)
 
-    valid_times = [
-        t for t in times
-        if datetime.datetime.strptime(t, "%Y-%m-%d %H:%M:%S") > now - datetime.timedelta(minutes=1)
-    ]
-
-    return jsonify(valid_times)
+    response = jsonify(times)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
 
 
 @app.route("/booked_seats", methods=["POST"])
@@ -457,10 +987,10 @@ def booked_seats():
     if not time_slot:
         return jsonify([]), 200
 
-    conn = get_connection()
+    conn = read_connection(time_sticky_key(normalize_slot(time_slot)))
     cursor = conn.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT seat_number, vip FROM tickets WHERE date_ticket_time = %s AND paid = 1", (time_slot,))
+        cursor.execute(queries.BOOKED_SEATS_BY_TIME, (time_slot,))
         seats = cursor.fetchall()
         
         for seat in seats:
@@ -468,7 +998,7 @@ def booked_seats():
 
         return jsonify(seats)
     except Exception as e:
-        print(f"Error in booked_seats: {e}")
+        log_error("booked_seats_error", e)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         cursor.close()
@@ -490,52 +1020,182 @@ def booked_seats_status():
     if not all([time_slot, line, departure_station, arrival_station]):
         return jsonify({"success": False, "message": "يرجى اختيار جميع تفاصيل الرحلة"}), 400
 
-    conn = get_connection()
+    # 🛑 تم توحيد الفئات: Single=0, Family=1, VIP=2
+    type_mapping = {'SINGLE': 0, 'FAMILY': 1, 'VIP': 2}
+    
+    target_vip_value = type_mapping.get(seat_type.upper(), 0) if seat_type else 0
+
+    if not excluded_ticket_id:
+        try:
+            key = slot_key(time_slot, line, departure_station, arrival_station, target_vip_value)
+            booked_seats_list = with_overlapping_legs(key, seat_index.booked_seats(key, load_booked_seats))
+            return jsonify({"success": True, "booked_seats": booked_seats_list})
+        except Exception as e:
+            log_error("booked_seats_status_error", e)
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    key = slot_key(time_slot, line, departure_station, arrival_station, target_vip_value)
+    conn = read_connection(*trip_sticky_keys(key))
     cursor = conn.cursor(dictionary=True)
     try:
-        # 🛑 تم توحيد الفئات: Single=0, Family=1, VIP=2
-        type_mapping = {'SINGLE': 0, 'FAMILY': 1, 'VIP': 2}
-        
-        target_vip_value = type_mapping.get(seat_type.upper(), 0) if seat_type else 0
-        
-        print(f"DEBUG: Checking Status for: {seat_type} -> Looking for Value: {target_vip_value}")
-
-        query = """
-            SELECT seat_number
-            FROM tickets
-            WHERE date_ticket_time = %s
-            AND TRIM(LOWER(line)) = TRIM(LOWER(%s))
-            AND TRIM(LOWER(departure_station)) = TRIM(LOWER(%s))
-            AND TRIM(LOWER(arrival_station)) = TRIM(LOWER(%s))
-            AND paid = 1
-            AND vip = %s  
-        """
-        
-        params = [time_slot, line, departure_station, arrival_station, target_vip_value]
-        
-        if excluded_ticket_id:
-            query += " AND id_ticket != %s"
-            params.append(excluded_ticket_id)
-
-        cursor.execute(query, tuple(params))
+        cursor.execute(queries.BOOKED_SEATS_EXCLUDING_TICKET, key + (excluded_ticket_id,))
         
         booked_seats_list = [seat['seat_number'] for seat in cursor.fetchall()]
 
+        journey = seat_segments.journey(key)
+        if journey is not None:
+            train, _, first_leg, end_leg = journey
+            cursor.execute(queries.TRAIN_SEATS_EXCLUDING_TICKET,
+                           tuple(train) + (first_leg, end_leg, excluded_ticket_id))
+            listed = set(booked_seats_list)
+            booked_seats_list += [seat['seat_number'] for seat in cursor.fetchall() if seat['seat_number'] not in listed]
+
         return jsonify({"success": True, "booked_seats": booked_seats_list})
     
     except Exception as e:
-        print(f"Error in booked_seats_status: {e}")
+        log_error("booked_seats_status_error", e)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         cursor.close()
         conn.close()
 
 
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route("/seat_events", methods=["GET"])
+def seat_events_stream():
+    """بث Server-Sent Events لرحلة واحدة: المقاعد المحجوزة أولاً ثم التغييرات أولاً بأول
+    (seat-taken / seat-freed)، بدلاً من إعادة طلب /booked_seats/status."""
+    time_slot = request.args.get("time_slot")
+    line = request.args.get("line")
+    departure_station = request.args.get("departure_station")
+    arrival_station = request.args.get("arrival_station")
+    seat_type = request.args.get("seat_type")
+
+    if not all([time_slot, line, departure_station, arrival_station]):
+        return jsonify({"success": False, "message": "يرجى اختيار جميع تفاصيل الرحلة"}), 400
+
+    type_mapping = {'SINGLE': 0, 'FAMILY': 1, 'VIP': 2}
+    key = slot_key(time_slot, line, departure_station, arrival_station,
+                   type_mapping.get(seat_type.upper(), 0) if seat_type else 0)
+
+    try:
+        # الاشتراك قبل قراءة اللقطة حتى لا يضيع تغيير يحدث بينهما
+        subscription = seat_events.subscribe(key)
+    except TooManySubscribersError:
+        response = jsonify({"success": False, "message": "الخادم مشغول حالياً، يرجى المحاولة بعد قليل"})
+        response.headers['Retry-After'] = "5"
+        return response, 503
+
+    def snapshot():
+        return sse("snapshot", {"booked_seats": seat_index.booked_seats(key, load_booked_seats)})
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            yield snapshot()
+            deadline = time.monotonic() + seat_event_stream.STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                item = subscription.next(seat_event_stream.STREAM_HEARTBEAT)
+                if item is None:
+                    yield ": ping\n\n"
+                elif item[0] == seat_event_stream.RESYNC:
+                    yield snapshot()
+                else:
+                    yield sse(item[0], {"seat_number": item[1]})
+        except Exception as e:
+            log_warning("seat_event_stream_ended", slot=list(key), error=str(e))
+        finally:
+            seat_events.unsubscribe(subscription)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/seat_events/stats", methods=["GET"])
+def get_seat_events_stats():
+    return jsonify(seat_events.stats())
+
+
+def book_write_behind(name, passenger_id, time_slot, seat_number, seat_type,
+                      line, departure_station, arrival_station):
+    """وضع الكتابة المؤجلة: يُقبل الحجز من الذاكرة والسجل المحلي، ويكتبه booking_writer لاحقاً على دفعات."""
+    type_mapping = {'SINGLE': 0, 'FAMILY': 1, 'VIP': 2}
+    key = slot_key(time_slot, line, departure_station, arrival_station, type_mapping.get(seat_type.upper(), 0))
+    try:
+        # قرار حجز وليس عرضاً، فلا يُقرأ من نسخة متأخرة
+        seat_taken = str(seat_number).strip() in seat_index.booked_seats(
+            key, functools.partial(load_booked_seats, primary=True))
+        journey = seat_segments.journey(key)
+        if journey is not None and not seat_taken:
+            seat_taken = str(seat_number).strip() in seat_segments.taken(
+                journey, functools.partial(load_train_legs, primary=True))
+        ticket_id = booking_writer.accept(key, seat_number, {
+            "name": name,
+            "user_id": passenger_id,
+            "date_ticket_time": key[0],
+            "date_ticket_find": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "vip": key[4],
+            "paid": 1,
+            "line": line,
+            "departure_station": departure_station,
+            "arrival_station": arrival_station,
+            "name_key": normalize_text(name),
+            "line_key": key[1],
+            "departure_key": key[2],
+            "arrival_key": key[3],
+        }, seat_taken)
+    except WriterUnavailableError:
+        return server_busy()
+    except Exception as e:
+        log_error("book_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    if ticket_id is None:
+        return jsonify({"success": False, "message": "هذا المقعد محجوز مسبقًا."}), 409
+
+    seat_index.mark_taken(key, seat_number)
+    seat_segments.mark_taken(key, seat_number)
+    ticket_verifier.record({
+        "id_ticket": ticket_id, "name": name, "seat_number": seat_number,
+        "date_ticket_time": key[0], "paid": 1
+    })
+    qr_payload = issue_ticket_token(ticket_id, name, seat_number, key, line, departure_station, arrival_station)
+    return jsonify({"success": True, "ticket_id": ticket_id, "qr_payload": qr_payload})
+
+
+def write_behind_conflict(ticket_id):
+    # حجز مؤجل خسر مقعده لعملية أخرى قبل كتابته؛ حُفظ ملغى، فلا تُقبل تذكرته على البوابة
+    ticket_verifier.mark_cancelled(ticket_id)
+    ticket_tokens.revoke(ticket_id, None)
+
+
+def write_behind_written(cursor, rows):
+    # داخل معاملة الدفعة نفسها؛ rows هي التذاكر الجديدة التي احتفظت بمقاعدها فقط.
+    # تُحسب في دقيقة قبول الحجز (date_ticket_find) لا دقيقة كتابة الدفعة، فلا تتكدس الذروة في دقيقة لاحقة
+    by_minute = {}
+    for row in rows:
+        key = (row["date_ticket_time"], row["line_key"], row["departure_key"], row["arrival_key"], row["vip"])
+        by_minute.setdefault(str(row["date_ticket_find"])[:16] + ":00", []).append((row["id_ticket"], key))
+    for minute, tickets in by_minute.items():
+        booking_rollups.booked(cursor, tickets, minute)
+
+
+booking_writer.start(get_connection, on_conflict=write_behind_conflict, on_written=write_behind_written,
+                     journey=seat_segments.journey)
+
+
 @app.route("/book", methods=["POST"])
+@with_principal("passenger", "employee")
 def book():
     data = request.get_json()
 
     name = data.get("name")
+    passenger_id = data.get("passenger_id")
+    if g.principal and g.principal['role'] == 'passenger':
+        passenger_id = g.principal['id']
     time = data.get("time")
     seat_number = data.get("seat_number")
     seat_type = data.get("seat_type")
@@ -543,10 +1203,17 @@ def book():
     line = data.get("line")
     departure_station = data.get("departure_station")
     arrival_station = data.get("arrival_station")
+    hold_token = data.get("hold_token")
 
     if not all([name, time, seat_number, seat_type, line, departure_station, arrival_station]):
         return jsonify({"success": False, "message": "بيانات الحجز ناقصة"}), 400
 
+    if booking_writer.enabled:
+        if hold_token:
+            return write_behind_unsupported()
+        return book_write_behind(name, passenger_id, time, seat_number, seat_type,
+                                 line, departure_station, arrival_station)
+
     conn = get_connection()
     cursor = conn.cursor()
     try:
@@ -554,32 +1221,56 @@ def book():
         type_mapping = {'SINGLE': 0, 'FAMILY': 1, 'VIP': 2}
         
         vip_value = type_mapping.get(seat_type.upper(), 0)
-        
-        print(f"DEBUG: Booking Seat Type: {seat_type} -> Saved Value: {vip_value}")
+
+        key = slot_key(time, line, departure_station, arrival_station, vip_value)
+        if not seat_engine.claim(cursor, key, seat_number, hold_token):
+            conn.rollback()
+            return jsonify({"success": False, "message": "هذا المقعد محجوز مسبقًا."}), 409
 
         cursor.execute("""
             INSERT INTO tickets (
-                name, date_ticket_time, date_ticket_find, 
+                name, user_id, date_ticket_time, date_ticket_find, 
                 seat_number, vip, paid, 
-                line, departure_station, arrival_station
+                line, departure_station, arrival_station,
+                name_key, line_key, departure_key, arrival_key
             )
-            VALUES (%s, %s, NOW(), %s, %s, 1, %s, %s, %s)
+            VALUES (%s, %s, %s, NOW(), %s, %s, 1, %s, %s, %s, %s, %s, %s, %s)
         """, (
             name,
+            passenger_id,
             time,
             seat_number,
             vip_value,
             line,
             departure_station,
-            arrival_station
+            arrival_station,
+            normalize_text(name),
+            key[1],
+            key[2],
+            key[3]
         ))
         
-        conn.commit()
         ticket_id = cursor.lastrowid
-        return jsonify({"success": True, "ticket_id": ticket_id})
+        journey = seat_segments.journey(key)
+        if journey is not None and not seat_segments.claim(cursor, journey, seat_number, ticket_id, hold_token):
+            conn.rollback()
+            return jsonify({"success": False, "message": "هذا المقعد محجوز في جزء من رحلتك."}), 409
+
+        seat_engine.attach(cursor, key, seat_number, ticket_id)
+        booking_rollups.booked(cursor, [(ticket_id, key)])
+        conn.commit()
+        sticky_reads.mark(*user_sticky_keys(passenger_id, normalize_text(name)), *trip_sticky_keys(key))
+        seat_index.mark_taken(key, seat_number)
+        seat_segments.mark_taken(key, seat_number)
+        ticket_verifier.record({
+            "id_ticket": ticket_id, "name": name, "seat_number": seat_number,
+            "date_ticket_time": key[0], "paid": 1
+        })
+        qr_payload = issue_ticket_token(ticket_id, name, seat_number, key, line, departure_station, arrival_station)
+        return jsonify({"success": True, "ticket_id": ticket_id, "qr_payload": qr_payload})
     except Exception as e:
-        print("Book error:", e)
-        if '1062' in str(e):
+        log_error("book_error", e)
+        if isinstance(e, mysql.connector.IntegrityError) and e.errno == 1062:
             return jsonify({"success": False, "message": "هذا المقعد محجوز مسبقًا."}), 409
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
@@ -587,6 +1278,198 @@ def book():
         conn.close()
 
 
+@app.route("/book/batch", methods=["POST"])
+@with_principal("passenger", "employee")
+def book_batch():
+    """حجز عدة مقاعد لرحلة واحدة (عائلة أو مجموعة) في معاملة واحدة: تُحجز كلها أو لا شيء.
+    {"name", "passenger_id", "time", "line", "departure_station", "arrival_station",
+     "seats": [{"seat_number", "seat_type", "name"?, "hold_token"?}, ...]}"""
+    data = request.get_json()
+
+    name = data.get("name")
+    passenger_id = data.get("passenger_id")
+    if g.principal and g.principal['role'] == 'passenger':
+        passenger_id = g.principal['id']
+    time_slot = data.get("time")
+    line = data.get("line")
+    departure_station = data.get("departure_station")
+    arrival_station = data.get("arrival_station")
+    items = data.get("seats")
+
+    if not all([time_slot, line, departure_station, arrival_station]) or not isinstance(items, list) or not items:
+        return jsonify({"success": False, "message": "بيانات الحجز ناقصة"}), 400
+    if len(items) > BOOK_BATCH_MAX:
+        return jsonify({"success": False, "message": f"الحد الأقصى {BOOK_BATCH_MAX} مقعداً في الطلب"}), 400
+    if booking_writer.enabled:
+        return write_behind_unsupported()
+
+    type_mapping = {'SINGLE': 0, 'FAMILY': 1, 'VIP': 2}
+    seats, results, hold_tokens, seen = [], [], {}, set()
+    for item in items:
+        seat_number = str(item.get("seat_number") or "").strip()
+        seat_type = item.get("seat_type")
+        passenger_name = item.get("name") or name
+        result = {"seat_number": seat_number}
+        results.append(result)
+        if not all([seat_number, seat_type, passenger_name]):
+            result["status"] = "invalid"
+            continue
+        key = slot_key(time_slot, line, departure_station, arrival_station, type_mapping.get(seat_type.upper(), 0))
+        if (key, seat_number) in seen:
+            result["status"] = "duplicate"
+            continue
+        seen.add((key, seat_number))
+        seats.append((key, seat_number, passenger_name))
+        if item.get("hold_token"):
+            hold_tokens[(key, seat_number)] = item["hold_token"]
+
+    if len(seats) != len(items):
+        for result in results:
+            result.setdefault("status", "not_booked")
+        return jsonify({"success": False, "message": "بيانات الحجز ناقصة", "results": results}), 400
+
+    pairs = [(key, seat_number) for key, seat_number, _ in seats]
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        if not seat_engine.claim_many(cursor, pairs, hold_tokens):
+            conn.rollback()
+            taken = seat_engine.taken_among(cursor, pairs)
+            for result, pair in zip(results, pairs):
+                result["status"] = "taken" if pair in taken else "not_booked"
+            return jsonify({"success": False, "message": "بعض المقاعد محجوزة مسبقًا.", "results": results}), 409
+
+        params = ()
+        for key, seat_number, passenger_name in seats:
+            params += (
+                passenger_name, passenger_id, time_slot, seat_number, key[4],
+                line, departure_station, arrival_station,
+                normalize_text(passenger_name), key[1], key[2], key[3]
+            )
+        cursor.execute(queries.insert_tickets(len(seats)), params)
+        ticket_ids = seat_engine.attach_many(cursor, pairs, cursor.lastrowid)
+
+        journey = seat_segments.journey(pairs[0][0])
+        if journey is not None:
+            overlapping = set()
+            for key, seat_number in pairs:
+                # الفئات تختلف بين المقاعد (vip جزء من مفتاح القطار)
+                if not seat_segments.claim(cursor, seat_segments.journey(key), seat_number,
+                                           ticket_ids[(key, seat_number)], hold_tokens.get((key, seat_number))):
+                    overlapping.add((key, seat_number))
+            if overlapping:
+                conn.rollback()
+                for result, pair in zip(results, pairs):
+                    result["status"] = "taken" if pair in overlapping else "not_booked"
+                return jsonify({"success": False, "message": "بعض المقاعد محجوزة في جزء من الرحلة.",
+                                "results": results}), 409
+        booking_rollups.booked(cursor, [(ticket_ids[pair], pair[0]) for pair in pairs])
+        conn.commit()
+        written = set(user_sticky_keys(passenger_id))
+        for key, _, passenger_name in seats:
+            written.update(user_sticky_keys(name_key=normalize_text(passenger_name)), trip_sticky_keys(key))
+        sticky_reads.mark(*written)
+
+        for result, (key, seat_number, passenger_name) in zip(results, seats):
+            ticket_id = ticket_ids[(key, seat_number)]
+            seat_index.mark_taken(key, seat_number)
+            seat_segments.mark_taken(key, seat_number)
+            ticket_verifier.record({
+                "id_ticket": ticket_id, "name": passenger_name, "seat_number": seat_number,
+                "date_ticket_time": key[0], "paid": 1
+            })
+            result.update({
+                "status": "booked",
+                "ticket_id": ticket_id,
+                "qr_payload": issue_ticket_token(ticket_id, passenger_name, seat_number, key,
+                                                 line, departure_station, arrival_station),
+            })
+        return jsonify({"success": True, "results": results})
+    except Exception as e:
+        log_error("book_batch_error", e)
+        if isinstance(e, mysql.connector.IntegrityError) and e.errno == 1062:
+            return jsonify({"success": False, "message": "بعض المقاعد محجوزة مسبقًا."}), 409
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@app.route("/booking_writer/stats", methods=["GET"])
+def get_booking_writer_stats():
+    return jsonify(booking_writer.stats())
+
+
+@app.route("/seat_hold", methods=["POST"])
+def hold_seat():
+    data = request.get_json()
+
+    time = data.get("time")
+    seat_number = data.get("seat_number")
+    seat_type = data.get("seat_type")
+    line = data.get("line")
+    departure_station = data.get("departure_station")
+    arrival_station = data.get("arrival_station")
+
+    if not all([time, seat_number, seat_type, line, departure_station, arrival_station]):
+        return jsonify({"success": False, "message": "بيانات الحجز ناقصة"}), 400
+    if booking_writer.enabled:
+        return write_behind_unsupported()
+
+    type_mapping = {'SINGLE': 0, 'FAMILY': 1, 'VIP': 2}
+    key = slot_key(time, line, departure_station, arrival_station, type_mapping.get(seat_type.upper(), 0))
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        hold_token = seat_engine.hold(cursor, key, seat_number)
+        if not hold_token:
+            conn.rollback()
+            return jsonify({"success": False, "message": "هذا المقعد محجوز مسبقًا."}), 409
+        journey = seat_segments.journey(key)
+        if journey is not None and not seat_segments.hold(cursor, journey, seat_number, hold_token,
+                                                          seat_engine.hold_seconds):
+            conn.rollback()
+            return jsonify({"success": False, "message": "هذا المقعد محجوز في جزء من رحلتك."}), 409
+        conn.commit()
+
+        seat_index.mark_taken(key, seat_number)
+        seat_segments.mark_taken(key, seat_number)
+        return jsonify({"success": True, "hold_token": hold_token, "expires_in": seat_engine.hold_seconds})
+    except Exception as e:
+        log_error("seat_hold_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@app.route("/seat_hold/release", methods=["POST"])
+def release_seat_hold():
+    data = request.get_json()
+    hold_token = data.get("hold_token")
+
+    if not hold_token:
+        return jsonify({"success": False, "message": "Missing hold_token"}), 400
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        released = seat_engine.release_hold(cursor, hold_token)
+        seat_segments.release_hold(cursor, hold_token)
+        conn.commit()
+        if released:
+            seat_index.mark_free(slot_key(*released[:5]), released[5])
+            seat_segments.mark_free(slot_key(*released[:5]), released[5])
+        return jsonify({"success": True})
+    except Exception as e:
+        log_error("seat_hold_release_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
 @app.route("/pay", methods=["POST"])
 def pay():
     data = request.get_json()
@@ -599,85 +1482,175 @@ def pay():
 
 
 
-@app.route("/active_bookings", methods=["GET"])
-def get_active_bookings():
+def parse_history_page():
+    """قراءة ?after=<date_ticket_time,id_ticket>&limit= ؛ ترفع ValueError عند صيغة غير صالحة."""
+    after = request.args.get('after')
+    limit = request.args.get('limit')
+
+    if after:
+        after_time, after_id = after.rsplit(',', 1)
+        after_time = datetime.datetime.strptime(after_time.strip(), "%Y-%m-%d %H:%M:%S")
+        after = (after_time, after_time, int(after_id))
+    if limit:
+        limit = min(max(int(limit), 1), 500)
+    return after or None, limit or None
+
+
+BOOKING_TIME_COLUMN = queries.BOOKING_FIELDS.index("date_ticket_time")
+BOOKING_ID_COLUMN = queries.BOOKING_FIELDS.index("id_ticket")
+
+
+def next_page_cursor(row):
+    """Cursor for the page after `row`, a tuple in queries.BOOKING_FIELDS order."""
+    return f"{row[BOOKING_TIME_COLUMN]},{row[BOOKING_ID_COLUMN]}"
+
+
+def json_body(body, status=200):
+    """Response for bytes already encoded by json_codec (bypasses jsonify)."""
+    return Response(body, status=status, mimetype="application/json")
+
+
+def cursor_rows(cursor, size=500):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+def stream_booking_history(query, params, limit, archived=None, sticky_keys=()):
+    """يُرسل الحجوزات بصيغة NDJSON أثناء قراءتها من المؤشر، فتبقى الذاكرة ثابتة مهما طال السجل.
+    archived: حجوزات الأرشيف (الأحدث أولاً) تُدمج مع صفوف MySQL بالترتيب.
+    عند الوصول إلى limit يكون السطر الأخير {"next_after": ...}."""
+    conn = read_connection(*sticky_keys)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        rows = cursor_rows(cursor)
+        if archived is not None:
+            rows = merge_newest_first(rows, archived, limit)
+        count = 0
+        last = None
+        for row in rows:
+            count += 1
+            yield json_codec.dumps(dict(zip(queries.BOOKING_FIELDS, row))) + b"\n"
+            last = row
+        if limit and count == limit:
+            yield json_codec.dumps({"next_after": next_page_cursor(last)}) + b"\n"
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def archived_history(passenger_id, passenger_name, after, limit):
+    """حجوزات الراكب في ticket_archive، بنفس ترتيب سجل الحجوزات المكتملة ومؤشر صفحته."""
+    after = (after[0].strftime("%Y-%m-%d %H:%M:%S"), after[2]) if after else None
+    if passenger_id:
+        try:
+            passenger_id = int(passenger_id)
+        except ValueError:
+            return iter(())
+        return ticket_archive.history(user_id=passenger_id, after=after, limit=limit)
+    return ticket_archive.history(name_key=normalize_text(passenger_name), after=after, limit=limit)
+
+
+def booking_history(where_by_user, where_by_name, descending, error_event, archived=False):
+    """archived: يدمج ticket_archive مع tickets (للسجل المكتمل فقط، الأحدث أولاً)."""
+    passenger_id = request.args.get('passenger_id')
     passenger_name = request.args.get('passenger_name')
-    if not passenger_name:
+    if g.principal and g.principal['role'] == 'passenger':
+        # الراكب المسجل يرى حجوزاته فقط، مهما كانت معاملات الطلب
+        passenger_id = g.principal['id']
+    if not passenger_id and not passenger_name:
         return jsonify({"success": False, "message": "Passenger name not provided"}), 400
 
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
     try:
-        query = """
-            SELECT *, id_ticket AS ticketId FROM tickets
-            WHERE TRIM(LOWER(name)) = TRIM(LOWER(%s))
-            AND paid = 1
-            AND date_ticket_time > NOW()
-            ORDER BY date_ticket_time ASC
-        """
-        cursor.execute(query, (passenger_name,))
-        bookings = cursor.fetchall()
-
-        for booking in bookings:
-            if isinstance(booking.get('date_ticket_time'), datetime.datetime):
-                booking['date_ticket_time'] = booking['date_ticket_time'].strftime("%Y-%m-%d %H:%M:%S")
-            if isinstance(booking.get('date_ticket_find'), datetime.datetime):
-                booking['date_ticket_find'] = booking['date_ticket_find'].strftime("%Y-%m-%d %H:%M:%S")
-            
-            booking['vip'] = 1 if booking.get('vip') else 0
-            booking['line'] = str(booking['line']).strip()
-            booking['departure_station'] = str(booking['departure_station']).strip()
-            booking['arrival_station'] = str(booking['arrival_station']).strip()
-
-
-        return jsonify(bookings)
+        after, limit = parse_history_page()
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid after/limit"}), 400
+
+    if passenger_id:
+        query = queries.booking_history(where_by_user, descending, after is not None, limit is not None)
+        params = [passenger_id]
+        sticky_keys = user_sticky_keys(passenger_id)
+    else:
+        query = queries.booking_history(where_by_name, descending, after is not None, limit is not None)
+        params = [normalize_text(passenger_name)]
+        sticky_keys = user_sticky_keys(name_key=normalize_text(passenger_name))
+    if after:
+        params.extend(after)
+    if limit:
+        params.append(limit)
+
+    archived_rows = archived_history(passenger_id, passenger_name, after, limit) if archived else None
+
+    if request.args.get('format') == 'ndjson':
+        return Response(stream_with_context(stream_booking_history(query, tuple(params), limit, archived_rows,
+                                                                       sticky_keys)),
+                        mimetype="application/x-ndjson")
+
+    conn = read_connection(*sticky_keys)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
+        if archived_rows is not None:
+            rows = list(merge_newest_first(rows, archived_rows, limit))
+
+        response = json_body(json_codec.rows(queries.BOOKING_FIELDS, rows))
+        if limit and len(rows) == limit:
+            response.headers['X-Next-After'] = next_page_cursor(rows[-1])
+        return response
     except Exception as e:
-        print("Active bookings error:", e)
+        log_error(error_event, e)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         cursor.close()
         conn.close()
 
 
+@app.route("/active_bookings", methods=["GET"])
+@with_principal("passenger", "employee")
+def get_active_bookings():
+    return booking_history(queries.ACTIVE_BY_USER, queries.ACTIVE_BY_NAME, False, "active_bookings_error")
+
+
 @app.route("/completed_bookings", methods=["GET"])
+@with_principal("passenger", "employee")
 def get_completed_bookings():
-    passenger_name = request.args.get('passenger_name')
-    if not passenger_name:
-        return jsonify({"success": False, "message": "Passenger name not provided"}), 400
+    return booking_history(queries.COMPLETED_BY_USER, queries.COMPLETED_BY_NAME, True, "completed_bookings_error",
+                           archived=True)
+
 
+@app.route("/ticket_archive/stats", methods=["GET"])
+def get_ticket_archive_stats():
+    return jsonify(ticket_archive.stats())
+
+
+def load_ticket(ticket_id):
     conn = get_connection()
     cursor = conn.cursor(dictionary=True)
     try:
-        query = """
-            SELECT *, id_ticket AS ticketId FROM tickets
-            WHERE TRIM(LOWER(name)) = TRIM(LOWER(%s))
-            AND (paid = 0 OR date_ticket_time <= NOW())
-            ORDER BY date_ticket_time DESC
-        """
-        cursor.execute(query, (passenger_name,))
-        bookings = cursor.fetchall()
-
-        for booking in bookings:
-            if isinstance(booking.get('date_ticket_time'), datetime.datetime):
-                booking['date_ticket_time'] = booking['date_ticket_time'].strftime("%Y-%m-%d %H:%M:%S")
-            if isinstance(booking.get('date_ticket_find'), datetime.datetime):
-                booking['date_ticket_find'] = booking['date_ticket_find'].strftime("%Y-%m-%d %H:%M:%S")
-
-            booking['vip'] = 1 if booking.get('vip') else 0
-            booking['line'] = str(booking['line']).strip()
-            booking['departure_station'] = str(booking['departure_station']).strip()
-            booking['arrival_station'] = str(booking['arrival_station']).strip()
-
-        return jsonify(bookings)
-    except Exception as e:
-        print("Completed bookings error:", e)
-        return jsonify({"success": False, "message": str(e)}), 500
+        cursor.execute(queries.VERIFY_TICKET, (ticket_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def load_ticket_window(start, end, after_id):
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(queries.VERIFY_TICKET_WINDOW, (start, end, after_id))
+        return cursor.fetchall()
     finally:
         cursor.close()
         conn.close()
 
 
 @app.route("/verify_ticket", methods=["POST"])
+@with_principal("employee")
 def verify_ticket():
     data = request.get_json()
     ticket_id = data.get("ticket_id")
@@ -685,56 +1658,154 @@ def verify_ticket():
     if not ticket_id:
         return jsonify({"valid": False, "message": "لم يتم إرسال رقم التذكرة"}), 400
 
+    # التحديث في خيط خلفي لكل عامل؛ المسح يقرأ الخريطة فقط
+    ticket_verifier.start(load_ticket_window)
+    try:
+        body, status = ticket_verifier.verify(ticket_id, load_ticket)
+        return jsonify(body), status
+    except Exception as e:
+        log_error("verify_ticket_error", e)
+        return jsonify({"valid": False, "message": str(e)}), 500
+
+
+@app.route("/verify_tickets", methods=["POST"])
+@with_principal("employee")
+def verify_tickets():
+    """تحقق دفعي لأجهزة البوابات التي ترفع عمليات المسح المخزنة بعد عودة الاتصال.
+    كل عنصر: {"ticket_id": ..., "scanned_at": "YYYY-MM-DD HH:MM:SS"} ويُقيَّم وقت المسح لا وقت الرفع."""
+    data = request.get_json()
+    scans = data.get("scans")
+
+    if not isinstance(scans, list) or not scans:
+        return jsonify({"success": False, "message": "لم يتم إرسال أي عمليات مسح"}), 400
+    if len(scans) > 1000:
+        return jsonify({"success": False, "message": "الحد الأقصى 1000 عملية مسح في الطلب"}), 400
+
+    ticket_verifier.start(load_ticket_window)
+    results = []
+    for scan in scans:
+        ticket_id = scan.get("ticket_id") if isinstance(scan, dict) else None
+        if not ticket_id:
+            results.append({"ticket_id": ticket_id, "status": 400, "valid": False, "message": "لم يتم إرسال رقم التذكرة"})
+            continue
+
+        scanned_at = None
+        if scan.get("scanned_at"):
+            try:
+                scanned_at = datetime.datetime.strptime(scan["scanned_at"].strip(), "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                results.append({"ticket_id": ticket_id, "status": 400, "valid": False, "message": "صيغة وقت المسح غير صالحة"})
+                continue
+
+        try:
+            body, status = ticket_verifier.verify(ticket_id, load_ticket, scanned_at)
+        except Exception as e:
+            log_error("verify_ticket_error", e)
+            body, status = {"valid": False, "message": str(e)}, 500
+        results.append({"ticket_id": ticket_id, "status": status, **body})
+
+    return jsonify({"success": True, "results": results})
+
+
+def parse_analytics_range(default_span):
+    """?from=&to= بصيغة "YYYY-MM-DD HH:MM:SS" أو ?date=YYYY-MM-DD ليوم كامل؛ الافتراضي آخر default_span،
+    أو اليوم كاملاً إن كان default_span = None."""
+    date = request.args.get('date')
+    if not date and default_span is None and not request.args.get('from'):
+        date = datetime.date.today().isoformat()
+        default_span = datetime.timedelta(days=1)
+    if date:
+        start = datetime.datetime.strptime(date.strip(), "%Y-%m-%d")
+        return start, start + datetime.timedelta(days=1)
+    end = request.args.get('to')
+    end = datetime.datetime.strptime(end.strip(), "%Y-%m-%d %H:%M:%S") if end else datetime.datetime.now()
+    start = request.args.get('from')
+    start = datetime.datetime.strptime(start.strip(), "%Y-%m-%d %H:%M:%S") if start else end - default_span
+    return start, end
+
+
+def analytics_response(read, default_span, *args):
+    try:
+        start, end = parse_analytics_range(default_span)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid date range"}), 400
     conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT * FROM tickets WHERE id_ticket = %s", (ticket_id,))
-        ticket = cursor.fetchone()
+        result = read(cursor, start, end, *args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        log_error("analytics_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+    return jsonify({"success": True, "from": start.strftime("%Y-%m-%d %H:%M:%S"),
+                    "to": end.strftime("%Y-%m-%d %H:%M:%S"), "data": result})
 
-        if not ticket:
-            return jsonify({"valid": False, "message": "التذكرة غير موجودة"}), 404
 
-        if ticket["paid"] != 1:
-            return jsonify({"valid": False, "message": "التذكرة غير مدفوعة (ملغاة أو لم تكتمل)"}), 400
+@app.route("/analytics/occupancy", methods=["GET"])
+@with_principal("employee", required=True)
+def get_occupancy():
+    """الإشغال لكل رحلة وفئة؛ الافتراضي رحلات اليوم. ?line= لمسار واحد."""
+    return analytics_response(booking_rollups.occupancy, None,
+                              normalize_text(request.args.get('line')) or None)
 
-        now = datetime.datetime.now()
-        booking_time = ticket["date_ticket_time"]
 
-        one_hour = datetime.timedelta(hours=1)
-        valid_start = booking_time - one_hour
-        valid_end = booking_time + one_hour
+@app.route("/analytics/bookings_per_minute", methods=["GET"])
+@with_principal("employee", required=True)
+def get_bookings_per_minute():
+    return analytics_response(booking_rollups.per_minute, datetime.timedelta(hours=1),
+                              normalize_text(request.args.get('line')) or None)
 
-        if now >= valid_start and now <= valid_end:
-            return jsonify({
-                "valid": True,
-                "message": "التذكرة صالحة ومطابقة للوقت",
-                "details": {
-                    "name": ticket['name'],
-                    "seat": ticket['seat_number'],
-                    "time": booking_time.strftime("%Y-%m-%d %H:%M:%S")
-                }
-            }), 200
 
-        elif now > valid_end:
-            return jsonify({"valid": False, "message": "التذكرة منتهية الصلاحية (تجاوزت وقت الحجز بساعة)"}), 400
+@app.route("/analytics/cancellation_rates", methods=["GET"])
+@with_principal("employee", required=True)
+def get_cancellation_rates():
+    return analytics_response(booking_rollups.cancellation_rates, datetime.timedelta(days=1))
 
-        elif now < valid_start:
-            return jsonify({"valid": False, "message": "التذكرة سابقة لأوانها (قبل ساعة من موعدها)"}), 400
 
-        else:
-            return jsonify({"valid": False, "message": "خطأ غير متوقع في التحقق من الصلاحية"}), 500
+@app.route("/analytics/stats", methods=["GET"])
+def get_analytics_stats():
+    return jsonify(booking_rollups.stats())
 
-    except Exception as e:
-        print("Verify ticket error:", e)
-        return jsonify({"valid": False, "message": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+
+@app.route("/ticket_verifier/stats", methods=["GET"])
+def get_ticket_verifier_stats():
+    return jsonify(ticket_verifier.stats())
+
+
+@app.route("/profiles/slowest", methods=["GET"])
+@with_principal("employee", required=True)
+def get_slowest_profiles():
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid limit"}), 400
+    return jsonify({
+        "profiler": request_profiler.stats(),
+        "requests": request_profiler.slowest(limit, request.args.get('route')),
+    })
+
+
+@app.route("/profiles/<filename>", methods=["GET"])
+@with_principal("employee", required=True)
+def get_profile_file(filename):
+    path = request_profiler.file_path(filename)
+    if path is None:
+        return jsonify({"success": False, "message": "Profile not found"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=filename)
 
 if __name__ == "__main__":
-    if check_db_connection():
-        app.run(host="0.0.0.0", port=5000, debug=True)
+    # خادم التطوير فقط؛ للتشغيل الفعلي استخدم: gunicorn -c gunicorn.conf.py wsgi:app
+    ready, error = database_ready()
+    if ready:
+        print("✅ نجح الاتصال بقاعدة البيانات!")
+        # FLASK_DEBUG=true يشغّل مصحح Werkzeug ويقبل مفاتيح التوقيع المدمجة؛ الافتراضي معطل (signing.debug_mode)
+        app.run(host="0.0.0.0", port=5000, debug=debug_mode())
     else:
+        print(f"❌ فشل الاتصال بقاعدة البيانات عند بدء التشغيل: {error}")
         print("="*50)
         print("❌ لم يتم تشغيل الخادم بسبب فشل الاتصال بقاعدة البيانات.")
         print("يرجى مراجعة إعدادات الاتصال في 'db_config.py'.")
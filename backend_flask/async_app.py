@@ -0,0 +1,265 @@
+import datetime
+import functools
+import os
+
+import pymysql
+from quart import Quart, g, request, jsonify
+from quart_cors import cors
+
+import async_db
+import queries
+from booking_rollups import booking_rollups
+from booking_writer import WRITER_SETTINGS
+from event_log import log_error
+from seat_engine import seat_engine
+from seat_events import seat_events
+from seat_index import seat_index, slot_key, normalize_text
+from seat_segments import seat_segments
+from session_tokens import session_tokens
+from ticket_tokens import issue_ticket_token
+from ticket_verifier import ticket_verifier, verification_result
+
+# نسخة asyncio من المسارات الساخنة (خريطة المقاعد، الحجز، التحقق من التذاكر).
+# تعيد نفس أشكال الاستجابة التي يعيدها app.py، وتعمل كعملية مستقلة:
+#   hypercorn async_app:app --bind 0.0.0.0:5001
+# الطلب المنتظر لقاعدة البيانات لا يحجز خيطاً، فتخدم عملية واحدة آلاف الطلبات المتزامنة.
+
+app = cors(Quart(__name__))
+
+# حجوزات هذه العملية تُنشر لمشتركي البث في العمال الآخرين عبر الوسيط (إن وُجد)
+seat_events.attach(seat_index)
+
+AUTH_REQUIRED = os.environ.get("AUTH_REQUIRED", "false").lower() == "true"
+
+type_mapping = {'SINGLE': 0, 'FAMILY': 1, 'VIP': 2}
+
+
+@app.before_serving
+async def startup():
+    # خريطة التحقق تُحدَّث في مهمة خلفية؛ /verify_ticket لا ينتظر إعادة تحميلها
+    ticket_verifier.start_async(load_ticket_window)
+
+
+@app.after_serving
+async def shutdown():
+    await async_db.close_pool()
+
+
+def with_principal(*roles):
+    """نفس with_principal في app.py: الهوية من رمز Bearer في الذاكرة دون قاعدة البيانات."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            g.principal = None
+            header = request.headers.get('Authorization', '')
+            if header.startswith('Bearer '):
+                principal = session_tokens.authenticate(header[7:].strip())
+                if principal is None:
+                    return jsonify({"success": False, "message": "انتهت الجلسة، يرجى تسجيل الدخول من جديد"}), 401
+                if roles and principal['role'] not in roles:
+                    return jsonify({"success": False, "message": "غير مصرح لك بهذا الإجراء"}), 403
+                g.principal = principal
+            elif AUTH_REQUIRED:
+                return jsonify({"success": False, "message": "يرجى تسجيل الدخول"}), 401
+            return await view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def load_booked_seats(key):
+    async with async_db.connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(queries.SLOT_SEAT_CLAIMS, tuple(key))
+            return [row[0] for row in await cursor.fetchall()]
+
+
+async def load_train_legs(train):
+    async with async_db.connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(queries.TRAIN_LEG_CLAIMS, tuple(train))
+            return await cursor.fetchall()
+
+
+async def load_ticket(ticket_id):
+    async with async_db.connection() as conn:
+        async with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            await cursor.execute(queries.VERIFY_TICKET, (ticket_id,))
+            return await cursor.fetchone()
+
+
+async def load_ticket_window(start, end, after_id):
+    async with async_db.connection() as conn:
+        async with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            await cursor.execute(queries.VERIFY_TICKET_WINDOW, (start, end, after_id))
+            return await cursor.fetchall()
+
+
+@app.route("/async/stats", methods=["GET"])
+async def get_async_stats():
+    return jsonify({
+        "pool": async_db.pool_stats(),
+        "seat_index": seat_index.stats(),
+        "seat_engine": seat_engine.stats(),
+        "seat_segments": seat_segments.stats(),
+        "ticket_verifier": ticket_verifier.stats(),
+    })
+
+
+@app.route("/booked_seats", methods=["POST"])
+async def booked_seats():
+    data = await request.get_json()
+    time_slot = data.get("time_slot")
+    if not time_slot:
+        return jsonify([]), 200
+
+    try:
+        async with async_db.connection() as conn:
+            async with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+                await cursor.execute(queries.BOOKED_SEATS_BY_TIME, (time_slot,))
+                seats = await cursor.fetchall()
+
+        for seat in seats:
+            seat['vip'] = 1 if seat.get('vip') else 0
+
+        return jsonify(seats)
+    except Exception as e:
+        log_error("booked_seats_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route("/booked_seats/status", methods=["POST"])
+async def booked_seats_status():
+    data = await request.get_json()
+    time_slot = data.get("time_slot")
+    line = data.get("line")
+    departure_station = data.get("departure_station")
+    arrival_station = data.get("arrival_station")
+    seat_type = data.get("seat_type")
+
+    excluded_ticket_id = request.args.get('exclude_ticket_id')
+
+    if not all([time_slot, line, departure_station, arrival_station]):
+        return jsonify({"success": False, "message": "يرجى اختيار جميع تفاصيل الرحلة"}), 400
+
+    target_vip_value = type_mapping.get(seat_type.upper(), 0) if seat_type else 0
+    key = slot_key(time_slot, line, departure_station, arrival_station, target_vip_value)
+
+    try:
+        if not excluded_ticket_id:
+            booked_seats_list = await seat_index.booked_seats_async(key, load_booked_seats)
+            journey = seat_segments.journey(key)
+            if journey is not None:
+                listed = set(booked_seats_list)
+                booked_seats_list = booked_seats_list + [
+                    seat for seat in await seat_segments.taken_async(journey, load_train_legs) if seat not in listed
+                ]
+        else:
+            async with async_db.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(queries.BOOKED_SEATS_EXCLUDING_TICKET, key + (excluded_ticket_id,))
+                    booked_seats_list = [row[0] for row in await cursor.fetchall()]
+                    journey = seat_segments.journey(key)
+                    if journey is not None:
+                        train, _, first_leg, end_leg = journey
+                        await cursor.execute(queries.TRAIN_SEATS_EXCLUDING_TICKET,
+                                             tuple(train) + (first_leg, end_leg, excluded_ticket_id))
+                        listed = set(booked_seats_list)
+                        booked_seats_list += [row[0] for row in await cursor.fetchall() if row[0] not in listed]
+        return jsonify({"success": True, "booked_seats": booked_seats_list})
+    except Exception as e:
+        log_error("booked_seats_status_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route("/book", methods=["POST"])
+@with_principal("passenger", "employee")
+async def book():
+    data = await request.get_json()
+
+    name = data.get("name")
+    passenger_id = data.get("passenger_id")
+    if g.principal and g.principal['role'] == 'passenger':
+        passenger_id = g.principal['id']
+    time = data.get("time")
+    seat_number = data.get("seat_number")
+    seat_type = data.get("seat_type")
+
+    line = data.get("line")
+    departure_station = data.get("departure_station")
+    arrival_station = data.get("arrival_station")
+    hold_token = data.get("hold_token")
+
+    if not all([name, time, seat_number, seat_type, line, departure_station, arrival_station]):
+        return jsonify({"success": False, "message": "بيانات الحجز ناقصة"}), 400
+    if WRITER_SETTINGS["enabled"]:
+        # دفتر الحجز المؤجل وتسلسل أرقامه في عملية app.py؛ حجز مباشر من هنا لا يراه أيٌّ منهما
+        return jsonify({"success": False, "message": "هذه العملية غير متاحة في وضع الحجز المؤجل"}), 503
+
+    vip_value = type_mapping.get(seat_type.upper(), 0)
+    key = slot_key(time, line, departure_station, arrival_station, vip_value)
+
+    try:
+        async with async_db.connection() as conn:
+            async with conn.cursor() as cursor:
+                if not await seat_engine.claim_async(cursor, key, seat_number, hold_token):
+                    return jsonify({"success": False, "message": "هذا المقعد محجوز مسبقًا."}), 409
+
+                await cursor.execute("""
+                    INSERT INTO tickets (
+                        name, user_id, date_ticket_time, date_ticket_find,
+                        seat_number, vip, paid,
+                        line, departure_station, arrival_station,
+                        name_key, line_key, departure_key, arrival_key
+                    )
+                    VALUES (%s, %s, %s, NOW(), %s, %s, 1, %s, %s, %s, %s, %s, %s, %s)
+                """, (
+                    name, passenger_id, time, seat_number, vip_value,
+                    line, departure_station, arrival_station,
+                    normalize_text(name), key[1], key[2], key[3]
+                ))
+
+                ticket_id = cursor.lastrowid
+                journey = seat_segments.journey(key)
+                if journey is not None and not await seat_segments.claim_async(cursor, journey, seat_number, ticket_id,
+                                                                               hold_token):
+                    await conn.rollback()
+                    return jsonify({"success": False, "message": "هذا المقعد محجوز في جزء من رحلتك."}), 409
+
+                await seat_engine.attach_async(cursor, key, seat_number, ticket_id)
+                await booking_rollups.booked_async(cursor, [(ticket_id, key)])
+            await conn.commit()
+
+        seat_index.mark_taken(key, seat_number)
+        seat_segments.mark_taken(key, seat_number)
+        ticket_verifier.record({
+            "id_ticket": ticket_id, "name": name, "seat_number": seat_number,
+            "date_ticket_time": key[0], "paid": 1
+        })
+        qr_payload = issue_ticket_token(ticket_id, name, seat_number, key, line, departure_station, arrival_station)
+        return jsonify({"success": True, "ticket_id": ticket_id, "qr_payload": qr_payload})
+    except Exception as e:
+        if isinstance(e, pymysql.err.IntegrityError) and e.args[0] == 1062:
+            return jsonify({"success": False, "message": "هذا المقعد محجوز مسبقًا."}), 409
+        log_error("book_error", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route("/verify_ticket", methods=["POST"])
+@with_principal("employee")
+async def verify_ticket():
+    data = await request.get_json()
+    ticket_id = data.get("ticket_id")
+
+    if not ticket_id:
+        return jsonify({"valid": False, "message": "لم يتم إرسال رقم التذكرة"}), 400
+
+    try:
+        at = datetime.datetime.now()
+        result = ticket_verifier.verify_cached(ticket_id, at)
+        if result is None:
+            result = verification_result(await load_ticket(str(ticket_id).strip()), at)
+        body, status = result
+        return jsonify(body), status
+    except Exception as e:
+        log_error("verify_ticket_error", e)
+        return jsonify({"valid": False, "message": str(e)}), 500
@@ -0,0 +1,73 @@
+import asyncio
+import contextlib
+import os
+
+import aiomysql
+
+from db_config import DB_SETTINGS, PoolTimeoutError
+
+# تجمع اتصالات غير متزامن لنسخة asyncio من الخادم (async_app.py)
+ASYNC_POOL_SETTINGS = {
+    "minsize": int(os.environ.get("DB_ASYNC_POOL_MIN", 5)),
+    "maxsize": int(os.environ.get("DB_ASYNC_POOL_MAX", 50)),
+    "timeout": float(os.environ.get("DB_POOL_TIMEOUT", 5)),
+    "recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+}
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await aiomysql.create_pool(
+                    host=DB_SETTINGS["host"],
+                    port=DB_SETTINGS["port"],
+                    user=DB_SETTINGS["user"],
+                    password=DB_SETTINGS["password"],
+                    db=DB_SETTINGS["database"],
+                    minsize=ASYNC_POOL_SETTINGS["minsize"],
+                    maxsize=ASYNC_POOL_SETTINGS["maxsize"],
+                    pool_recycle=ASYNC_POOL_SETTINGS["recycle"],
+                    autocommit=False,
+                )
+    return _pool
+
+
+@contextlib.asynccontextmanager
+async def connection():
+    """Borrow a connection; waiting longer than the pool timeout raises PoolTimeoutError.
+
+    Anything left uncommitted is rolled back before the connection goes back.
+    """
+    pool = await get_pool()
+    try:
+        conn = await asyncio.wait_for(pool.acquire(), ASYNC_POOL_SETTINGS["timeout"])
+    except asyncio.TimeoutError:
+        raise PoolTimeoutError("Timed out waiting for a database connection")
+    try:
+        yield conn
+    finally:
+        try:
+            if conn.get_transaction_status():
+                await conn.rollback()
+        except Exception:
+            conn.close()
+        pool.release(conn)
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+
+def pool_stats():
+    if _pool is None:
+        return {"size": 0, "free": 0, "maxsize": ASYNC_POOL_SETTINGS["maxsize"]}
+    return {"size": _pool.size, "free": _pool.freesize, "maxsize": _pool.maxsize}
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import json
+import time
+import urllib.parse
+
+from loadtest import percentile
+
+# مقارنة جنباً إلى جنب بين الخادم المتزامن (app.py) ونسخة asyncio (async_app.py).
+# العميل نفسه مبني على asyncio حتى يستطيع فتح آلاف الاتصالات من عملية واحدة.
+#   gunicorn -c gunicorn.conf.py wsgi:app            (المنفذ 5000)
+#   hypercorn async_app:app --bind 0.0.0.0:5001
+#   python bench_async.py --sync http://127.0.0.1:5000 --async http://127.0.0.1:5001
+
+DEFAULT_BODY = {
+    "time_slot": "2025-01-01 08:00:00",
+    "line": "Red",
+    "departure_station": "A",
+    "arrival_station": "B",
+    "seat_type": "SINGLE",
+}
+
+
+def build_request(host, path, body):
+    payload = json.dumps(body).encode("utf-8")
+    head = (
+        f"POST {path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        "Connection: keep-alive\r\n\r\n"
+    )
+    return head.encode("ascii") + payload
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(url, raw_request, deadline, latencies, counters):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            started = time.perf_counter()
+            writer.write(raw_request)
+            await writer.drain()
+            status = await read_response(reader)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status >= 500:
+                counters["errors"] += 1
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            counters["errors"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run(base, path, body, concurrency, duration):
+    url = urllib.parse.urlsplit(base)
+    raw_request = build_request(url.netloc, path, body)
+    latencies, counters = [], {"errors": 0}
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    await asyncio.gather(*(client(url, raw_request, deadline, latencies, counters) for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "server": base,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": counters["errors"],
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="مقارنة الخادم المتزامن مع نسخة asyncio")
+    parser.add_argument("--sync", dest="sync_base", default="http://127.0.0.1:5000")
+    parser.add_argument("--async", dest="async_base", default="http://127.0.0.1:5001")
+    parser.add_argument("--path", default="/booked_seats/status")
+    parser.add_argument("--body", default=json.dumps(DEFAULT_BODY), help="جسم JSON للطلب")
+    parser.add_argument("--concurrency", type=int, action="append", help="الافتراضي 100 و1000 و5000")
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    for concurrency in args.concurrency or [100, 1000, 5000]:
+        for base in (args.sync_base, args.async_base):
+            result = asyncio.run(run(base, args.path, json.loads(args.body), concurrency, args.duration))
+            print(json.dumps(result))
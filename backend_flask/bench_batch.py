@@ -0,0 +1,99 @@
+import argparse
+import http.client
+import json
+import statistics
+import time
+import urllib.parse
+import uuid
+
+# مقارنة الحجز والإلغاء الدفعي مع N طلباً متتالياً على المسارات الحالية.
+# يحجز في رحلة وهمية بعيدة (سنة 2099، خط عشوائي) ثم يلغي كل ما حجزه.
+#   python bench_batch.py --seats 10 --rounds 20
+
+
+class Client:
+    def __init__(self, base):
+        url = urllib.parse.urlsplit(base)
+        self.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+
+    def post(self, path, body):
+        self.conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+        response = self.conn.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+
+
+def trip(round_number):
+    return {
+        "name": "bench",
+        "time": f"2099-01-01 {round_number % 24:02d}:00:00",
+        "line": f"bench-{uuid.uuid4().hex[:8]}",
+        "departure_station": "A",
+        "arrival_station": "B",
+    }
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - started) * 1000, result
+
+
+def sequential_round(client, seats, round_number):
+    booking = trip(round_number)
+
+    def book():
+        ids = []
+        for seat in range(1, seats + 1):
+            status, body = client.post("/book", dict(booking, seat_number=str(seat), seat_type="SINGLE"))
+            if status != 200:
+                raise RuntimeError(f"/book failed: {status} {body}")
+            ids.append(body["ticket_id"])
+        return ids
+
+    def cancel(ids):
+        for ticket_id in ids:
+            client.post(f"/bookings/cancel/{ticket_id}", {})
+
+    book_ms, ids = timed(book)
+    cancel_ms, _ = timed(lambda: cancel(ids))
+    return book_ms, cancel_ms
+
+
+def batch_round(client, seats, round_number):
+    booking = trip(round_number)
+    booking["seats"] = [{"seat_number": str(seat), "seat_type": "SINGLE"} for seat in range(1, seats + 1)]
+
+    def book():
+        status, body = client.post("/book/batch", booking)
+        if status != 200:
+            raise RuntimeError(f"/book/batch failed: {status} {body}")
+        return [result["ticket_id"] for result in body["results"]]
+
+    book_ms, ids = timed(book)
+    cancel_ms, _ = timed(lambda: client.post("/bookings/cancel/batch", {"ticket_ids": ids}))
+    return book_ms, cancel_ms
+
+
+def summarize(label, samples):
+    book = [sample[0] for sample in samples]
+    cancel = [sample[1] for sample in samples]
+    return {
+        "mode": label,
+        "rounds": len(samples),
+        "book_median_ms": round(statistics.median(book), 2),
+        "cancel_median_ms": round(statistics.median(cancel), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="مقارنة الحجز/الإلغاء الدفعي مع الطلبات المتتالية")
+    parser.add_argument("--base", default="http://127.0.0.1:5000")
+    parser.add_argument("--seats", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    client = Client(args.base)
+    sequential = [sequential_round(client, args.seats, n) for n in range(args.rounds)]
+    batched = [batch_round(client, args.seats, n) for n in range(args.rounds)]
+    print(json.dumps(summarize(f"{args.seats} sequential calls", sequential)))
+    print(json.dumps(summarize("one batch call", batched)))
@@ -0,0 +1,102 @@
+import argparse
+import datetime
+import json
+import random
+import statistics
+import time
+
+import json_codec
+import queries
+
+# قياس تكلفة ترميز قوائم الحجوزات لكل 1000 صف، قبل وبعد:
+#   قبل: صفوف dict من المؤشر + حلقة strftime/strip في بايثون + jsonify
+#   بعد: صفوف tuple منسَّقة في SQL + json_codec (كل ترميز متاح)
+#   python bench_json.py --rows 1000 --repeat 200
+# لا يحتاج قاعدة بيانات؛ التنسيق داخل MySQL خارج هذا القياس لأنه يحدث في الخادم.
+
+LINES = ["المسار الأزرق ", "المسار الأحمر", " المسار البرتقالي"]
+STATIONS = ["KAFD ", "Al-Murooj", " STC", "National Museum"]
+
+
+def dict_rows(count, rng):
+    """Rows as a dictionary cursor returns them (datetimes, raw vip, untrimmed text)."""
+    start = datetime.datetime(2025, 1, 1, 6, 0)
+    rows = []
+    for i in range(count):
+        at = start + datetime.timedelta(minutes=5 * i)
+        rows.append({
+            "id_ticket": 100000 + i, "ticketId": 100000 + i, "name": f"راكب {i}",
+            "date_ticket_time": at, "date_ticket_find": at - datetime.timedelta(hours=3),
+            "seat_number": str(rng.randint(1, 60)), "vip": rng.choice((0, 1, 2)), "paid": 1,
+            "line": rng.choice(LINES), "departure_station": rng.choice(STATIONS),
+            "arrival_station": rng.choice(STATIONS),
+        })
+    return rows
+
+
+def sql_formatted_rows(rows):
+    """The same rows as tuples, already formatted the way queries.booking_columns() returns them."""
+    return [(
+        row["id_ticket"], row["ticketId"], row["name"],
+        row["date_ticket_time"].strftime("%Y-%m-%d %H:%M:%S"),
+        row["date_ticket_find"].strftime("%Y-%m-%d %H:%M:%S"),
+        row["seat_number"], 1 if row["vip"] else 0, row["paid"],
+        row["line"].strip(), row["departure_station"].strip(), row["arrival_station"].strip(),
+    ) for row in rows]
+
+
+def legacy_format_booking(booking):
+    # نسخة من حلقة التنسيق السابقة في app.py
+    if isinstance(booking.get('date_ticket_time'), datetime.datetime):
+        booking['date_ticket_time'] = booking['date_ticket_time'].strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(booking.get('date_ticket_find'), datetime.datetime):
+        booking['date_ticket_find'] = booking['date_ticket_find'].strftime("%Y-%m-%d %H:%M:%S")
+
+    booking['vip'] = 1 if booking.get('vip') else 0
+    booking['line'] = str(booking['line']).strip()
+    booking['departure_station'] = str(booking['departure_station']).strip()
+    booking['arrival_station'] = str(booking['arrival_station']).strip()
+    return booking
+
+
+def legacy_jsonify():
+    """Flask's own provider when Flask is installed, else the same json.dumps arguments it uses."""
+    try:
+        from flask import Flask
+        app = Flask(__name__)
+        return lambda obj: app.json.dumps(obj).encode("utf-8")
+    except ImportError:
+        return lambda obj: json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def time_per_1k(fn, make_input, rows, repeat):
+    samples = []
+    for _ in range(repeat):
+        data = make_input()
+        started = time.perf_counter()
+        fn(data)
+        samples.append((time.perf_counter() - started) * 1e6 * 1000 / rows)
+    return round(statistics.median(samples), 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="تكلفة ترميز قوائم الحجوزات لكل 1000 صف")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    source = dict_rows(args.rows, random.Random(1))
+    formatted = sql_formatted_rows(source)
+    dumps = legacy_jsonify()
+
+    before = time_per_1k(lambda rows: dumps([legacy_format_booking(row) for row in rows]),
+                         lambda: [dict(row) for row in source], args.rows, args.repeat)
+    results = [{"path": "dict rows + Python formatting + jsonify", "us_per_1k_rows": before}]
+    for name in sorted(json_codec.CODECS):
+        codec = json_codec.load_codec(name)
+        after = time_per_1k(lambda rows: codec.rows(queries.BOOKING_FIELDS, rows),
+                            lambda: formatted, args.rows, args.repeat)
+        results.append({"path": f"tuple rows + {name}", "us_per_1k_rows": after,
+                        "speedup": round(before / after, 1)})
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
@@ -0,0 +1,139 @@
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+
+from bench_rush import Client, RouteStats, RushHour, summarize
+
+# زمن الحجز أثناء عاصفة تسجيل دخول، فوق قاعدة مُعبأة بـ bench_seed.py.
+# المرحلة الأولى: عملاء الحجز وحدهم (/booked_seats/status و /book). الثانية: العملاء أنفسهم مع
+# --storm خيط يرسل /login بلا توقف. التجزئة في مجمّع العمليات ومحدد المحاولات يجب أن يُبقيا p95/p99 للحجز ثابتة:
+#   python bench_login_storm.py --storm 64 --duration 30
+# المحدد يرد 429 على أغلب العاصفة لأنها من عنوان واحد؛ لقياس مجمّع التجزئة نفسه ارفعه في الخادم:
+#   LOGIN_RATE_BURST=1000000 LOGIN_RATE_PER_MINUTE=1000000 gunicorn -c gunicorn.conf.py wsgi:app
+
+BOOKING_ROUTES = {"status": 3, "book": 1}
+
+
+def booking_worker(index, args, manifest, phase_end, stats, lock):
+    rng = random.Random(args.seed * 100003 + index)
+    session = RushHour(manifest, rng, None)
+    client = Client(args.base)
+    routes, weights = list(BOOKING_ROUTES), list(BOOKING_ROUTES.values())
+    local = RouteStats()
+    while time.monotonic() < phase_end:
+        route = rng.choices(routes, weights=weights)[0]
+        started = time.perf_counter()
+        try:
+            status, outcome = session.call(client, route)
+        except (OSError, http.client.HTTPException):
+            local.errors += 1
+            continue
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if status >= 500 and status != 503:
+            local.errors += 1
+        elif status in (429, 503):
+            local.throttled += 1
+        else:
+            if outcome == "conflict":
+                local.conflicts += 1
+            local.latencies.append(elapsed_ms)
+    if client.conn is not None:
+        client.conn.close()
+    with lock:
+        stats.merge(local)
+
+
+def storm_worker(index, args, manifest, stop, outcomes, lock):
+    """Logs in as random seeded users; --wrong-password makes every attempt a failed credential check."""
+    rng = random.Random(args.seed * 7919 + index)
+    client = Client(args.base)
+    password = "wrong-password" if args.wrong_password else manifest["password"]
+    local = {}
+    while not stop.is_set():
+        username = f"{manifest['username_prefix']}{rng.randrange(manifest['users'])}"
+        try:
+            status = client.login(username, password)
+        except (OSError, http.client.HTTPException):
+            status = "error"
+        local[status] = local.get(status, 0) + 1
+    if client.conn is not None:
+        client.conn.close()
+    with lock:
+        for status, count in local.items():
+            outcomes[str(status)] = outcomes.get(str(status), 0) + count
+
+
+def phase(args, manifest, storm):
+    stats, lock = RouteStats(), threading.Lock()
+    outcomes, stop = {}, threading.Event()
+    storm_threads = [threading.Thread(target=storm_worker, args=(i, args, manifest, stop, outcomes, lock))
+                     for i in range(storm)]
+    for thread in storm_threads:
+        thread.start()
+    if storm:
+        # العاصفة تبلغ ذروتها (طابور التجزئة ممتلئ) قبل بدء القياس
+        time.sleep(args.warmup)
+    started = time.monotonic()
+    threads = [threading.Thread(target=booking_worker,
+                                args=(i, args, manifest, started + args.duration, stats, lock))
+               for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    stop.set()
+    for thread in storm_threads:
+        thread.join()
+    return {"booking": summarize(stats, elapsed), "logins": outcomes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="زمن الحجز قبل عاصفة تسجيل الدخول وأثناءها")
+    parser.add_argument("--base", default="http://127.0.0.1:5000")
+    parser.add_argument("--manifest", default="bench_manifest.json")
+    parser.add_argument("--concurrency", type=int, default=16, help="عملاء الحجز")
+    parser.add_argument("--storm", type=int, default=64, help="خيوط /login في المرحلة الثانية")
+    parser.add_argument("--wrong-password", action="store_true")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="أقصى زيادة مسموحة في p95/p99 للحجز أثناء العاصفة")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    with open(args.manifest, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    report = {"quiet": phase(args, manifest, 0), "storm": phase(args, manifest, args.storm)}
+    report["config"] = {"concurrency": args.concurrency, "storm": args.storm, "duration_s": args.duration,
+                        "wrong_password": args.wrong_password, "seed": args.seed}
+
+    print(f"{'phase':8} {'req':>8} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>6} {'429/503':>8}")
+    for name in ("quiet", "storm"):
+        row = report[name]["booking"]
+        print(f"{name:8} {row['requests']:>8} {row['throughput_rps']:>8} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['errors']:>6} {row['throttled']:>8}")
+    print(f"storm /login responses: {report['storm']['logins']}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    quiet, storm = report["quiet"]["booking"], report["storm"]["booking"]
+    regressions = [f"{key} {quiet[key]} -> {storm[key]}" for key in ("p95_ms", "p99_ms")
+                   if storm[key] > quiet[key] * (1 + args.tolerance)]
+    for regression in regressions:
+        print(f"❌ booking latency during the login storm: {regression}")
+    if regressions:
+        return 1
+    print("✅ Booking latency stayed flat during the login storm")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import argparse
+import datetime
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+from loadtest import percentile
+
+# محاكاة ساعة الذروة على المسارات الحقيقية فوق قاعدة مُعبأة بـ bench_seed.py.
+# كل عميل افتراضي يسجل الدخول كراكب ثم يرسل طلبات بحسب أوزان --mix، ويُقاس كل مسار على حدة.
+# نفس --seed ونفس البيانات تعطي نفس تسلسل الطلبات، فتصلح النتائج للمقارنة بين تشغيل وآخر:
+#   python bench_rush.py --out before.json
+#   python bench_rush.py --baseline before.json      # يفشل (exit 1) إذا تراجع أي مسار
+
+DEFAULT_MIX = "login=5,times=20,status=25,book=10,active=25,verify=15"
+ROUTE_NAMES = {
+    "login": "POST /login",
+    "times": "GET /times",
+    "status": "POST /booked_seats/status",
+    "book": "POST /book",
+    "active": "GET /active_bookings",
+    "verify": "POST /verify_ticket",
+}
+SEAT_TYPES = ("SINGLE", "SINGLE", "SINGLE", "FAMILY", "VIP")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTE_NAMES:
+            raise ValueError(f"Unknown route in mix: {name} (expected one of {', '.join(ROUTE_NAMES)})")
+        mix[name] = float(weight)
+    return mix
+
+
+class Client:
+    """Keep-alive JSON client; a dropped connection is reopened on the next request."""
+
+    def __init__(self, base):
+        self.url = urllib.parse.urlsplit(base)
+        self.conn = None
+        self.token = None
+
+    def request(self, method, path, body=None, token=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=30)
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        try:
+            self.conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def login(self, username, password, path="/login"):
+        status, raw = self.request("POST", path, {"username": username, "password": password})
+        if status == 200:
+            self.token = json.loads(raw).get("access_token")
+        return status
+
+
+class RushHour:
+    """Request generator for one virtual passenger, driven by its own seeded RNG."""
+
+    def __init__(self, manifest, rng, employee_token):
+        self.manifest = manifest
+        self.rng = rng
+        self.employee_token = employee_token
+        self.lines = manifest["lines"]
+        self.user = rng.randrange(manifest["users"])
+
+    def username(self):
+        return f"{self.manifest['username_prefix']}{self.user}"
+
+    def trip(self):
+        line = self.rng.choice(sorted(self.lines))
+        departure, arrival = self.rng.sample(self.lines[line], 2)
+        return line, departure, arrival
+
+    def upcoming_slot(self):
+        day = datetime.date.today() + datetime.timedelta(days=self.rng.randint(1, self.manifest["days_ahead"]))
+        hour = self.rng.choices(range(24), weights=self.manifest["hour_weights"])[0]
+        return f"{day.isoformat()} {hour:02d}:{self.rng.randrange(0, 60, 5):02d}:00"
+
+    def call(self, client, route):
+        if route == "login":
+            self.user = self.rng.randrange(self.manifest["users"])
+            return client.login(self.username(), self.manifest["password"]), None
+
+        if route == "times":
+            line = urllib.parse.quote(self.rng.choice(sorted(self.lines)))
+            return client.request("GET", f"/times?interval_minutes=5&line={line}")[0], None
+
+        if route == "status":
+            line, departure, arrival = self.trip()
+            return client.request("POST", "/booked_seats/status", {
+                "time_slot": self.upcoming_slot(), "line": line,
+                "departure_station": departure, "arrival_station": arrival,
+                "seat_type": self.rng.choice(SEAT_TYPES),
+            }, client.token)[0], None
+
+        if route == "book":
+            line, departure, arrival = self.trip()
+            status, raw = client.request("POST", "/book", {
+                "name": f"راكب {self.user}", "passenger_id": self.manifest["user_id_base"] + self.user,
+                "time": self.upcoming_slot(), "line": line,
+                "departure_station": departure, "arrival_station": arrival,
+                "seat_number": str(self.rng.randint(1, self.manifest["seats_per_trip"])),
+                "seat_type": self.rng.choice(SEAT_TYPES),
+            }, client.token)
+            # 409 = المقعد محجوز مسبقاً؛ نتيجة متوقعة في الذروة وليست خطأً
+            return status, "conflict" if status == 409 else None
+
+        if route == "active":
+            passenger_id = self.manifest["user_id_base"] + self.user
+            return client.request("GET", f"/active_bookings?passenger_id={passenger_id}&limit=20",
+                                  token=client.token)[0], None
+
+        first, last = self.manifest["today_tickets"]
+        ticket_id = self.rng.randint(first, last) if first else self.rng.randint(1, self.manifest["tickets"])
+        return client.request("POST", "/verify_ticket", {"ticket_id": ticket_id}, self.employee_token)[0], None
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.throttled = 0
+        self.conflicts = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        self.throttled += other.throttled
+        self.conflicts += other.conflicts
+
+
+def worker(index, args, manifest, mix, employee_token, measure_from, deadline, results, lock):
+    rng = random.Random(args.seed * 100003 + index)
+    session = RushHour(manifest, rng, employee_token)
+    client = Client(args.base)
+    try:
+        client.login(session.username(), manifest["password"])
+    except (OSError, http.client.HTTPException):
+        pass
+
+    routes, weights = list(mix), list(mix.values())
+    local = {route: RouteStats() for route in routes}
+    while time.monotonic() < deadline:
+        route = rng.choices(routes, weights=weights)[0]
+        started = time.perf_counter()
+        try:
+            status, outcome = session.call(client, route)
+        except (OSError, http.client.HTTPException):
+            status, outcome = None, None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        # فترة الإحماء لا تُحتسب: ذاكرات التخزين المؤقت والتجمعات تمتلئ فيها
+        if time.monotonic() < measure_from:
+            continue
+        stats = local[route]
+        if status is None or status >= 500 and status != 503:
+            stats.errors += 1
+            continue
+        if status in (429, 503):
+            stats.throttled += 1
+            continue
+        if outcome == "conflict":
+            stats.conflicts += 1
+        stats.latencies.append(elapsed_ms)
+    if client.conn is not None:
+        client.conn.close()
+
+    with lock:
+        for route, stats in local.items():
+            results.setdefault(route, RouteStats()).merge(stats)
+
+
+def summarize(stats, elapsed):
+    latencies = sorted(stats.latencies)
+    return {
+        "requests": len(latencies),
+        "errors": stats.errors,
+        "throttled": stats.throttled,
+        "conflicts": stats.conflicts,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+    }
+
+
+def run(args, manifest, mix):
+    employee_token = None
+    if "verify" in mix:
+        client = Client(args.base)
+        if client.login(manifest["employee_username"], manifest["password"], "/employee_login") == 200:
+            employee_token = client.token
+
+    results, lock = {}, threading.Lock()
+    started = time.monotonic()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.duration
+    threads = [threading.Thread(target=worker, args=(i, args, manifest, mix, employee_token,
+                                                      measure_from, deadline, results, lock))
+               for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - measure_from
+
+    total = RouteStats()
+    for stats in results.values():
+        total.merge(stats)
+    return {
+        "config": {
+            "base": args.base, "mix": mix, "concurrency": args.concurrency,
+            "duration_s": args.duration, "warmup_s": args.warmup, "seed": args.seed,
+            "dataset": {"users": manifest["users"], "tickets": manifest["tickets"], "seed": manifest["seed"]},
+        },
+        "routes": {ROUTE_NAMES[route]: summarize(stats, elapsed) for route, stats in sorted(results.items())},
+        "total": summarize(total, elapsed),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Per-route regressions: p95/p99 slower or throughput lower than the baseline beyond `tolerance`."""
+    regressions = []
+    for route, current in report["routes"].items():
+        before = baseline["routes"].get(route)
+        if not before or not before["requests"]:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if current[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{route}: {key} {before[key]} -> {current[key]}")
+        if current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{route}: throughput_rps {before['throughput_rps']} -> {current['throughput_rps']}")
+        if current["errors"] > before["errors"]:
+            regressions.append(f"{route}: errors {before['errors']} -> {current['errors']}")
+    if report["config"]["dataset"] != baseline["config"]["dataset"] or report["config"]["mix"] != baseline["config"]["mix"]:
+        print("⚠️ Baseline was recorded with a different dataset or mix; the comparison is not like for like")
+    return regressions
+
+
+def print_table(report):
+    print(f"{'route':28} {'req':>8} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>6} {'429/503':>8}")
+    for route, row in list(report["routes"].items()) + [("total", report["total"])]:
+        print(f"{route:28} {row['requests']:>8} {row['throughput_rps']:>8} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['errors']:>6} {row['throttled']:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="قياس ساعة الذروة: الإنتاجية و p50/p95/p99 لكل مسار")
+    parser.add_argument("--base", default="http://127.0.0.1:5000")
+    parser.add_argument("--manifest", default="bench_manifest.json")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"أوزان المسارات، الافتراضي {DEFAULT_MIX}")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--warmup", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="حفظ النتيجة JSON لاستخدامها كخط أساس لاحقاً")
+    parser.add_argument("--baseline", help="نتيجة سابقة للمقارنة؛ يخرج بالرمز 1 عند التراجع")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    with open(args.manifest, encoding="utf-8") as f:
+        manifest = json.load(f)
+    report = run(args, manifest, parse_mix(args.mix))
+    print_table(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ {regression}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against the baseline")
@@ -0,0 +1,299 @@
+import argparse
+import datetime
+import json
+import random
+import sys
+import time
+
+from werkzeug.security import generate_password_hash
+
+import booking_rollups
+from db_config import get_connection
+from migrate import migrate
+from password_hasher import HASHER_SETTINGS
+from seat_index import normalize_text
+
+# تعبئة قاعدة بيانات مخصصة للقياس بأحجام واقعية (ملايين التذاكر، مئات آلاف الركاب).
+# البيانات حتمية لنفس --seed، فتتكرر نفس الأحجام والتوزيعات بين تشغيل وآخر.
+#   docker run -d --name tashilat-bench -e MYSQL_ROOT_PASSWORD=bench -e MYSQL_DATABASE=tashilat_bench -p 3307:3306 mysql:8
+#   DB_PORT=3307 DB_PASSWORD=bench DB_NAME=tashilat_bench python bench_seed.py --users 300000 --tickets 2000000
+# يكتب bench_manifest.json الذي يقرأ منه bench_rush.py الحسابات والمسارات ونطاق تذاكر اليوم.
+
+# الجداول الأساسية كما كانت قبل migrations/ (تضيف الترحيلات بعدها الأعمدة والفهارس)
+BASE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGINT PRIMARY KEY,
+        name VARCHAR(255) NULL,
+        date_of_birth DATE NULL,
+        resettle_date DATE NULL,
+        address VARCHAR(255) NULL,
+        username VARCHAR(255) NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        email VARCHAR(255) NULL,
+        phone VARCHAR(50) NULL,
+        priority_card_path VARCHAR(255) NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS employee (
+        employee_id VARCHAR(50) PRIMARY KEY,
+        name VARCHAR(255) NULL,
+        username VARCHAR(255) NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        email VARCHAR(255) NULL,
+        phone VARCHAR(50) NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tickets (
+        id_ticket INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NULL,
+        date_ticket_time DATETIME NOT NULL,
+        date_ticket_find DATETIME NULL,
+        seat_number VARCHAR(20) NOT NULL,
+        vip TINYINT NOT NULL DEFAULT 0,
+        paid TINYINT NOT NULL DEFAULT 0,
+        line VARCHAR(100) NULL,
+        departure_station VARCHAR(100) NULL,
+        arrival_station VARCHAR(100) NULL
+    )
+    """,
+]
+
+BENCH_TABLES = ["seat_claims", "seat_leg_claims", "rollup_trip_occupancy", "rollup_booking_minutes", "sessions",
+                "replication_heartbeat", "ticket_id_sequence", "tickets", "employee", "users", "schema_migrations"]
+
+LINES = {
+    "المسار الأزرق": ["SABB", "Dr Sulaiman Al-Habib", "Al-Shabab Club Stadium", "KAFD", "Al-Murooj",
+                      "King Fahad District", "King Fahad District 2", "STC"],
+    "المسار الأحمر": ["King Saud University Station", "King Salman Oasis", "KACST", "At Takhassusi", "STC",
+                      "Al-Wurud", "King Abdulaziz Road", "Ministry of Education"],
+    "المسار البرتقالي": ["Jeddah Road", "Tuwaiq", "Ad Douh", "Western Station", "Aishah bint Abi Bakr Street",
+                         "Dhahrat Al-Badiah", "Sultanah", "Al-Jarradiyah"],
+    "المسار الأصفر": ["Airport T1-2", "Airport T3", "Airport T4", "Airport T5", "KAFD"],
+    "المسار الأخضر": ["Ministry of Education", "National Museum"],
+    "المسار البنفسجي": ["KAFD", "An Naseem"],
+}
+
+# وزن كل ساعة في اليوم: ذروة صباحية (7-9) ومسائية (16-18)
+HOUR_WEIGHTS = [0, 0, 0, 0, 0, 1, 3, 9, 10, 6, 3, 3, 4, 4, 3, 4, 8, 10, 9, 5, 3, 2, 1, 1]
+SEATS_PER_TRIP = 60
+USER_ID_BASE = 1_000_000_000
+USERNAME_PREFIX = "bench_user_"
+BENCH_PASSWORD = "bench-password"
+BENCH_EMPLOYEE = "bench_employee"
+BATCH_ROWS = 5000
+
+USER_INSERT = """
+    INSERT INTO users (id, name, username, username_key, password, email, phone)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+TICKET_INSERT = """
+    INSERT INTO tickets (
+        name, user_id, date_ticket_time, date_ticket_find,
+        seat_number, vip, paid,
+        line, departure_station, arrival_station,
+        name_key, line_key, departure_key, arrival_key
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# مطالبات المقاعد للرحلات القادمة، كما يفعل 001_seat_claims.sql للبيانات القديمة
+CLAIMS_BACKFILL = """
+    INSERT IGNORE INTO seat_claims (
+        slot_time, line_key, departure_key, arrival_key, vip, seat_number, ticket_id
+    )
+    SELECT date_ticket_time, line_key, departure_key, arrival_key, vip, seat_number, id_ticket
+    FROM tickets
+    WHERE paid = 1
+    AND date_ticket_time >= CURDATE()
+"""
+
+TODAY_TICKET_RANGE = """
+    SELECT MIN(id_ticket), MAX(id_ticket)
+    FROM tickets
+    WHERE date_ticket_time >= CURDATE()
+    AND date_ticket_time < CURDATE() + INTERVAL 1 DAY
+"""
+
+
+def passenger_name(index):
+    return f"راكب {index}"
+
+
+def random_slot(rng, day):
+    hour = rng.choices(range(24), weights=HOUR_WEIGHTS)[0]
+    return datetime.datetime(day.year, day.month, day.day, hour, rng.randrange(0, 60, 5))
+
+
+def random_trip(rng):
+    line = rng.choice(list(LINES))
+    departure, arrival = rng.sample(LINES[line], 2)
+    return line, departure, arrival
+
+
+def insert_batches(conn, statement, rows, label, total):
+    cursor = conn.cursor()
+    inserted = 0
+    batch = []
+    started = time.monotonic()
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_ROWS:
+                cursor.executemany(statement, batch)
+                conn.commit()
+                inserted += len(batch)
+                batch = []
+                if inserted % (BATCH_ROWS * 20) == 0:
+                    rate = inserted / max(time.monotonic() - started, 1e-6)
+                    print(f"  {label}: {inserted}/{total} ({rate:.0f} rows/s)")
+        if batch:
+            cursor.executemany(statement, batch)
+            conn.commit()
+            inserted += len(batch)
+    finally:
+        cursor.close()
+    print(f"  {label}: {inserted} rows in {time.monotonic() - started:.1f}s")
+
+
+def user_rows(count, password_hash):
+    for index in range(count):
+        username = f"{USERNAME_PREFIX}{index}"
+        yield (USER_ID_BASE + index, passenger_name(index), username, normalize_text(username),
+               password_hash, f"{username}@example.com", f"05{index:08d}")
+
+
+def ticket_rows(rng, count, users, today, days_back, days_ahead):
+    """Tickets in chronological order, so ids grow with the trip date as in production."""
+    days = days_back + days_ahead + 1
+    per_day = count // days
+    now = datetime.datetime.now()
+    for offset in range(-days_back, days_ahead + 1):
+        day = today + datetime.timedelta(days=offset)
+        remaining = per_day + (count - per_day * days if offset == days_ahead else 0)
+        for _ in range(remaining):
+            user = rng.randrange(users)
+            slot = random_slot(rng, day)
+            line, departure, arrival = random_trip(rng)
+            vip = rng.choices((0, 1, 2), weights=(85, 10, 5))[0]
+            unpaid = rng.random() < 0.05
+            paid = 1 if slot >= now or not unpaid else 0
+            name = passenger_name(user)
+            yield (name, USER_ID_BASE + user, slot, slot - datetime.timedelta(hours=rng.randint(1, 72)),
+                   str(rng.randint(1, SEATS_PER_TRIP)), vip, paid, line, departure, arrival,
+                   normalize_text(name), normalize_text(line), normalize_text(departure), normalize_text(arrival))
+
+
+def prepare_schema(conn, reset):
+    cursor = conn.cursor()
+    try:
+        if reset:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            for table in BENCH_TABLES:
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+        for statement in BASE_SCHEMA:
+            cursor.execute(statement)
+        cursor.execute("SELECT COUNT(*) FROM users")
+        existing = cursor.fetchone()[0]
+        conn.commit()
+    finally:
+        cursor.close()
+    if existing:
+        raise RuntimeError(f"Database already has {existing} users; use a dedicated bench database or --reset")
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    today = datetime.date.today()
+    password_hash = generate_password_hash(BENCH_PASSWORD, method=args.hash_method)
+
+    conn = get_connection()
+    try:
+        prepare_schema(conn, args.reset)
+    finally:
+        conn.close()
+    migrate()
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        # التعبئة فقط: لا حاجة لفحص المفاتيح الأجنبية صفاً صفاً
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+        cursor.execute("SET UNIQUE_CHECKS = 0")
+        cursor.close()
+
+        print(f"Seeding {args.users} users")
+        insert_batches(conn, USER_INSERT, user_rows(args.users, password_hash), "users", args.users)
+
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO employee (employee_id, name, username, username_key, password, email, phone)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, ("900000", "موظف القياس", BENCH_EMPLOYEE, normalize_text(BENCH_EMPLOYEE), password_hash,
+              "bench_employee@example.com", "0500000000"))
+        conn.commit()
+        cursor.close()
+
+        print(f"Seeding {args.tickets} tickets over {args.days_back} past and {args.days_ahead} upcoming days")
+        insert_batches(conn, TICKET_INSERT,
+                       ticket_rows(rng, args.tickets, args.users, today, args.days_back, args.days_ahead),
+                       "tickets", args.tickets)
+
+        cursor = conn.cursor()
+        cursor.execute(CLAIMS_BACKFILL)
+        print(f"  seat_claims: {cursor.rowcount} upcoming seats")
+        print(f"  rollups: {booking_rollups.rebuild(cursor, minutes=True)} trips")
+        conn.commit()
+        for table in ("users", "tickets", "seat_claims", "rollup_trip_occupancy", "rollup_booking_minutes"):
+            cursor.execute(f"ANALYZE TABLE {table}")
+            cursor.fetchall()
+        cursor.execute(TODAY_TICKET_RANGE)
+        first_today, last_today = cursor.fetchone()
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+        cursor.execute("SET UNIQUE_CHECKS = 1")
+        cursor.close()
+    finally:
+        conn.close()
+
+    manifest = {
+        "seed": args.seed,
+        "seeded_on": today.isoformat(),
+        "users": args.users,
+        "tickets": args.tickets,
+        "user_id_base": USER_ID_BASE,
+        "username_prefix": USERNAME_PREFIX,
+        "password": BENCH_PASSWORD,
+        "employee_username": BENCH_EMPLOYEE,
+        "days_ahead": args.days_ahead,
+        "seats_per_trip": SEATS_PER_TRIP,
+        "hour_weights": HOUR_WEIGHTS,
+        "lines": LINES,
+        "today_tickets": [first_today, last_today],
+    }
+    with open(args.manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"✅ Manifest written to {args.manifest}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="تعبئة قاعدة بيانات القياس ببيانات حتمية وأحجام واقعية")
+    parser.add_argument("--users", type=int, default=300_000)
+    parser.add_argument("--tickets", type=int, default=2_000_000)
+    parser.add_argument("--days-back", type=int, default=90)
+    parser.add_argument("--days-ahead", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reset", action="store_true", help="يحذف جداول القياس ويعيد إنشاءها")
+    parser.add_argument("--manifest", default="bench_manifest.json")
+    # نفس طريقة التجزئة التي يستخدمها الخادم، وإلا أعاد تجزئة كلمة المرور عند أول دخول
+    parser.add_argument("--hash-method", default=HASHER_SETTINGS["method"])
+    args = parser.parse_args()
+
+    try:
+        seed(args)
+    except Exception as e:
+        print(f"❌ فشل تعبئة قاعدة القياس: {e}")
+        sys.exit(1)
@@ -0,0 +1,125 @@
+import argparse
+import json
+import random
+import statistics
+import time
+
+from seat_segments import LineTopology, SegmentInventory, SEGMENT_SETTINGS, leg_mask
+
+# قياس استعلام التوفر حسب المقاطع ليوم كامل في الذاكرة (بدون قاعدة بيانات):
+# كل المسارات، الاتجاهين، الفئات الثلاث، رحلة كل 5 دقائق من 05:00 حتى 24:00.
+#   python bench_segments.py --seats 60 --fill 0.6 --queries 200000
+# يقارن خريطة البتات في SegmentInventory بفحص بسيط لقائمة فترات (first, end) لكل مقعد.
+
+CLASSES = (0, 1, 2)
+
+
+def day_trains(topology_path, start_hour, end_hour, every_minutes):
+    with open(topology_path, encoding="utf-8") as f:
+        lines = json.load(f)["lines"]
+    topology = LineTopology(lines)
+    slots = [f"{hour:02d}:{minute:02d}" for hour in range(start_hour, end_hour)
+             for minute in range(0, 60, every_minutes)]
+    trains = []
+    for line, stations in lines.items():
+        for slot in slots:
+            for direction in (0, 1):
+                for vip in CLASSES:
+                    trains.append(((slot, line, direction, vip), len(stations) - 1))
+    return topology, trains
+
+
+def random_journey(rng, legs):
+    first = rng.randrange(legs)
+    return first, rng.randint(first + 1, legs)
+
+
+def fill(trains, seats, fill_rate, rng):
+    """Sell random journeys per train (overlaps skipped); returns the bitmap and interval-list layouts."""
+    bitmaps, intervals = {}, {}
+    for train, legs in trains:
+        seat_bits = {}
+        seat_spans = {}
+        # رحلة عشوائية تغطي نحو نصف الأجزاء، فهذا العدد يقارب نسبة الإشغال المطلوبة
+        for _ in range(int(seats * fill_rate * 2)):
+            seat = str(rng.randint(1, seats))
+            first, end = random_journey(rng, legs)
+            mask = leg_mask(first, end)
+            if seat_bits.get(seat, 0) & mask:
+                continue
+            seat_bits[seat] = seat_bits.get(seat, 0) | mask
+            seat_spans.setdefault(seat, []).append((first, end))
+        bitmaps[train] = seat_bits
+        intervals[train] = seat_spans
+    return bitmaps, intervals
+
+
+def naive_taken(spans, first, end):
+    return [seat for seat, journeys in spans.items() if any(a < end and first < b for a, b in journeys)]
+
+
+def timed(fn, samples):
+    durations = []
+    for args in samples:
+        started = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    return {
+        "p50_us": round(statistics.median(durations) * 1e6, 2),
+        "p99_us": round(durations[int(len(durations) * 0.99)] * 1e6, 2),
+        "per_second": round(len(durations) / sum(durations)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="قياس توفر المقاعد حسب المقاطع ليوم تشغيل كامل")
+    parser.add_argument("--topology", default=SEGMENT_SETTINGS["topology_path"])
+    parser.add_argument("--seats", type=int, default=60)
+    parser.add_argument("--fill", type=float, default=0.6)
+    parser.add_argument("--every", type=int, default=5, help="دقائق بين الرحلات")
+    parser.add_argument("--queries", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    topology, trains = day_trains(args.topology, 5, 24, args.every)
+    bitmaps, intervals = fill(trains, args.seats, args.fill, rng)
+
+    inventory = SegmentInventory(ttl=float("inf"), max_trains=len(trains))
+    loaded_in = time.perf_counter()
+    for train, seats in bitmaps.items():
+        rows = [(seat, leg) for seat, legs in seats.items() for leg in range(legs.bit_length()) if legs >> leg & 1]
+        inventory.taken(train, 0, lambda _, rows=rows: rows)
+    loaded_in = time.perf_counter() - loaded_in
+
+    samples = []
+    for _ in range(args.queries):
+        train, legs = trains[rng.randrange(len(trains))]
+        first, end = random_journey(rng, legs)
+        samples.append((train, first, end))
+
+    no_loader = lambda train: []
+    bitmap_result = timed(lambda train, first, end: inventory.taken(train, leg_mask(first, end), no_loader), samples)
+    naive_result = timed(lambda train, first, end: naive_taken(intervals[train], first, end), samples)
+
+    claims = []
+    claim_inventory = SegmentInventory(ttl=float("inf"), max_trains=len(trains))
+    for train, _ in trains:
+        claim_inventory.taken(train, 0, no_loader)
+    for _ in range(args.queries):
+        train, legs = trains[rng.randrange(len(trains))]
+        first, end = random_journey(rng, legs)
+        claims.append((train, str(rng.randint(1, args.seats)), leg_mask(first, end)))
+    claim_result = timed(claim_inventory.mark_taken, claims)
+
+    print(json.dumps({
+        "trains": len(trains),
+        "topology": topology.stats(),
+        "sold_seat_legs": sum(bin(legs).count("1") for seats in bitmaps.values() for legs in seats.values()),
+        "load_seconds": round(loaded_in, 3),
+        "availability_bitmap": bitmap_result,
+        "availability_interval_list": naive_result,
+        "speedup": round(naive_result["p50_us"] / bitmap_result["p50_us"], 1) if bitmap_result["p50_us"] else None,
+        "mark_taken": claim_result,
+    }, ensure_ascii=False))
@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import statistics
+import time
+
+# session_tokens ينشئ نسخة الوحدة عند الاستيراد ويرفض العمل بلا مفاتيح خارج وضع التطوير
+os.environ.setdefault("SESSION_TOKEN_KEYS", '{"bench": "bench-secret"}')
+os.environ.setdefault("SESSION_TOKEN_ACTIVE_KID", "bench")
+
+from loadtest import percentile  # noqa: E402
+from session_tokens import SessionTokens  # noqa: E402
+
+# تكلفة التحقق من رمز الوصول لكل طلب، بلا قاعدة بيانات:
+#   python bench_tokens.py --tokens 10000 --repeat 5
+# hit: الرمز في ذاكرة العملية (الطلبات التالية للجلسة نفسها)، miss: أول طلب بالرمز في هذا العامل
+# (تحقق HMAC ثم تخزين)، rejected: توقيع خاطئ أو رمز منتهي.
+
+
+def principals(count):
+    return [{"sid": f"{i:032x}", "role": "passenger", "id": str(i), "name": f"p{i}"} for i in range(count)]
+
+
+def make_tokens(count):
+    tokens = SessionTokens(keys={"bench": "bench-secret"}, active_kid="bench", cache_size=count * 2)
+    issued = [tokens._access_token(p["sid"], p) for p in principals(count)]
+    return tokens, issued
+
+
+def forged(issued):
+    # آخر حرف من التوقيع مقلوب: يمر بالتحليل ويفشل عند مقارنة HMAC
+    return [token[:-1] + ("A" if token[-1] != "A" else "B") for token in issued]
+
+
+def time_each(authenticate, tokens):
+    samples = []
+    for token in tokens:
+        started = time.perf_counter()
+        authenticate(token)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return samples
+
+
+def summary(name, samples):
+    samples.sort()
+    return {"path": name, "calls": len(samples), "mean_us": round(statistics.fmean(samples), 2),
+            "p50_us": round(percentile(samples, 0.50), 2), "p99_us": round(percentile(samples, 0.99), 2)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="تكلفة التحقق من رموز الجلسة لكل طلب")
+    parser.add_argument("--tokens", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = {"miss": [], "hit": [], "rejected": []}
+    for _ in range(args.repeat):
+        tokens, issued = make_tokens(args.tokens)
+        samples["miss"] += time_each(tokens.authenticate, issued)
+        samples["hit"] += time_each(tokens.authenticate, issued)
+        samples["rejected"] += time_each(tokens.authenticate, forged(issued))
+        assert tokens.stats()["cache_hits"] == args.tokens and tokens.stats()["rejected"] == args.tokens
+
+    for name in ("hit", "miss", "rejected"):
+        print(json.dumps(summary(name, samples[name]), ensure_ascii=False))
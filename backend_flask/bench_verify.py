@@ -0,0 +1,118 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+# ticket_tokens ينشئ نسخة الوحدة عند الاستيراد ويرفض العمل بلا مفاتيح خارج وضع التطوير
+os.environ.setdefault("TICKET_TOKEN_KEYS", '{"bench": "bench-secret"}')
+os.environ.setdefault("TICKET_TOKEN_ACTIVE_KID", "bench")
+
+from loadtest import percentile  # noqa: E402
+from ticket_tokens import TicketTokens  # noqa: E402
+from ticket_verifier import TicketVerifier  # noqa: E402
+
+# زمن التحقق من مسح بوابة واحد داخل العملية، بلا قاعدة بيانات: خريطة تذاكر اليوم مُعبأة،
+# ثم --threads خيط (كخيوط gunicorn) يمسح أرقام تذاكر ورموز QR موقعة بالتناوب، بينما يعيد
+# خيط التحديث الخلفي تحميل النافذة كاملة كل --refresh-seconds (قراءة تستغرق --load-ms ثم بناء الصفوف).
+#   python bench_verify.py --tickets 200000 --threads 4 --scans 50000
+# يخرج بـ 1 إذا تجاوز p99 لأي نوع مسح --target-ms (2 ms).
+
+NOW = datetime.datetime.now().replace(microsecond=0)
+
+
+def make_rows(count, rng):
+    rows = []
+    for ticket_id in range(1, count + 1):
+        departure = NOW + datetime.timedelta(minutes=rng.randint(-50, 50))
+        rows.append({"id_ticket": ticket_id, "name": f"p{ticket_id}", "seat_number": str(ticket_id % 60 + 1),
+                     "date_ticket_time": departure, "paid": 1 if ticket_id % 20 else 0})
+    return rows
+
+
+def window_loader(rows, load_ms, loads):
+    """Stand-in for load_ticket_window: waits like a query, then builds fresh row dicts like the driver."""
+    def load_window(start, end, after_id):
+        time.sleep(load_ms / 1000)
+        loads.append(after_id)
+        return [dict(row) for row in rows if row["id_ticket"] > after_id]
+    return load_window
+
+
+def scans(verifier, rows, count, rng):
+    payloads = []
+    for _ in range(count):
+        row = rng.choice(rows)
+        if rng.random() < 0.5:
+            payloads.append(("id", str(row["id_ticket"])))
+        else:
+            payloads.append(("token", verifier.tokens.issue(
+                row["id_ticket"], row["name"], row["seat_number"], row["date_ticket_time"], "Blue", "A", "B")))
+    return payloads
+
+
+def scanner(verifier, payloads, samples, lock):
+    local = {"id": [], "token": []}
+    for kind, payload in payloads:
+        started = time.perf_counter()
+        # ما يفعله /verify_ticket: التأكد من خيط التحديث ثم القراءة من الخريطة
+        verifier.start(None)
+        verifier.verify(payload, lambda ticket_id: None)
+        local[kind].append((time.perf_counter() - started) * 1000)
+    with lock:
+        for kind, values in local.items():
+            samples[kind] += values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="زمن التحقق من تذاكر البوابات لكل مسح")
+    parser.add_argument("--tickets", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--scans", type=int, default=50000, help="لكل خيط")
+    parser.add_argument("--refresh-seconds", type=float, default=0.5)
+    parser.add_argument("--load-ms", type=float, default=50, help="زمن قراءة النافذة من MySQL")
+    parser.add_argument("--target-ms", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # full_refresh_seconds=0: كل تحديث إعادة تحميل كاملة، أسوأ حالة لخيوط المسح
+    verifier = TicketVerifier(TicketTokens({"bench": "bench-secret"}, "bench"),
+                              refresh_seconds=args.refresh_seconds, full_refresh_seconds=0)
+    rows, loads = make_rows(args.tickets, rng), []
+    load_window = window_loader(rows, args.load_ms, loads)
+    verifier.refresh(load_window, NOW)
+    batches = [scans(verifier, rows, args.scans, rng) for _ in range(args.threads)]
+    verifier.start(load_window)
+
+    samples, lock = {"id": [], "token": []}, threading.Lock()
+    threads = [threading.Thread(target=scanner, args=(verifier, batch, samples, lock)) for batch in batches]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    failed = False
+    for kind in ("id", "token"):
+        values = sorted(samples[kind])
+        row = {"scan": kind, "count": len(values), "p50_ms": round(percentile(values, 0.50), 4),
+               "p99_ms": round(percentile(values, 0.99), 4), "max_ms": round(values[-1], 4)}
+        print(json.dumps(row, ensure_ascii=False))
+        failed = failed or row["p99_ms"] >= args.target_ms
+    print(json.dumps({"scans_per_s": round(args.threads * args.scans / elapsed),
+                      "full_reloads": loads.count(0) - 1, "stats": verifier.stats()}, ensure_ascii=False))
+
+    if failed:
+        print(f"❌ scan p99 is not under {args.target_ms} ms")
+        return 1
+    print(f"✅ scan p99 under {args.target_ms} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import datetime
+import os
+import sys
+import threading
+
+import queries
+
+# تجميعات لوحة الموظف (الإشغال لكل رحلة وفئة، الحجوزات والإلغاءات لكل دقيقة) تُحدَّث
+# بإضافة فروق صغيرة داخل معاملة الحجز أو الإلغاء نفسها، فلا تحتاج اللوحة GROUP BY على tickets.
+ROLLUP_SETTINGS = {
+    "shards": int(os.environ.get("BOOKING_ROLLUP_SHARDS", 8)),
+    "seats_per_trip": int(os.environ.get("SEATS_PER_TRIP", 60)),
+    "max_range_days": int(os.environ.get("ANALYTICS_MAX_RANGE_DAYS", 31)),
+}
+
+_TRIP_ROW = "(%s, %s, %s, %s, %s, %s)"
+_UPSERT_TRIPS = """
+    INSERT INTO rollup_trip_occupancy (slot_time, line_key, vip, shard, booked, cancelled)
+    VALUES {rows}
+    ON DUPLICATE KEY UPDATE booked = booked + VALUES(booked), cancelled = cancelled + VALUES(cancelled)
+"""
+
+_MINUTE_ROW = "(%s, %s, %s, %s, %s)"
+_UPSERT_MINUTES = """
+    INSERT INTO rollup_booking_minutes (minute, line_key, shard, booked, cancelled)
+    VALUES {rows}
+    ON DUPLICATE KEY UPDATE booked = booked + VALUES(booked), cancelled = cancelled + VALUES(cancelled)
+"""
+
+# إعادة البناء من tickets بنفس منطق migrations/006. رحلات ticket_archive لم تعد في tickets فتبقى
+# صفوفها كما هي. الدقائق تُبنى من date_ticket_find فقط، فإعادة بنائها تمحو الإلغاءات المسجلة لكل دقيقة.
+REBUILD_TRIPS = [
+    "DELETE FROM rollup_trip_occupancy WHERE slot_time >= (SELECT MIN(date_ticket_time) FROM tickets)",
+    """
+    INSERT INTO rollup_trip_occupancy (slot_time, line_key, vip, shard, booked, cancelled)
+    SELECT date_ticket_time, line_key, vip, 0, SUM(paid = 1), SUM(paid = 0)
+    FROM tickets
+    GROUP BY date_ticket_time, line_key, vip
+    """,
+]
+
+REBUILD_MINUTES = [
+    "DELETE FROM rollup_booking_minutes",
+    """
+    INSERT INTO rollup_booking_minutes (minute, line_key, shard, booked, cancelled)
+    SELECT DATE_FORMAT(date_ticket_find, '%Y-%m-%d %H:%i:00'), line_key, 0, COUNT(*), 0
+    FROM tickets
+    WHERE date_ticket_find IS NOT NULL
+    GROUP BY DATE_FORMAT(date_ticket_find, '%Y-%m-%d %H:%i:00'), line_key
+    """,
+]
+
+
+def current_minute():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:00")
+
+
+class BookingRollups:
+    """Occupancy and booking-rate counters kept next to the tickets they count.
+
+    booked()/cancelled()/moved() add deltas with one INSERT ... ON DUPLICATE
+    KEY UPDATE per table, on the caller's cursor, so the counters commit or
+    roll back with the ticket write. Each ticket lands in shard
+    `ticket_id % shards` of its row; concurrent bookings for one trip then
+    update different rows instead of queueing on a single row lock, and the
+    dashboard queries sum the shards. Rows are written in key order so two
+    multi-row updates cannot deadlock each other.
+    """
+
+    def __init__(self, shards=8, seats_per_trip=60, max_range_days=31):
+        self.shards = max(1, shards)
+        self.seats_per_trip = seats_per_trip
+        self.max_range_days = max_range_days
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.rows = 0
+
+    def _statements(self, trips, minutes):
+        for template, row, deltas in ((_UPSERT_TRIPS, _TRIP_ROW, trips), (_UPSERT_MINUTES, _MINUTE_ROW, minutes)):
+            deltas = sorted((key, delta) for key, delta in deltas.items() if delta != (0, 0))
+            if not deltas:
+                continue
+            params = ()
+            for key, (booked, cancelled) in deltas:
+                params += key + (booked, cancelled)
+            with self._lock:
+                self.updates += 1
+                self.rows += len(deltas)
+            yield template.format(rows=", ".join([row] * len(deltas))), params
+
+    def _apply(self, cursor, trips, minutes):
+        for sql, params in self._statements(trips, minutes):
+            cursor.execute(sql, params)
+
+    async def _apply_async(self, cursor, trips, minutes):
+        for sql, params in self._statements(trips, minutes):
+            await cursor.execute(sql, params)
+
+    @staticmethod
+    def _add(deltas, key, booked, cancelled):
+        current = deltas.get(key, (0, 0))
+        deltas[key] = (current[0] + booked, current[1] + cancelled)
+
+    def _trip(self, ticket_id, key):
+        """Trip row key for a ticket; `key` is a seat_index slot key (slot, line, departure, arrival, vip)."""
+        return key[0], key[1], int(key[4]), int(ticket_id) % self.shards
+
+    def _booked_deltas(self, tickets, minute):
+        trips, minutes = {}, {}
+        minute = minute or current_minute()
+        for ticket_id, key in tickets:
+            self._add(trips, self._trip(ticket_id, key), 1, 0)
+            self._add(minutes, (minute, key[1], int(ticket_id) % self.shards), 1, 0)
+        return trips, minutes
+
+    def booked(self, cursor, tickets, minute=None):
+        """Count new tickets, given as (ticket_id, slot_key) pairs; `minute` defaults to now."""
+        self._apply(cursor, *self._booked_deltas(tickets, minute))
+
+    async def booked_async(self, cursor, tickets, minute=None):
+        await self._apply_async(cursor, *self._booked_deltas(tickets, minute))
+
+    def cancelled(self, cursor, tickets):
+        """Move cancelled (ticket_id, slot_key) pairs from booked to cancelled."""
+        trips, minutes = {}, {}
+        minute = current_minute()
+        for ticket_id, key in tickets:
+            self._add(trips, self._trip(ticket_id, key), -1, 1)
+            self._add(minutes, (minute, key[1], int(ticket_id) % self.shards), 0, 1)
+        self._apply(cursor, trips, minutes)
+
+    def moved(self, cursor, ticket_id, old_key, new_key):
+        """A booking changed trip or class; per-minute counts are unaffected."""
+        trips = {}
+        self._add(trips, self._trip(ticket_id, old_key), -1, 0)
+        self._add(trips, self._trip(ticket_id, new_key), 1, 0)
+        self._apply(cursor, trips, {})
+
+    # ---- قراءة اللوحة ----
+
+    def _check_range(self, start, end):
+        if end <= start:
+            raise ValueError("'to' must be after 'from'")
+        if end - start > datetime.timedelta(days=self.max_range_days):
+            raise ValueError(f"Range is limited to {self.max_range_days} days")
+
+    def occupancy(self, cursor, start, end, line_key=None):
+        """Per trip and class in [start, end): active and cancelled tickets, occupancy and cancellation rate."""
+        self._check_range(start, end)
+        params = (start, end) + ((line_key,) if line_key else ())
+        cursor.execute(queries.rollup_occupancy(bool(line_key)), params)
+        trips = []
+        for slot_time, line, vip, booked, cancelled in cursor.fetchall():
+            booked, cancelled = int(booked), int(cancelled)
+            trips.append({
+                "time": slot_time,
+                "line_key": line,
+                "vip": vip,
+                "booked": booked,
+                "cancelled": cancelled,
+                "seats": self.seats_per_trip,
+                "occupancy": round(booked / self.seats_per_trip, 4) if self.seats_per_trip else None,
+                "cancellation_rate": rate(cancelled, booked + cancelled),
+            })
+        return trips
+
+    def per_minute(self, cursor, start, end, line_key=None):
+        """Bookings and cancellations per minute in [start, end); minutes without any are omitted."""
+        self._check_range(start, end)
+        params = (start, end) + ((line_key,) if line_key else ())
+        cursor.execute(queries.rollup_minutes(bool(line_key)), params)
+        return [{"minute": minute, "booked": int(booked), "cancelled": int(cancelled)}
+                for minute, booked, cancelled in cursor.fetchall()]
+
+    def cancellation_rates(self, cursor, start, end):
+        """Cancellations against bookings made in [start, end), per line and overall."""
+        self._check_range(start, end)
+        cursor.execute(queries.ROLLUP_CANCELLATIONS_BY_LINE, (start, end))
+        lines = []
+        total_booked = total_cancelled = 0
+        for line, booked, cancelled in cursor.fetchall():
+            booked, cancelled = int(booked), int(cancelled)
+            total_booked += booked
+            total_cancelled += cancelled
+            lines.append({"line_key": line, "booked": booked, "cancelled": cancelled,
+                          "cancellation_rate": rate(cancelled, booked)})
+        return {"lines": lines, "booked": total_booked, "cancelled": total_cancelled,
+                "cancellation_rate": rate(total_cancelled, total_booked)}
+
+    def stats(self):
+        with self._lock:
+            return {"shards": self.shards, "updates": self.updates, "rows": self.rows}
+
+
+def rate(part, whole):
+    return round(part / whole, 4) if whole else None
+
+
+booking_rollups = BookingRollups(**ROLLUP_SETTINGS)
+
+
+def rebuild(cursor, minutes=False):
+    """Recompute the rollups from tickets with GROUP BY; returns the trip rows written."""
+    for statement in REBUILD_TRIPS:
+        cursor.execute(statement)
+    trips = cursor.rowcount
+    if minutes:
+        for statement in REBUILD_MINUTES:
+            cursor.execute(statement)
+    return trips
+
+
+if __name__ == "__main__":
+    # python booking_rollups.py rebuild [--minutes]   — عند الشك في انحراف العدادات.
+    # يُشغَّل والحجز متوقف: ما يُحجز أثناءه قد يُحسب مرتين أو لا يُحسب.
+    if sys.argv[1:2] != ["rebuild"] or sys.argv[2:] not in ([], ["--minutes"]):
+        print("usage: python booking_rollups.py rebuild [--minutes]")
+        sys.exit(2)
+    from db_config import get_connection
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        trips = rebuild(cursor, minutes=sys.argv[2:] == ["--minutes"])
+        conn.commit()
+        print(f"✅ rollup_trip_occupancy rebuilt: {trips} rows")
+    finally:
+        cursor.close()
+        conn.close()
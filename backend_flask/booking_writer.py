@@ -0,0 +1,549 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from event_log import log_error, log_event, log_warning
+
+# وضع الحجز: "sync" (الافتراضي، كتابة فورية) أو "write_behind" (قبول من الذاكرة ثم كتابة دفعية)
+WRITER_SETTINGS = {
+    "enabled": os.environ.get("BOOKING_MODE", "sync").lower() == "write_behind",
+    "journal_path": os.environ.get("BOOKING_JOURNAL", os.path.join("journal", "bookings.log")),
+    "batch_size": int(os.environ.get("BOOKING_FLUSH_BATCH", 500)),
+    "flush_interval": float(os.environ.get("BOOKING_FLUSH_INTERVAL", 0.05)),
+    "id_block": int(os.environ.get("BOOKING_ID_BLOCK", 1000)),
+    "journal_max_bytes": int(os.environ.get("BOOKING_JOURNAL_MAX_BYTES", 64 * 1024 * 1024)),
+}
+
+FLUSH_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+TICKET_COLUMNS = (
+    "id_ticket", "name", "user_id", "date_ticket_time", "date_ticket_find",
+    "seat_number", "vip", "paid", "line", "departure_station", "arrival_station",
+    "name_key", "line_key", "departure_key", "arrival_key",
+)
+
+
+# LAST_INSERT_ID(expr) يعيد نهاية الكتلة لهذا الاتصال فقط، وقفل الصف ينتهي مع commit
+_RESERVE_IDS = """
+    UPDATE ticket_id_sequence
+    SET next_id = LAST_INSERT_ID(
+        GREATEST(next_id, (SELECT COALESCE(MAX(id_ticket), 0) + 1 FROM tickets), %s) + %s
+    )
+    WHERE id = 1
+"""
+
+
+class WriterUnavailableError(Exception):
+    pass
+
+
+def row_key(row):
+    """seat_index slot key of a journaled ticket row."""
+    return (row["date_ticket_time"], row["line_key"], row["departure_key"], row["arrival_key"], row["vip"])
+
+
+class BookingJournal:
+    """Append-only JSON-lines journal with group fsync.
+
+    Every accepted booking is appended and fsynced before the request is
+    answered; threads that arrive while another thread is syncing are covered
+    by that sync. "flushed" records mark tickets that reached MySQL, so replay
+    only re-inserts the rest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._file = open(path, "ab")
+        self._written = 0
+        self._synced = 0
+
+    def read(self):
+        """(unflushed booking rows, highest id seen) from the journal on disk."""
+        bookings, flushed, max_id = {}, set(), 0
+        with open(self.path, "rb") as journal:
+            for number, line in enumerate(journal, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # السطر الأخير قد يكون مقطوعاً إذا توقفت العملية أثناء الكتابة؛ لم يُؤكَّد لأحد
+                    log_warning("booking_journal_torn_record", path=self.path, line=number)
+                    continue
+                if record["op"] == "book":
+                    bookings[record["t"]["id_ticket"]] = record["t"]
+                    max_id = max(max_id, record["t"]["id_ticket"])
+                elif record["op"] == "flushed":
+                    flushed.update(record["ids"])
+        return [row for ticket_id, row in sorted(bookings.items()) if ticket_id not in flushed], max_id
+
+    def append(self, record, sync=True):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._file.write(line)
+            self._written += 1
+            sequence = self._written
+        if sync:
+            self._sync(sequence)
+
+    def _sync(self, sequence):
+        with self._sync_lock:
+            if self._synced >= sequence:
+                return
+            with self._lock:
+                self._file.flush()
+                target = self._written
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    def size(self):
+        with self._lock:
+            return self._file.tell()
+
+    def truncate(self):
+        """Start an empty journal; only called when nothing is waiting to be flushed."""
+        with self._sync_lock, self._lock:
+            self._file.close()
+            self._file = open(self.path, "wb")
+            os.fsync(self._file.fileno())
+            self._written = self._synced = 0
+
+
+class BookingWriter:
+    """Write-behind bookings: accept from memory, persist in group commits.
+
+    accept() checks the seat against the seat index and the ledger, gives the
+    ticket an id from a block reserved in MySQL, journals it and returns. The
+    ledger keeps every seat this process booked until it is cancelled or its
+    departure passes, not only until the flush: a seat index loaded between
+    accept() and the flush does not show the seat, and would let a second
+    booking for it through. On lines with a known topology the ledger also
+    keeps each booking's legs per train, so an overlapping segment of the same
+    seat is refused too. A background thread inserts queued tickets, their
+    seat_claims rows and their seat_leg_claims rows in batches, one transaction
+    per batch, and fsyncs a "flushed" record after each commit. Tickets carry
+    explicit ids; replaying a batch that was already committed (crash between
+    COMMIT and the "flushed" record) skips every ticket whose id is already in
+    MySQL, so tickets cancelled or moved since then keep their current state.
+
+    The ledger only knows this process's bookings, so the mode needs a single
+    booking process (WEB_WORKERS=1; gunicorn.conf.py enforces it).
+    """
+
+    def __init__(self, enabled=False, journal_path="journal/bookings.log", batch_size=500,
+                 flush_interval=0.05, id_block=1000, journal_max_bytes=64 * 1024 * 1024):
+        self.enabled = enabled
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block = id_block
+        self.journal_max_bytes = journal_max_bytes
+
+        self._journal = None
+        self._get_connection = None
+        self._on_conflict = None
+        self._on_written = None
+        self._journey = lambda key: None
+        self._ready = threading.Event()
+        self._thread = None
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._queue = deque()
+        self._seats = {}
+        self._legs = {}
+        self._pending_ids = set()
+        self._pruned_at = 0.0
+        self._next_id = 0
+        self._block_end = 0
+        self._id_floor = 1
+
+        self.accepted = 0
+        self.flushed = 0
+        self.batches = 0
+        self.replayed = 0
+        self.conflicts = 0
+        self.last_error = None
+        self._flush_counts = [0] * (len(FLUSH_BUCKETS_MS) + 1)
+        self._flush_sum_ms = 0.0
+
+    def start(self, get_connection, on_conflict=None, on_written=None, journey=None):
+        """Replay the journal and start the writer thread (no-op unless enabled).
+
+        on_written(cursor, rows) runs inside each batch transaction with the
+        tickets that were inserted by it and kept their seat. journey(key) is
+        seat_segments.journey: (train, leg mask, first leg, end leg) or None.
+        """
+        if not self.enabled or self._thread is not None:
+            return
+        self._get_connection = get_connection
+        self._on_conflict = on_conflict
+        self._on_written = on_written
+        if journey is not None:
+            self._journey = journey
+        self._journal = BookingJournal(self.journal_path)
+        self._thread = threading.Thread(target=self._run, name="booking-writer", daemon=True)
+        self._thread.start()
+
+    # ---- قبول الحجز ----
+
+    def _reserve_ids(self, cursor):
+        """Reserve [start, start + id_block) from ticket_id_sequence (migrations/009)."""
+        # GREATEST: الحجز المتزامن (وضع sync أو قبل تفعيل هذا الوضع) يأخذ أرقامه من AUTO_INCREMENT،
+        # فتبدأ الكتلة بعد أكبر رقم في tickets وبعد كل رقم ظهر في السجل
+        cursor.execute(_RESERVE_IDS, (self._id_floor, self.id_block))
+        if cursor.rowcount != 1:
+            raise RuntimeError("ticket_id_sequence has no row; apply migrations/009_ticket_id_sequence.sql")
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        end = int(cursor.fetchone()[0])
+        return end - self.id_block, end
+
+    def _next_ticket_id(self):
+        # يُستدعى والقفل مأخوذ؛ حجز كتلة جديدة نادر (مرة كل id_block حجز) وهو تحديث صف واحد
+        if self._next_id >= self._block_end:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            try:
+                self._next_id, self._block_end = self._reserve_ids(cursor)
+                conn.commit()
+            finally:
+                cursor.close()
+                conn.close()
+        ticket_id = self._next_id
+        self._next_id += 1
+        return ticket_id
+
+    # الدفتر حسب الأجزاء: {(القطار، المقعد): {مفتاح الرحلة: قناع أجزائها}}؛ تُستدعى والقفل مأخوذ
+
+    def _legs_taken(self, key, seat):
+        journey = self._journey(key)
+        if journey is None:
+            return False
+        owners = self._legs.get((journey[0], seat), {})
+        return any(mask & journey[1] for mask in owners.values())
+
+    def _book_seat(self, key, seat, ticket_id):
+        self._seats[(key, seat)] = ticket_id
+        journey = self._journey(key)
+        if journey is not None:
+            self._legs.setdefault((journey[0], seat), {})[key] = journey[1]
+
+    def _unbook_seat(self, key, seat):
+        self._seats.pop((key, seat), None)
+        journey = self._journey(key)
+        if journey is not None:
+            owners = self._legs.get((journey[0], seat))
+            if owners is not None:
+                owners.pop(key, None)
+                if not owners:
+                    del self._legs[(journey[0], seat)]
+
+    def accept(self, key, seat_number, ticket, seat_taken):
+        """Book from memory; returns the new ticket id, or None if the seat is taken.
+
+        `ticket` holds the tickets columns except id_ticket; `seat_taken` says
+        whether the seat index (or the segment inventory) already shows the seat
+        as claimed in MySQL.
+        """
+        if not self._ready.wait(timeout=5):
+            raise WriterUnavailableError("Booking writer is still replaying its journal")
+        seat = str(seat_number).strip()
+        with self._lock:
+            if seat_taken or (key, seat) in self._seats or self._legs_taken(key, seat):
+                return None
+            ticket_id = self._next_ticket_id()
+            self._book_seat(key, seat, ticket_id)
+            self._pending_ids.add(ticket_id)
+
+        # يُكتب في السجل (مع fsync) قبل دخول الطابور وقبل الرد على العميل
+        row = dict(ticket, id_ticket=ticket_id, seat_number=seat)
+        try:
+            self._journal.append({"op": "book", "t": row})
+        except Exception:
+            with self._lock:
+                self._unbook_seat(key, seat)
+                self._pending_ids.discard(ticket_id)
+            raise
+
+        with self._lock:
+            self._queue.append((key, seat, row))
+            self.accepted += 1
+            self._wakeup.notify()
+        return ticket_id
+
+    def claim_seat(self, key, seat_number):
+        """Keep write-behind bookings off a seat a synchronous path is about to claim in MySQL.
+
+        False if this process already booked it, or an overlapping segment of
+        it on the same train. The caller gives the seat back
+        with release_seat() if its own claim fails, or when it later frees it.
+        """
+        if not self.enabled:
+            return True
+        seat = str(seat_number).strip()
+        with self._lock:
+            if (key, seat) in self._seats or self._legs_taken(key, seat):
+                return False
+            self._book_seat(key, seat, None)
+            return True
+
+    def release_seat(self, key, seat_number):
+        """A booked seat was cancelled or moved away from; it can be sold again."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._unbook_seat(key, str(seat_number).strip())
+
+    def _wait(self, done, timeout):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._wakeup.notify()
+        while not done():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(self.flush_interval / 2)
+        return True
+
+    def wait_flushed(self, ticket_id, timeout=5.0):
+        """Block until `ticket_id` is in MySQL, so edits and cancellations can find it."""
+        if not self.enabled:
+            return True
+        try:
+            ticket_id = int(ticket_id)
+        except (TypeError, ValueError):
+            return True
+        return self._wait(lambda: ticket_id not in self._pending_ids, timeout)
+
+    def drain(self, timeout=5.0):
+        """Block until every accepted booking is in MySQL (e.g. before cancelling a whole departure)."""
+        if not self.enabled:
+            return True
+        return self._wait(lambda: not self._pending_ids, timeout)
+
+    # ---- الكاتب الخلفي ----
+
+    def _run(self):
+        while not self._ready.is_set():
+            try:
+                self._replay()
+                self._ready.set()
+            except Exception as e:
+                self.last_error = str(e)
+                log_error("booking_journal_replay_failed", e)
+                time.sleep(2)
+
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._wakeup.wait(self.flush_interval)
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if not batch:
+                self._maybe_compact()
+                continue
+            try:
+                self._flush(batch)
+            except Exception as e:
+                self.last_error = str(e)
+                log_error("booking_flush_failed", e, tickets=len(batch))
+                with self._lock:
+                    self._queue.extendleft(reversed(batch))
+                time.sleep(1)
+
+    def _replay(self):
+        rows, max_id = self._journal.read()
+        if rows:
+            log_event("booking_journal_replay", sample=1, bookings=len(rows))
+            for start in range(0, len(rows), self.batch_size):
+                chunk = rows[start:start + self.batch_size]
+                # دفعة ربما وصلت إلى قاعدة البيانات قبل التوقف ثم أُلغيت تذاكرها أو نُقلت:
+                # ما في MySQL هو المرجع، فلا تُعاد مطالباتها ولا تُلغى بسبب مقعدها القديم
+                written = self._written_ids(chunk)
+                fresh = [row for row in chunk if row["id_ticket"] not in written]
+                lost = set(self._write(fresh)) if fresh else set()
+                self._journal.append({"op": "flushed", "ids": [row["id_ticket"] for row in chunk]})
+                # فهرس المقاعد قد يُحمَّل قبل انتهاء الإعادة، فالدفتر يحفظ مقاعدها كما يحفظ المقبول حديثاً
+                with self._lock:
+                    for row in fresh:
+                        if row["id_ticket"] not in lost:
+                            self._book_seat(row_key(row), row["seat_number"], row["id_ticket"])
+                self._report_lost(sorted(lost))
+            self.replayed += len(rows)
+        # الكتلة الجديدة تبدأ بعد كل رقم ظهر في السجل، حتى لو لم يصل إلى قاعدة البيانات
+        self._id_floor = max_id + 1
+        self._journal.truncate()
+
+    def _report_lost(self, lost):
+        if not lost:
+            return
+        with self._lock:
+            self.conflicts += len(lost)
+        log_error("write_behind_seat_lost", "seat taken by another process before the flush", ticket_ids=lost)
+        if self._on_conflict:
+            for ticket_id in lost:
+                self._on_conflict(ticket_id)
+
+    def _written_ids(self, rows):
+        """Ids among journaled `rows` that already have a tickets row (in any slot, paid or not)."""
+        ids = [row["id_ticket"] for row in rows]
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT DISTINCT id_ticket FROM tickets WHERE id_ticket IN (" + ", ".join(["%s"] * len(ids)) + ")",
+                tuple(ids)
+            )
+            return {row[0] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _write(self, rows):
+        """Insert tickets and their claims in one transaction; returns ids whose claim lost."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            row_sql = "(" + ", ".join(["%s"] * len(TICKET_COLUMNS)) + ")"
+            cursor.execute(
+                "INSERT IGNORE INTO tickets (" + ", ".join(TICKET_COLUMNS) + ") VALUES " +
+                ", ".join([row_sql] * len(rows)),
+                tuple(row[column] for row in rows for column in TICKET_COLUMNS)
+            )
+            claim_sql = "(%s, %s, %s, %s, %s, %s, %s)"
+            cursor.execute(
+                "INSERT IGNORE INTO seat_claims (slot_time, line_key, departure_key, arrival_key, vip, "
+                "seat_number, ticket_id) VALUES " +
+                ", ".join([claim_sql] * len(rows)),
+                tuple(value for row in rows for value in (
+                    row["date_ticket_time"], row["line_key"], row["departure_key"], row["arrival_key"],
+                    row["vip"], row["seat_number"], row["id_ticket"]
+                ))
+            )
+            lost = []
+            if cursor.rowcount < len(rows):
+                # مقعد أخذته عملية أخرى بين القبول والكتابة: تُحفظ التذكرة ملغاة ويُبلَّغ عنها
+                ids = [row["id_ticket"] for row in rows]
+                cursor.execute(
+                    "SELECT ticket_id FROM seat_claims WHERE ticket_id IN (" + ", ".join(["%s"] * len(ids)) + ")",
+                    tuple(ids)
+                )
+                claimed = {row[0] for row in cursor.fetchall()}
+                lost = [ticket_id for ticket_id in ids if ticket_id not in claimed]
+            journeys = [(row, self._journey(row_key(row))) for row in rows if row["id_ticket"] not in lost]
+            lost += self._claim_legs(cursor, [(row, journey) for row, journey in journeys if journey is not None])
+            if lost:
+                cursor.execute(
+                    "UPDATE tickets SET paid = 0 WHERE id_ticket IN (" + ", ".join(["%s"] * len(lost)) + ")",
+                    tuple(lost)
+                )
+            if self._on_written:
+                self._on_written(cursor, [row for row in rows if row["id_ticket"] not in lost])
+            conn.commit()
+            return lost
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _claim_legs(self, cursor, rows):
+        """seat_leg_claims for (row, journey) pairs; returns the ids that lost a leg, with their seat claim removed."""
+        if not rows:
+            return []
+        values, expected = (), {}
+        for row, (train, _, first_leg, end_leg) in rows:
+            for leg in range(first_leg, end_leg):
+                values += tuple(train) + (row["seat_number"], leg, row["id_ticket"])
+            expected[row["id_ticket"]] = end_leg - first_leg
+        cursor.execute(
+            "INSERT IGNORE INTO seat_leg_claims (slot_time, line_key, direction, vip, seat_number, leg, ticket_id) "
+            "VALUES " + ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * (len(values) // 7)),
+            values
+        )
+        if cursor.rowcount == sum(expected.values()):
+            return []
+        # جزء باعه حجز متزامن أو حجز مؤقت قبل الكتابة
+        ids = list(expected)
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(
+            "SELECT ticket_id, COUNT(*) FROM seat_leg_claims WHERE ticket_id IN (" + placeholders + ") "
+            "GROUP BY ticket_id",
+            tuple(ids)
+        )
+        claimed = dict(cursor.fetchall())
+        lost = [ticket_id for ticket_id in ids if claimed.get(ticket_id, 0) < expected[ticket_id]]
+        if lost:
+            placeholders = ", ".join(["%s"] * len(lost))
+            cursor.execute("DELETE FROM seat_leg_claims WHERE ticket_id IN (" + placeholders + ")", tuple(lost))
+            cursor.execute("DELETE FROM seat_claims WHERE ticket_id IN (" + placeholders + ")", tuple(lost))
+        return lost
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        lost = self._write([row for _, _, row in batch])
+        # مع fsync قبل أن تتحرر wait_flushed وقبل أي ضغط للسجل: علامة ضائعة تعني إعادة الدفعة بعد التوقف
+        self._journal.append({"op": "flushed", "ids": [row["id_ticket"] for _, _, row in batch]})
+        elapsed_ms = (time.monotonic() - started) * 1000
+
+        with self._lock:
+            for key, seat, row in batch:
+                self._pending_ids.discard(row["id_ticket"])
+                if row["id_ticket"] in lost and self._seats.get((key, seat)) == row["id_ticket"]:
+                    self._unbook_seat(key, seat)
+            self.flushed += len(batch)
+            self.batches += 1
+            self.last_error = None
+            index = next((i for i, bound in enumerate(FLUSH_BUCKETS_MS) if elapsed_ms <= bound), len(FLUSH_BUCKETS_MS))
+            self._flush_counts[index] += 1
+            self._flush_sum_ms += elapsed_ms
+        self._report_lost(lost)
+
+    def _prune_seats(self):
+        # مرة في الدقيقة عند خلو الطابور: رحلات غادرت لا تُحجز مرة أخرى
+        if time.monotonic() - self._pruned_at < 60:
+            return
+        self._pruned_at = time.monotonic()
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            for key_seat in [key_seat for key_seat in self._seats if str(key_seat[0][0]) < now]:
+                del self._seats[key_seat]
+            for train_seat in [train_seat for train_seat in self._legs if str(train_seat[0][0]) < now]:
+                del self._legs[train_seat]
+
+    def _maybe_compact(self):
+        self._prune_seats()
+        if self._journal.size() < self.journal_max_bytes:
+            return
+        with self._lock:
+            if self._pending_ids:
+                return
+            # كل ما في السجل وصل إلى قاعدة البيانات؛ لا حاجة لإعادة تشغيله
+            self._journal.truncate()
+
+    def stats(self):
+        with self._lock:
+            buckets, cumulative = {}, 0
+            for bound, count in zip(FLUSH_BUCKETS_MS, self._flush_counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = self.batches
+            return {
+                "mode": "write_behind" if self.enabled else "sync",
+                "ready": self._ready.is_set(),
+                "queue_depth": len(self._pending_ids),
+                "accepted": self.accepted,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "replayed": self.replayed,
+                "conflicts": self.conflicts,
+                "journal_bytes": self._journal.size() if self._journal else 0,
+                "last_error": self.last_error,
+                "flush_latency_ms": {
+                    "buckets": buckets,
+                    "sum": round(self._flush_sum_ms, 3),
+                    "count": self.batches,
+                },
+            }
+
+
+booking_writer = BookingWriter(**WRITER_SETTINGS)
@@ -1,10 +1,476 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
 import mysql.connector
 
+from event_log import log_warning
+from metrics import InstrumentedCursor
+
+DB_SETTINGS = {
+    "host": os.environ.get("DB_HOST", "127.0.0.1"),
+    "user": os.environ.get("DB_USER", "root"),
+    "password": os.environ.get("DB_PASSWORD", "shouq2002"),
+    "port": int(os.environ.get("DB_PORT", 3306)),
+    "database": os.environ.get("DB_NAME", "tashilat"),
+}
+
+# إعدادات تجمع الاتصالات (يمكن تعديلها من متغيرات البيئة)
+POOL_SETTINGS = {
+    "size": int(os.environ.get("DB_POOL_SIZE", 10)),
+    "max_overflow": int(os.environ.get("DB_POOL_MAX_OVERFLOW", 5)),
+    "timeout": float(os.environ.get("DB_POOL_TIMEOUT", 5)),
+    "recycle": float(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    "pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true",
+}
+
+# النسخ المتماثلة للقراءة: "host:port:weight,host:port:weight" (المنفذ والوزن اختياريان).
+# المستخدم وكلمة المرور وقاعدة البيانات كالأساسية ما لم تُحدَّد DB_REPLICA_USER / DB_REPLICA_PASSWORD.
+# تُستبعد النسخة حين يتجاوز تأخرها max_lag ثانية أو يفشل الاتصال بها، وتعود حين ينزل تحت نصفه.
+REPLICA_SETTINGS = {
+    "replicas": os.environ.get("DB_REPLICAS", ""),
+    "max_lag": float(os.environ.get("DB_REPLICA_MAX_LAG", 2)),
+    "check_interval": float(os.environ.get("DB_REPLICA_CHECK_INTERVAL", 1)),
+    # status: SHOW REPLICA STATUS (يحتاج صلاحية REPLICATION CLIENT)
+    # heartbeat: صف replication_heartbeat يكتبه المراقب على الأساسية كل check_interval (migrations/008)
+    "lag_source": os.environ.get("DB_REPLICA_LAG_SOURCE", "status"),
+}
+
+# حدود مدرج زمن انتظار الحصول على اتصال (بالملي ثانية)
+WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class PooledConnection:
+    """Wraps a raw MySQL connection; close() hands it back to the pool."""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._returned = False
+
+    def close(self):
+        if self._returned:
+            return
+        self._returned = True
+        self._pool._release(self._raw, self._created_at)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._raw.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class ConnectionPool:
+    def __init__(self, size=10, max_overflow=5, timeout=5.0, recycle=1800.0,
+                 pre_ping=True, connect_kwargs=None):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.connect_kwargs = connect_kwargs or {}
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._opened = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        self._wait_counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._wait_sum_ms = 0.0
+        self._wait_total = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._failed_pings = 0
+
+    def _connect(self):
+        return mysql.connector.connect(**self.connect_kwargs)
+
+    def _is_usable(self, raw):
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _record_wait(self, wait_ms):
+        index = len(WAIT_BUCKETS_MS)
+        for i, bound in enumerate(WAIT_BUCKETS_MS):
+            if wait_ms <= bound:
+                index = i
+                break
+        self._wait_counts[index] += 1
+        self._wait_sum_ms += wait_ms
+        self._wait_total += 1
+
+    def get_connection(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        raw = None
+        created_at = None
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        # LIFO: أحدث اتصال مستخدم هو الأكثر "دفئاً"
+                        raw, created_at = self._idle.pop()
+                        break
+                    if self._opened < self.size + self.max_overflow:
+                        self._opened += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {self.timeout}s waiting for a database connection"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+
+        try:
+            if raw is not None:
+                if self.recycle and time.monotonic() - created_at > self.recycle:
+                    self._discard(raw)
+                    raw = None
+                    with self._cond:
+                        self._recycled += 1
+                elif self.pre_ping and not self._is_usable(raw):
+                    self._discard(raw)
+                    raw = None
+                    with self._cond:
+                        self._failed_pings += 1
+            if raw is None:
+                raw = self._connect()
+                created_at = time.monotonic()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._record_wait((time.monotonic() - started) * 1000)
+        return PooledConnection(self, raw, created_at)
+
+    def _release(self, raw, created_at):
+        reusable = True
+        try:
+            # لا نعيد اتصالاً يحمل معاملة مفتوحة أو أقفالاً إلى التجمع
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            reusable = False
+
+        with self._cond:
+            self._in_use -= 1
+            if reusable and len(self._idle) < self.size:
+                self._idle.append((raw, created_at))
+                raw = None
+            else:
+                self._opened -= 1
+            self._cond.notify()
+
+        if raw is not None:
+            self._discard(raw)
+
+    def close_idle(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for raw, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            buckets = {}
+            cumulative = 0
+            for bound, count in zip(WAIT_BUCKETS_MS, self._wait_counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = self._wait_total
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "opened": self._opened,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "failed_pings": self._failed_pings,
+                "checkout_wait_ms": {
+                    "buckets": buckets,
+                    "sum": round(self._wait_sum_ms, 3),
+                    "count": self._wait_total,
+                },
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(connect_kwargs=DB_SETTINGS, **POOL_SETTINGS)
+    return _pool
+
+
 def get_connection():
-    return mysql.connector.connect(
-        host="127.0.0.1",
-        user="root",
-        password="shouq2002",
-        port=3306,
-        database="tashilat"
-    )
+    return get_pool().get_connection()
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def parse_replicas(spec):
+    """Parse "host[:port[:weight]],..." into (host, port, weight) tuples."""
+    replicas = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(":")
+        if len(parts) > 3 or not parts[0]:
+            raise ValueError(f"Invalid replica '{item}', expected host[:port[:weight]]")
+        port = int(parts[1]) if len(parts) > 1 and parts[1] else 3306
+        weight = float(parts[2]) if len(parts) > 2 else 1.0
+        if weight <= 0:
+            raise ValueError(f"Replica '{item}' needs a positive weight")
+        replicas.append((parts[0], port, weight))
+    return replicas
+
+
+class Replica:
+    """One read replica: its own pool, weight and last measured lag."""
+
+    def __init__(self, host, port, weight, connect_kwargs, pool_settings):
+        self.name = f"{host}:{port}"
+        self.weight = weight
+        self.pool = ConnectionPool(connect_kwargs=connect_kwargs, **pool_settings)
+        self.healthy = True
+        self.lag = None
+        self.reads = 0
+        self.errors = 0
+        self.ejections = 0
+        self.last_error = None
+
+
+class ReplicaRouter:
+    """Sends read-only queries to healthy replicas, everything else to the primary.
+
+    A replica is picked at random in proportion to its weight. A monitor
+    thread measures each replica's lag every check_interval seconds, ejects
+    replicas lagging more than max_lag (or not replicating at all) and
+    readmits them once lag drops to max_lag / 2, so a replica hovering around
+    the limit does not flap. A replica that fails to hand out a connection is
+    ejected on the spot until the monitor sees it healthy again. With no
+    healthy replica, reads fall back to the primary.
+    """
+
+    def __init__(self, primary, replicas, max_lag=2.0, check_interval=1.0, lag_source="status",
+                 connect_kwargs=None, pool_settings=None):
+        self.primary = primary
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag_source = lag_source
+        self.replicas = [Replica(host, port, weight, dict(connect_kwargs or {}, host=host, port=port),
+                                 pool_settings or {})
+                         for host, port, weight in replicas]
+        self._lock = threading.Lock()
+        self._monitor_pid = None
+        self.primary_reads = 0
+        self.fallbacks = 0
+
+    def _ensure_monitor(self):
+        # خيط المراقبة لا ينجو من fork، فكل عامل يبدأ خيطه عند أول قراءة
+        if not self.replicas or self._monitor_pid == os.getpid():
+            return
+        with self._lock:
+            if self._monitor_pid == os.getpid():
+                return
+            self._monitor_pid = os.getpid()
+        threading.Thread(target=self._monitor, name="replica-monitor", daemon=True).start()
+
+    def _pick(self):
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return random.choices(healthy, weights=[replica.weight for replica in healthy])[0]
+
+    def get_connection(self, sticky=False):
+        """A connection for a read-only query; `sticky` forces the primary (read-your-writes)."""
+        self._ensure_monitor()
+        if not sticky:
+            # النسخة الفاشلة تُستبعد فوراً، فكل محاولة تالية تختار من نسخ أقل
+            replica = self._pick()
+            while replica is not None:
+                try:
+                    conn = replica.pool.get_connection()
+                except PoolTimeoutError:
+                    # تجمع مشغول وليس نسخة معطلة: لا استبعاد، القراءة تذهب للأساسية
+                    break
+                except Exception as e:
+                    self._eject(replica, str(e))
+                    replica = self._pick()
+                    continue
+                with self._lock:
+                    replica.reads += 1
+                return conn
+            if self.replicas:
+                with self._lock:
+                    self.fallbacks += 1
+        with self._lock:
+            self.primary_reads += 1
+        return self.primary.get_connection()
+
+    def _eject(self, replica, reason):
+        with self._lock:
+            replica.last_error = reason
+            replica.errors += 1
+            if not replica.healthy:
+                return
+            replica.healthy = False
+            replica.ejections += 1
+        log_warning("replica_ejected", replica=replica.name, reason=reason, lag=replica.lag)
+
+    def _readmit(self, replica):
+        with self._lock:
+            if replica.healthy:
+                return
+            replica.healthy = True
+        log_warning("replica_readmitted", replica=replica.name, lag=replica.lag)
+
+    def _monitor(self):
+        while True:
+            if self.lag_source == "heartbeat":
+                self._beat()
+            for replica in self.replicas:
+                try:
+                    lag = self.measure_lag(replica)
+                except Exception as e:
+                    replica.lag = None
+                    self._eject(replica, str(e))
+                    continue
+                replica.lag = lag
+                if lag is None:
+                    self._eject(replica, "replication stopped")
+                elif lag > self.max_lag:
+                    self._eject(replica, f"lag {lag}s > {self.max_lag}s")
+                elif lag <= self.max_lag / 2:
+                    self._readmit(replica)
+            time.sleep(self.check_interval)
+
+    def _beat(self):
+        try:
+            conn = self.primary.get_connection()
+        except Exception as e:
+            log_warning("replica_heartbeat_failed", error=str(e))
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute("REPLACE INTO replication_heartbeat (id, ts) VALUES (1, UTC_TIMESTAMP(6))")
+            conn.commit()
+        except Exception as e:
+            log_warning("replica_heartbeat_failed", error=str(e))
+        finally:
+            cursor.close()
+            conn.close()
+
+    def measure_lag(self, replica):
+        """Seconds the replica is behind, or None when it is not replicating."""
+        conn = replica.pool.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            if self.lag_source == "heartbeat":
+                cursor.execute("SELECT TIMESTAMPDIFF(MICROSECOND, ts, UTC_TIMESTAMP(6)) / 1e6 AS lag"
+                               " FROM replication_heartbeat WHERE id = 1")
+                row = cursor.fetchone()
+                return max(0.0, float(row["lag"])) if row and row["lag"] is not None else None
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except mysql.connector.Error:
+                # MySQL قبل 8.0.22 / MariaDB
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            if not row:
+                return None
+            lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+            return float(lag) if lag is not None else None
+        finally:
+            cursor.close()
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_lag": self.max_lag,
+                "lag_source": self.lag_source,
+                "primary_reads": self.primary_reads,
+                "fallbacks": self.fallbacks,
+                "replicas": [{
+                    "name": replica.name,
+                    "weight": replica.weight,
+                    "healthy": replica.healthy,
+                    "lag": replica.lag,
+                    "reads": replica.reads,
+                    "errors": replica.errors,
+                    "ejections": replica.ejections,
+                    "last_error": replica.last_error,
+                    "pool": replica.pool.stats(),
+                } for replica in self.replicas],
+            }
+
+
+_router = None
+
+
+def get_router():
+    global _router
+    if _router is None:
+        primary = get_pool()
+        with _pool_lock:
+            if _router is None:
+                replica_kwargs = dict(DB_SETTINGS,
+                                      user=os.environ.get("DB_REPLICA_USER", DB_SETTINGS["user"]),
+                                      password=os.environ.get("DB_REPLICA_PASSWORD", DB_SETTINGS["password"]))
+                settings = dict(REPLICA_SETTINGS)
+                replicas = parse_replicas(settings.pop("replicas"))
+                _router = ReplicaRouter(primary, replicas, connect_kwargs=replica_kwargs,
+                                        pool_settings=POOL_SETTINGS, **settings)
+    return _router
+
+
+def get_read_connection(sticky=False):
+    """Connection for read-only handlers: a replica when configured and healthy, else the primary."""
+    return get_router().get_connection(sticky=sticky)
+
+
+def replica_stats():
+    return get_router().stats()
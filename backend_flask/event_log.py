@@ -0,0 +1,67 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import traceback
+
+# سجل أحداث منظم (سطر JSON لكل حدث) يُكتب من خيط مستقل عبر طابور،
+# فلا ينتظر خيط الطلب الكتابة على الطرفية. أحداث INFO على المسارات الساخنة
+# تُؤخذ منها عينة فقط؛ التحذيرات والأخطاء تُسجَّل دائماً.
+LOG_SETTINGS = {
+    "sample_rate": float(os.environ.get("LOG_SAMPLE_RATE", 0.01)),
+    "level": os.environ.get("LOG_LEVEL", "INFO").upper(),
+}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_queue = queue.SimpleQueue()
+_handler = logging.StreamHandler()
+_handler.setFormatter(JsonFormatter())
+_listener = logging.handlers.QueueListener(_queue, _handler)
+_listener.start()
+atexit.register(_listener.stop)
+
+logger = logging.getLogger("reserve_and_ride")
+logger.setLevel(LOG_SETTINGS["level"])
+logger.addHandler(logging.handlers.QueueHandler(_queue))
+logger.propagate = False
+
+
+def log_event(event, level=logging.INFO, sample=None, exc_info=False, **fields):
+    """Log `event` with key/value fields. INFO events are kept with probability
+    `sample` (LOG_SAMPLE_RATE by default); pass sample=1 for events that must appear."""
+    if level <= logging.INFO:
+        rate = LOG_SETTINGS["sample_rate"] if sample is None else sample
+        if rate < 1 and random.random() >= rate:
+            return
+    if exc_info:
+        # المكدس حقل عادي: QueueHandler يدمج exc_info في نص الحدث قبل أن يصل إلى JsonFormatter
+        exc_info = exc_info if isinstance(exc_info, tuple) else sys.exc_info()
+        fields["traceback"] = "".join(traceback.format_exception(*exc_info))
+    logger.log(level, event, extra={"fields": fields})
+
+
+def log_error(event, error, **fields):
+    """Log `error` and, when it is a raised exception, its stack in a "traceback" field."""
+    exc_info = False
+    if isinstance(error, BaseException) and error.__traceback__ is not None:
+        exc_info = (type(error), error, error.__traceback__)
+    log_event(event, logging.ERROR, exc_info=exc_info, error=str(error), **fields)
+
+
+def log_warning(event, **fields):
+    log_event(event, logging.WARNING, **fields)
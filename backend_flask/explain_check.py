@@ -0,0 +1,67 @@
+import sys
+
+import queries
+from db_config import get_connection
+
+# (الاسم، الاستعلام، معاملات تجريبية) — يُفضَّل التشغيل على قاعدة بيانات فيها بيانات
+# بحجم واقعي، لأن MySQL قد يختار المسح الكامل عمداً على الجداول الصغيرة جداً.
+HOT_QUERIES = [
+    ("login", queries.USER_LOGIN, ("passenger",)),
+    ("employee_login_by_id", queries.EMPLOYEE_LOGIN_BY_ID, (1,)),
+    ("employee_login_by_username", queries.EMPLOYEE_LOGIN_BY_USERNAME, ("employee",)),
+    ("employee_active_bookings", queries.EMPLOYEE_ACTIVE_BOOKINGS, (1, 1)),
+    ("active_bookings_by_user", queries.booking_history(queries.ACTIVE_BY_USER, False), (1,)),
+    ("completed_bookings_by_user", queries.booking_history(queries.COMPLETED_BY_USER, True), (1,)),
+    ("completed_bookings_page", queries.booking_history(queries.COMPLETED_BY_USER, True, after=True, limit=True),
+     (1, "2025-01-01 08:00:00", "2025-01-01 08:00:00", 100, 50)),
+    ("active_bookings", queries.booking_history(queries.ACTIVE_BY_NAME, False), ("passenger",)),
+    ("completed_bookings", queries.booking_history(queries.COMPLETED_BY_NAME, True), ("passenger",)),
+    ("seat_status_excluding_ticket", queries.BOOKED_SEATS_EXCLUDING_TICKET,
+     ("2025-01-01 08:00:00", "line", "from", "to", 0, 1)),
+    ("seat_status", queries.SLOT_SEAT_CLAIMS,
+     ("2025-01-01 08:00:00", "line", "from", "to", 0)),
+    ("train_leg_claims", queries.TRAIN_LEG_CLAIMS, ("2025-01-01 08:00:00", "line", 0, 0)),
+    ("train_seats_excluding_ticket", queries.TRAIN_SEATS_EXCLUDING_TICKET,
+     ("2025-01-01 08:00:00", "line", 0, 0, 2, 5, 1)),
+    ("booked_seats", queries.BOOKED_SEATS_BY_TIME, ("2025-01-01 08:00:00",)),
+    ("cancel_by_slot", queries.CANCELLABLE_BY_SLOT, ("2025-01-01 08:00:00", "line")),
+    ("cancel_by_segment", queries.CANCELLABLE_BY_SEGMENT, ("2025-01-01 08:00:00", "line", "from", "to")),
+    ("rollup_occupancy", queries.rollup_occupancy(True),
+     ("2025-01-01 00:00:00", "2025-01-02 00:00:00", "line")),
+    ("rollup_minutes", queries.rollup_minutes(False), ("2025-01-01 08:00:00", "2025-01-01 09:00:00")),
+    ("rollup_cancellations_by_line", queries.ROLLUP_CANCELLATIONS_BY_LINE,
+     ("2025-01-01 00:00:00", "2025-01-02 00:00:00")),
+    ("verify_ticket", queries.VERIFY_TICKET, (1,)),
+    ("verify_ticket_window", queries.VERIFY_TICKET_WINDOW,
+     ("2025-01-01 00:00:00", "2025-01-02 00:00:00", 0)),
+]
+
+
+def explain_hot_queries():
+    """تشغيل EXPLAIN على كل استعلام ساخن وإرجاع قائمة الاستعلامات التي تمسح جدولاً كاملاً."""
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    failures = []
+    try:
+        for name, sql, params in HOT_QUERIES:
+            cursor.execute("EXPLAIN " + sql, params)
+            for row in cursor.fetchall():
+                access = row.get("type")
+                print(f"{name:32} table={row.get('table')} type={access} key={row.get('key')} rows={row.get('rows')}")
+                if access == "ALL":
+                    failures.append((name, row.get("table")))
+    finally:
+        cursor.close()
+        conn.close()
+    return failures
+
+
+if __name__ == "__main__":
+    failures = explain_hot_queries()
+    if failures:
+        print("="*50)
+        for name, table in failures:
+            print(f"❌ {name}: مسح كامل للجدول {table}")
+        print("="*50)
+        sys.exit(1)
+    print("✅ كل الاستعلامات الساخنة تستخدم فهارس.")
@@ -0,0 +1,56 @@
+import multiprocessing
+import os
+
+# إعدادات خادم الإنتاج؛ كلها قابلة للتعديل من متغيرات البيئة.
+bind = os.environ.get("WEB_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+keepalive = int(os.environ.get("WEB_KEEPALIVE", 5))
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("WEB_MAX_REQUESTS_JITTER", 0))
+backlog = int(os.environ.get("WEB_BACKLOG", 2048))
+reload = os.environ.get("WEB_RELOAD", "false").lower() == "true"
+
+# دفتر الحجز المؤجل (booking_writer.py) في ذاكرة العملية، فلا يصح إلا مع عامل واحد
+if os.environ.get("BOOKING_MODE", "sync").lower() == "write_behind" and workers != 1:
+    raise RuntimeError("BOOKING_MODE=write_behind needs WEB_WORKERS=1 (raise WEB_THREADS instead)")
+
+# يُحمَّل التطبيق داخل كل عامل بعد fork، فيبني كل عامل تجمع اتصالاته وفهارسه
+# الخاصة ولا تُشارَك مقابس MySQL بين العمليات. إعادة التحميل السلسة: kill -HUP <master pid>.
+preload_app = False
+
+accesslog = os.environ.get("WEB_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.environ.get("WEB_LOG_LEVEL", "info")
+
+
+def pool_size_per_worker(workers, threads, max_connections=None):
+    """(حجم التجمع، الفائض) لكل عامل: خيط الطلب لا يحمل أكثر من اتصال واحد،
+    والمجموع على كل العمال لا يتجاوز DB_MAX_CONNECTIONS إن حُدّد."""
+    if not max_connections:
+        return threads, 2
+    budget = max(1, max_connections // workers)
+    size = min(threads, budget)
+    return size, budget - size
+
+
+# تُقرأ في db_config عند استيراده داخل كل عامل؛ القيم المحددة صراحةً لها الأولوية.
+_size, _overflow = pool_size_per_worker(workers, threads, int(os.environ.get("DB_MAX_CONNECTIONS", 0)))
+os.environ.setdefault("DB_POOL_SIZE", str(_size))
+os.environ.setdefault("DB_POOL_MAX_OVERFLOW", str(_overflow))
+
+# كل بث /seat_events يشغل خيطاً من خيوط العامل حتى SEAT_EVENTS_MAX_STREAM (300 ثانية)؛ الحد لكل عامل
+# يبقى ربع الخيوط (واحد على الأقل) حتى لا تأخذ الخرائط الحية خيوط /book و /login
+os.environ.setdefault("SEAT_EVENTS_MAX_SUBSCRIBERS", str(max(1, threads // 4)))
+if int(os.environ["SEAT_EVENTS_MAX_SUBSCRIBERS"]) > max(1, threads // 2):
+    raise RuntimeError("SEAT_EVENTS_MAX_SUBSCRIBERS must stay at or below half of WEB_THREADS "
+                       "(each open seat stream holds a worker thread)")
+
+
+def post_fork(server, worker):
+    server.log.info("Worker %s: DB pool size=%s overflow=%s threads=%s seat streams=%s",
+                    worker.pid, os.environ["DB_POOL_SIZE"], os.environ["DB_POOL_MAX_OVERFLOW"], threads,
+                    os.environ["SEAT_EVENTS_MAX_SUBSCRIBERS"])
@@ -0,0 +1,79 @@
+import datetime
+import decimal
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ترميز JSON لقوائم الحجوزات الطويلة: الصفوف tuples بأعمدة ثابتة (queries.BOOKING_FIELDS)
+# تُرمَّز مباشرة إلى bytes. JSON_CODEC=orjson|stdlib، والافتراضي orjson إن كان مثبتاً.
+JSON_SETTINGS = {
+    "codec": os.environ.get("JSON_CODEC", "auto").lower(),
+}
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def encode_value(value):
+    """Fallback for values the codecs do not encode themselves; datetimes keep the API's format."""
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        # أعمدة TIME تصل من mysql-connector كـ timedelta
+        return str(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class StdlibCodec:
+    """json module with a reused compact encoder; UTF-8 output instead of \\u escapes."""
+
+    name = "stdlib"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=encode_value)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj).encode("utf-8")
+
+    def rows(self, fields, rows):
+        return self.dumps([dict(zip(fields, row)) for row in rows])
+
+
+class OrjsonCodec:
+    """orjson; datetimes are passed through to encode_value so they match the stdlib output."""
+
+    name = "orjson"
+
+    def __init__(self):
+        self._option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=encode_value, option=self._option)
+
+    def rows(self, fields, rows):
+        return self.dumps([dict(zip(fields, row)) for row in rows])
+
+
+CODECS = {"stdlib": StdlibCodec}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec
+
+
+def load_codec(name):
+    if name == "auto":
+        name = "orjson" if "orjson" in CODECS else "stdlib"
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON codec {name!r}; available: {', '.join(sorted(CODECS))}")
+    return CODECS[name]()
+
+
+codec = load_codec(JSON_SETTINGS["codec"])
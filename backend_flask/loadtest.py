@@ -0,0 +1,80 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+# مسارات القراءة الافتراضية: لا تحتاج بيانات مسبقة ولا تغيّر قاعدة البيانات
+DEFAULT_PATHS = ["/healthz/live", "/times", "/healthz/ready"]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def worker(base, paths, deadline, latencies, errors, lock):
+    """عميل واحد بجلسة keep-alive يرسل الطلبات تباعاً حتى انتهاء المدة."""
+    url = urllib.parse.urlsplit(base)
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=10)
+    local_latencies = []
+    local_errors = 0
+    while time.monotonic() < deadline:
+        path = random.choice(paths)
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                local_errors += 1
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=10)
+            continue
+        local_latencies.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors[0] += local_errors
+
+
+def run(base, paths, concurrency, duration):
+    latencies, errors, lock = [], [0], threading.Lock()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=worker, args=(base, paths, deadline, latencies, errors, lock))
+               for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="اختبار حمل بسيط لقياس الإنتاجية وزمن الاستجابة")
+    parser.add_argument("--base", default="http://127.0.0.1:5000")
+    parser.add_argument("--path", action="append", dest="paths", help="يمكن تكراره؛ الافتراضي مسارات القراءة")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.base, args.paths or DEFAULT_PATHS, args.concurrency, args.duration)))
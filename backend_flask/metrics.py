@@ -0,0 +1,207 @@
+import contextvars
+import re
+import threading
+import time
+
+# مقاييس بصيغة Prometheus النصية دون مكتبات خارجية؛ تُعرض على /metrics.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, rendered the way Prometheus expects."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _labels(self.label_names + ("le",), label_values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {round(total, 6)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render_gauges(name, help_text, values):
+    """Lines for a gauge family from {label value (or None): value}; label is "name"."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for label, value in values.items():
+        labels = "" if label is None else _labels(("name",), (label,))
+        lines.append(f"{name}{labels} {value}")
+    return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("route", "method", "status"))
+http_exceptions = Counter(
+    "http_exceptions_total", "Unhandled exceptions by route.", ("route",))
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "Statement execution time by statement name.", ("statement",))
+db_query_rows = Counter(
+    "db_query_rows_total", "Rows fetched by statement name.", ("statement",))
+db_query_errors = Counter(
+    "db_query_errors_total", "Failed statements by statement name.", ("statement",))
+
+REGISTRY = [http_request_duration, http_exceptions, db_query_duration, db_query_rows, db_query_errors]
+
+
+# ---- تسمية الاستعلامات ----
+
+_statement_names = {}
+_fragments = {}
+_statement_lock = threading.Lock()
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+`?(\w+)`?", re.IGNORECASE)
+
+
+def register_statements(module):
+    """Name the SQL constants of `module`: full statements by their own name
+    (queries.SLOT_SEAT_CLAIMS -> "slot_seat_claims") and WHERE fragments such as
+    queries.ACTIVE_BY_USER for the statements built from them."""
+    with _statement_lock:
+        for attribute, value in vars(module).items():
+            if not attribute.isupper() or not isinstance(value, str):
+                continue
+            name = attribute.strip("_").lower()
+            if _TABLE.search(value):
+                _statement_names[value] = name
+            elif "%s" in value:
+                _fragments[value] = name
+
+
+def statement_name(sql):
+    """Stable, low-cardinality name for a statement: its registered name, else "<verb>_<table>"."""
+    name = _statement_names.get(sql)
+    if name is not None:
+        return name
+    name = next((fragment_name for fragment, fragment_name in _fragments.items() if fragment in sql), None)
+    if name is None:
+        verb = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else "empty"
+        table = _TABLE.search(sql)
+        name = f"{verb}_{table.group(1).lower()}" if table else verb
+    with _statement_lock:
+        # النصوص المبنية ديناميكياً (IN بعدد متغير) كثيرة؛ لا نخزنها بلا حدود
+        if len(_statement_names) < 5000:
+            _statement_names[sql] = name
+    return name
+
+
+# أحداث الاستعلامات للطلب الجاري حين يلتقطه request_profiler؛ None في بقية الطلبات
+statement_timeline = contextvars.ContextVar("statement_timeline", default=None)
+
+
+class InstrumentedCursor:
+    """Times execute() and counts fetched rows per statement name; everything else is delegated.
+
+    While a request is being profiled, execute and fetch calls are also appended
+    to statement_timeline as (phase, statement, started, seconds, rows).
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._statement = None
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._statement = statement_name(operation)
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        except Exception:
+            db_query_errors.inc(self._statement)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            db_query_duration.observe(elapsed, self._statement)
+            timeline = statement_timeline.get()
+            if timeline is not None:
+                timeline.append(("execute", self._statement, started, elapsed, None))
+
+    def _fetch(self, fetch, *args, single=False, **kwargs):
+        timeline = statement_timeline.get()
+        started = time.perf_counter() if timeline is not None else None
+        rows = fetch(*args, **kwargs)
+        count = int(rows is not None) if single else len(rows)
+        if self._statement is not None and count:
+            db_query_rows.inc(self._statement, amount=count)
+        if timeline is not None:
+            timeline.append(("fetch", self._statement, started, time.perf_counter() - started, count))
+        return rows
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._fetch(self._cursor.fetchmany, *args, **kwargs)
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone, single=True)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def render(extra_lines=()):
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,68 @@
+import os
+import sys
+
+from db_config import get_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def split_statements(sql):
+    statements = []
+    current = []
+    for line in sql.splitlines():
+        if line.strip().startswith("--"):
+            continue
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statement = "\n".join(current).strip().rstrip(";")
+            if statement:
+                statements.append(statement)
+            current = []
+    tail = "\n".join(current).strip()
+    if tail:
+        statements.append(tail)
+    return statements
+
+
+def pending_migrations(applied):
+    files = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql"))
+    return [f for f in files if f[:-4] not in applied]
+
+
+def migrate():
+    """تطبيق ملفات migrations/*.sql غير المطبقة بالترتيب وتسجيلها في schema_migrations."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(100) PRIMARY KEY,
+                applied_at DATETIME NOT NULL
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        for filename in pending_migrations(applied):
+            print(f"Applying migration {filename}")
+            with open(os.path.join(MIGRATIONS_DIR, filename), encoding="utf-8") as f:
+                statements = split_statements(f.read())
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, applied_at) VALUES (%s, NOW())",
+                (filename[:-4],)
+            )
+            conn.commit()
+        print("✅ قاعدة البيانات محدثة.")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    try:
+        migrate()
+    except Exception as e:
+        print(f"❌ فشل تطبيق الترحيل: {e}")
+        sys.exit(1)
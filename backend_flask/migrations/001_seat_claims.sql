@@ -0,0 +1,32 @@
+-- مطالبات المقاعد: صف واحد لكل مقعد محجوز أو محجوز مؤقتاً في رحلة معينة.
+-- المفتاح الأساسي هو مفتاح التفرد المطبَّع، فلا يمكن لحجزين امتلاك المقعد نفسه.
+CREATE TABLE IF NOT EXISTS seat_claims (
+    slot_time DATETIME NOT NULL,
+    line_key VARCHAR(100) NOT NULL,
+    departure_key VARCHAR(100) NOT NULL,
+    arrival_key VARCHAR(100) NOT NULL,
+    vip TINYINT NOT NULL,
+    seat_number VARCHAR(20) NOT NULL,
+    ticket_id INT NULL,
+    hold_token CHAR(32) NULL,
+    expires_at DATETIME NULL,
+    PRIMARY KEY (slot_time, line_key, departure_key, arrival_key, vip, seat_number),
+    UNIQUE KEY uq_seat_claims_ticket (ticket_id),
+    UNIQUE KEY uq_seat_claims_hold (hold_token),
+    KEY idx_seat_claims_expires (expires_at)
+);
+
+INSERT IGNORE INTO seat_claims (
+    slot_time, line_key, departure_key, arrival_key, vip, seat_number, ticket_id
+)
+SELECT
+    date_ticket_time,
+    TRIM(LOWER(line)),
+    TRIM(LOWER(departure_station)),
+    TRIM(LOWER(arrival_station)),
+    vip,
+    TRIM(seat_number),
+    id_ticket
+FROM tickets
+WHERE paid = 1
+AND date_ticket_time >= CURDATE();
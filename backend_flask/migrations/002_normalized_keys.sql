@@ -0,0 +1,22 @@
+-- مفاتيح مطبَّعة (أحرف صغيرة وبدون مسافات طرفية) تُخزَّن مرة واحدة عند الكتابة
+-- وتُفهرس، بدلاً من TRIM(LOWER(...)) داخل شروط WHERE التي تمنع استخدام الفهارس.
+ALTER TABLE users ADD COLUMN username_key VARCHAR(255) NULL;
+UPDATE users SET username_key = TRIM(LOWER(username));
+CREATE INDEX idx_users_username_key ON users (username_key);
+
+ALTER TABLE employee ADD COLUMN username_key VARCHAR(255) NULL;
+UPDATE employee SET username_key = TRIM(LOWER(username));
+CREATE INDEX idx_employee_username_key ON employee (username_key);
+
+ALTER TABLE tickets
+    ADD COLUMN name_key VARCHAR(255) NULL,
+    ADD COLUMN line_key VARCHAR(100) NULL,
+    ADD COLUMN departure_key VARCHAR(100) NULL,
+    ADD COLUMN arrival_key VARCHAR(100) NULL;
+UPDATE tickets SET
+    name_key = TRIM(LOWER(name)),
+    line_key = TRIM(LOWER(line)),
+    departure_key = TRIM(LOWER(departure_station)),
+    arrival_key = TRIM(LOWER(arrival_station));
+CREATE INDEX idx_tickets_name_key ON tickets (name_key, paid, date_ticket_time);
+CREATE INDEX idx_tickets_slot ON tickets (date_ticket_time, line_key, departure_key, arrival_key, vip, paid);
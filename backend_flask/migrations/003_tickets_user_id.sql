@@ -0,0 +1,18 @@
+-- ربط التذاكر بالراكب عبر users.id بدلاً من الاسم النصي.
+-- نوع العمود يجب أن يطابق نوع users.id.
+ALTER TABLE tickets ADD COLUMN user_id BIGINT NULL;
+
+-- تعبئة الصفوف القديمة: فقط الأسماء التي تطابق راكباً واحداً بالضبط،
+-- أما الأسماء المكررة فتبقى NULL لأنه لا يمكن معرفة صاحبها.
+UPDATE tickets t
+JOIN (
+    SELECT TRIM(LOWER(name)) AS name_key, MIN(id) AS user_id
+    FROM users
+    GROUP BY TRIM(LOWER(name))
+    HAVING COUNT(*) = 1
+) u ON u.name_key = t.name_key
+SET t.user_id = u.user_id
+WHERE t.user_id IS NULL;
+
+CREATE INDEX idx_tickets_user ON tickets (user_id, paid, date_ticket_time);
+ALTER TABLE tickets ADD CONSTRAINT fk_tickets_user FOREIGN KEY (user_id) REFERENCES users (id);
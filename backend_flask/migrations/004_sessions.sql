@@ -0,0 +1,13 @@
+-- جلسات تسجيل الدخول: رمز التحديث يُخزَّن مجزَّأً ويُستبدل عند كل استخدام.
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id CHAR(32) PRIMARY KEY,
+    role VARCHAR(20) NOT NULL,
+    subject_id VARCHAR(50) NOT NULL,
+    name VARCHAR(255) NULL,
+    refresh_hash CHAR(64) NOT NULL,
+    expires_at DATETIME NOT NULL,
+    revoked TINYINT NOT NULL DEFAULT 0,
+    created_at DATETIME NOT NULL,
+    KEY idx_sessions_subject (role, subject_id),
+    KEY idx_sessions_expires (expires_at)
+);
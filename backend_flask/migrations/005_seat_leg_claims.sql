@@ -0,0 +1,14 @@
+-- مطالبات المقاعد لكل جزء (leg) بين محطتين متتاليتين، للمسارات المعروفة في line_topology.json.
+-- direction: 0 مع ترتيب المحطات، 1 عكسه. المفتاح الأساسي يمنع بيع مقطعين متداخلين من المقعد نفسه.
+-- التذاكر القادمة الموجودة قبل هذا الترحيل: python seat_segments.py backfill
+CREATE TABLE IF NOT EXISTS seat_leg_claims (
+    slot_time DATETIME NOT NULL,
+    line_key VARCHAR(100) NOT NULL,
+    direction TINYINT NOT NULL,
+    vip TINYINT NOT NULL,
+    seat_number VARCHAR(20) NOT NULL,
+    leg SMALLINT NOT NULL,
+    ticket_id INT NOT NULL,
+    PRIMARY KEY (slot_time, line_key, direction, vip, seat_number, leg),
+    KEY idx_seat_leg_claims_ticket (ticket_id)
+);
@@ -0,0 +1,35 @@
+-- تجميعات لوحة الموظف، تُحدَّث في معاملة الحجز/الإلغاء/التعديل نفسها (booking_rollups.py).
+-- shard = رقم التذكرة % BOOKING_ROLLUP_SHARDS: حجوزات الرحلة نفسها في ساعة الذروة لا تنتظر قفل صف واحد.
+-- booked = التذاكر الفعالة حالياً للرحلة والفئة، cancelled = ما أُلغي منها.
+CREATE TABLE IF NOT EXISTS rollup_trip_occupancy (
+    slot_time DATETIME NOT NULL,
+    line_key VARCHAR(100) NOT NULL,
+    vip TINYINT NOT NULL,
+    shard TINYINT NOT NULL,
+    booked INT NOT NULL DEFAULT 0,
+    cancelled INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (slot_time, line_key, vip, shard)
+);
+
+-- الحجوزات والإلغاءات لكل دقيقة (وقت العملية لا وقت الرحلة)
+CREATE TABLE IF NOT EXISTS rollup_booking_minutes (
+    minute DATETIME NOT NULL,
+    line_key VARCHAR(100) NOT NULL,
+    shard TINYINT NOT NULL,
+    booked INT NOT NULL DEFAULT 0,
+    cancelled INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (minute, line_key, shard)
+);
+
+-- التذاكر الموجودة: الإشغال من حالتها الحالية، والحجوزات لكل دقيقة من date_ticket_find.
+-- أوقات الإلغاءات السابقة غير مسجلة، فتبدأ إلغاءات الدقائق من هذا الترحيل.
+INSERT INTO rollup_trip_occupancy (slot_time, line_key, vip, shard, booked, cancelled)
+SELECT date_ticket_time, line_key, vip, 0, SUM(paid = 1), SUM(paid = 0)
+FROM tickets
+GROUP BY date_ticket_time, line_key, vip;
+
+INSERT INTO rollup_booking_minutes (minute, line_key, shard, booked, cancelled)
+SELECT DATE_FORMAT(date_ticket_find, '%Y-%m-%d %H:%i:00'), line_key, 0, COUNT(*), 0
+FROM tickets
+WHERE date_ticket_find IS NOT NULL
+GROUP BY DATE_FORMAT(date_ticket_find, '%Y-%m-%d %H:%i:00'), line_key;
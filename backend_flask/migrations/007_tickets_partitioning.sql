@@ -0,0 +1,11 @@
+-- تقسيم tickets حسب وقت الرحلة، حتى تقرأ استعلامات الرحلات أقسامها فقط ويُحذف التاريخ القديم
+-- بإسقاط قسم كامل بعد أرشفته (ticket_archive.py).
+-- شروط MySQL للتقسيم: كل مفتاح فريد يتضمن عمود التقسيم، ولا مفاتيح أجنبية على الجدول المقسَّم.
+-- بعد هذا الترحيل: python ticket_archive.py partitions   (يقسم pmax إلى أشهر مرة واحدة)
+ALTER TABLE tickets DROP FOREIGN KEY fk_tickets_user;
+
+ALTER TABLE tickets DROP PRIMARY KEY, ADD PRIMARY KEY (id_ticket, date_ticket_time);
+
+ALTER TABLE tickets PARTITION BY RANGE COLUMNS (date_ticket_time) (
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+);
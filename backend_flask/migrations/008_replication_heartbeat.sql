@@ -0,0 +1,7 @@
+-- صف واحد يكتبه مراقب النسخ المتماثلة على الأساسية كل DB_REPLICA_CHECK_INTERVAL ثانية
+-- (DB_REPLICA_LAG_SOURCE=heartbeat)؛ تأخر النسخة = الآن - ts كما وصلها. يُقاس هكذا حين لا يملك
+-- مستخدم التطبيق صلاحية REPLICATION CLIENT لـ SHOW REPLICA STATUS، أو خلف وسيط يخفيها.
+CREATE TABLE IF NOT EXISTS replication_heartbeat (
+    id TINYINT UNSIGNED NOT NULL PRIMARY KEY,
+    ts DATETIME(6) NOT NULL
+);
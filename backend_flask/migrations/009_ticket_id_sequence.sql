@@ -0,0 +1,10 @@
+-- أرقام تذاكر وضع الكتابة المؤجلة (booking_writer.py) تُحجز كتلاً من هذا الصف بتحديث صف واحد
+-- (UPDATE ... LAST_INSERT_ID(next_id + n))، بدلاً من ALTER TABLE tickets AUTO_INCREMENT الذي
+-- يأخذ قفل البيانات الوصفية على tickets في وقت الذروة.
+CREATE TABLE IF NOT EXISTS ticket_id_sequence (
+    id TINYINT UNSIGNED NOT NULL PRIMARY KEY,
+    next_id BIGINT UNSIGNED NOT NULL
+);
+
+INSERT IGNORE INTO ticket_id_sequence (id, next_id)
+SELECT 1, COALESCE(MAX(id_ticket), 0) + 1 FROM tickets;
@@ -0,0 +1,7 @@
+-- الحجز المؤقت (/seat_hold) يطالب بأجزاء رحلته أيضاً، فلا يُباع مقطع متداخل من المقعد أثناء الدفع.
+-- صف الحجز المؤقت: ticket_id NULL مع hold_token و expires_at، كما في seat_claims.
+ALTER TABLE seat_leg_claims
+    MODIFY ticket_id INT NULL,
+    ADD COLUMN hold_token CHAR(32) NULL,
+    ADD COLUMN expires_at DATETIME NULL,
+    ADD KEY idx_seat_leg_claims_hold (hold_token);
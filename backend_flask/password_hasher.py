@@ -0,0 +1,85 @@
+import concurrent.futures
+import os
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASHER_SETTINGS = {
+    "method": os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000"),
+    "workers": int(os.environ.get("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2))),
+    "max_pending": int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 32)),
+    "timeout": float(os.environ.get("PASSWORD_HASH_TIMEOUT", 5)),
+}
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(stored_hash, password, method):
+    """يعمل داخل عملية منفصلة: يتحقق من كلمة المرور ويعيد تجزئتها إذا تغيرت الإعدادات."""
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if stored_hash.split("$", 1)[0] != method:
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+class PasswordHasher:
+    """Runs password hashing in a bounded process pool, off the request threads.
+
+    At most `max_pending` hashes may be queued or running; beyond that, and
+    when a hash takes longer than `timeout`, HasherBusyError is raised so the
+    handler can answer 503 instead of tying up a worker thread. A slot is
+    freed when its hash actually finishes, not when the caller gives up on
+    it, so timed-out hashes still count against `max_pending`.
+    """
+
+    def __init__(self, method, workers=1, max_pending=32, timeout=5.0):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._executor_pid = None
+
+    def _pool(self):
+        # يُنشأ بعد fork (عند أول طلب) لأن العمليات الفرعية لا تُورَّث بين عمليات الخادم
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        # بلا انتظار: الطابور الممتلئ يُرد عليه 503 فوراً بدلاً من حجز خيط الطلب حتى يفرغ
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusyError("Password hashing queue is full")
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # المكان يتحرر عند انتهاء التجزئة فعلاً (أو إلغائها قبل أن تبدأ)، لا عند انتهاء مهلة الطلب
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise HasherBusyError("Password hashing timed out")
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """Return (matches, new_hash); new_hash is set when the stored hash uses old parameters."""
+        return self._run(_verify, stored_hash, password, self.method)
+
+
+password_hasher = PasswordHasher(**HASHER_SETTINGS)
@@ -0,0 +1,256 @@
+import concurrent.futures
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from event_log import log_error, log_warning
+
+# صور بطاقات الأولوية: تُنسخ من الطلب على دفعات إلى منطقة مؤقتة مع حد للحجم،
+# وتُخزَّن باسم بصمتها (sha256) فلا تتكرر الصورة نفسها، ولا تُنقل إلى مكانها النهائي
+# إلا بعد نجاح إدراج صف المستخدم. الصور المصغرة تُنشأ في عمليات خلفية.
+CARD_SETTINGS = {
+    "root": os.environ.get("UPLOAD_DIR", "uploads"),
+    "max_bytes": int(os.environ.get("PRIORITY_CARD_MAX_BYTES", 10 * 1024 * 1024)),
+    "chunk_bytes": int(os.environ.get("PRIORITY_CARD_CHUNK_BYTES", 64 * 1024)),
+    "thumbnail_size": int(os.environ.get("PRIORITY_CARD_THUMBNAIL_SIZE", 320)),
+    "thumbnail_workers": int(os.environ.get("PRIORITY_CARD_THUMBNAIL_WORKERS", 1)),
+    "max_pending_thumbnails": int(os.environ.get("PRIORITY_CARD_MAX_PENDING_THUMBNAILS", 64)),
+}
+
+# التعرف على النوع من أول البايتات بدلاً من امتداد اسم الملف الذي يرسله العميل
+SIGNATURES = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+
+STAGING_MAX_AGE = 3600
+
+
+class CardTooLargeError(Exception):
+    pass
+
+
+class UnsupportedCardError(Exception):
+    pass
+
+
+def sniff_extension(head):
+    for signature, extension in SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "heic"
+    return None
+
+
+def _make_thumbnail(source, target, size):
+    """Runs in a worker process: downscale `source` to fit size x size and save it as JPEG."""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # يفك JPEG بدقة مخفضة مباشرة بدل فك الصورة كاملة ثم تصغيرها
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((size, size))
+        partial = target + ".part"
+        image.save(partial, "JPEG", quality=80, optimize=True)
+    os.replace(partial, target)
+    return target
+
+
+class StagedCard:
+    """An uploaded card copied to the staging area, not yet visible under its final path."""
+
+    def __init__(self, temp_path, digest, extension, size, final_path):
+        self.temp_path = temp_path
+        self.digest = digest
+        self.extension = extension
+        self.size = size
+        self.final_path = final_path
+
+
+class PriorityCardStore:
+    """Content-addressed card storage with staged commits and background thumbnails.
+
+    stage() streams the upload into <root>/staging in fixed-size chunks while
+    hashing it, rejecting it once `max_bytes` is exceeded; no DB connection
+    is held meanwhile. After the users row commits, commit() moves the file
+    to <root>/cards/<aa>/<sha256>.<ext> (a no-op when the same image already
+    exists) and queues a thumbnail; discard() drops it when the insert fails.
+    """
+
+    def __init__(self, root, max_bytes, chunk_bytes=65536, thumbnail_size=320,
+                 thumbnail_workers=1, max_pending_thumbnails=64):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_workers = thumbnail_workers
+        self.staging_dir = os.path.join(root, "staging")
+        self.cards_dir = os.path.join(root, "cards")
+        self.thumbnails_dir = os.path.join(root, "thumbnails")
+        for directory in (self.staging_dir, self.cards_dir, self.thumbnails_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending_thumbnails)
+        self._executor = None
+        self._executor_pid = None
+        self._thumbnails_available = None
+
+        self.staged = 0
+        self.committed = 0
+        self.deduplicated = 0
+        self.discarded = 0
+        self.rejected = 0
+        self.thumbnails = 0
+        self.thumbnails_skipped = 0
+        self.thumbnails_failed = 0
+
+    # ---- التخزين ----
+
+    def _card_path(self, digest, extension):
+        return os.path.join(self.cards_dir, digest[:2], f"{digest}.{extension}")
+
+    def stage(self, upload):
+        """Copy a werkzeug FileStorage into the staging area; returns a StagedCard."""
+        digest = hashlib.sha256()
+        size = 0
+        extension = None
+        fd, temp_path = tempfile.mkstemp(dir=self.staging_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = upload.stream.read(self.chunk_bytes)
+                    if not chunk:
+                        break
+                    if extension is None:
+                        extension = sniff_extension(chunk[:16])
+                        if extension is None:
+                            raise UnsupportedCardError("Priority card must be a JPEG, PNG, GIF, WebP or HEIC image")
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise CardTooLargeError(f"Priority card exceeds {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    out.write(chunk)
+            if extension is None:
+                raise UnsupportedCardError("Priority card is empty")
+        except Exception:
+            os.remove(temp_path)
+            with self._lock:
+                self.rejected += 1
+            raise
+
+        hex_digest = digest.hexdigest()
+        with self._lock:
+            self.staged += 1
+        return StagedCard(temp_path, hex_digest, extension, size, self._card_path(hex_digest, extension))
+
+    def commit(self, card):
+        """Publish a staged card under its content address and queue its thumbnail."""
+        os.makedirs(os.path.dirname(card.final_path), exist_ok=True)
+        if os.path.exists(card.final_path):
+            os.remove(card.temp_path)
+            with self._lock:
+                self.deduplicated += 1
+        else:
+            # نفس نظام الملفات، فالنقل ذري: إما الملف كاملاً أو لا شيء
+            os.replace(card.temp_path, card.final_path)
+            with self._lock:
+                self.committed += 1
+        self.request_thumbnail(card.final_path)
+
+    def discard(self, card):
+        try:
+            os.remove(card.temp_path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.discarded += 1
+
+    def sweep_staging(self, max_age=STAGING_MAX_AGE):
+        """Remove staged files left behind by a crash between stage() and commit()/discard()."""
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.staging_dir):
+            path = os.path.join(self.staging_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # ---- الصور المصغرة ----
+
+    def thumbnail_path(self, card_path):
+        digest = os.path.splitext(os.path.basename(card_path))[0]
+        return os.path.join(self.thumbnails_dir, f"{digest}_{self.thumbnail_size}.jpg")
+
+    def _pool(self):
+        # يُنشأ بعد fork كما في password_hasher: العمليات الفرعية لا تُورَّث بين عمال الخادم
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.thumbnail_workers)
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _can_thumbnail(self):
+        if self._thumbnails_available is None:
+            try:
+                import PIL  # noqa: F401
+                self._thumbnails_available = True
+            except ImportError:
+                log_warning("priority_card_thumbnails_disabled", reason="Pillow is not installed")
+                self._thumbnails_available = False
+        return self._thumbnails_available
+
+    def request_thumbnail(self, card_path):
+        """Queue a thumbnail for `card_path` unless it exists; never blocks the caller."""
+        target = self.thumbnail_path(card_path)
+        if os.path.exists(target) or not self._can_thumbnail():
+            return
+        if not self._slots.acquire(blocking=False):
+            # يُعاد طلبها عند أول عرض في لوحة الموظف
+            with self._lock:
+                self.thumbnails_skipped += 1
+            return
+        try:
+            future = self._pool().submit(_make_thumbnail, card_path, target, self.thumbnail_size)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda done: self._thumbnail_done(done, card_path))
+
+    def _thumbnail_done(self, future, card_path):
+        self._slots.release()
+        error = future.exception()
+        with self._lock:
+            if error is None:
+                self.thumbnails += 1
+            else:
+                self.thumbnails_failed += 1
+        if error is not None:
+            log_error("priority_card_thumbnail_failed", error, path=card_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "staged": self.staged,
+                "committed": self.committed,
+                "deduplicated": self.deduplicated,
+                "discarded": self.discarded,
+                "rejected": self.rejected,
+                "thumbnails": self.thumbnails,
+                "thumbnails_skipped": self.thumbnails_skipped,
+                "thumbnails_failed": self.thumbnails_failed,
+                "max_bytes": self.max_bytes,
+            }
+
+
+priority_cards = PriorityCardStore(**CARD_SETTINGS)
@@ -0,0 +1,219 @@
+# الاستعلامات الساخنة مشتركة بين app.py و explain_check.py حتى يُفحص بـ EXPLAIN
+# النص نفسه الذي يُنفذ فعلياً. كل المعاملات تُمرَّر مطبَّعة (normalize_text).
+
+USER_LOGIN = """
+    SELECT id, name, username, password
+    FROM users
+    WHERE username_key = %s
+"""
+
+EMPLOYEE_LOGIN_BY_ID = """
+    SELECT employee_id, name, password
+    FROM employee
+    WHERE employee_id = %s
+"""
+
+EMPLOYEE_LOGIN_BY_USERNAME = """
+    SELECT employee_id, name, password
+    FROM employee
+    WHERE username_key = %s
+"""
+
+# أعمدة سجل الحجوزات بترتيب ثابت (BOOKING_FIELDS) ومنسَّقة داخل MySQL: التاريخ نصاً
+# (CAST لـ DATETIME يعطي YYYY-MM-DD HH:MM:SS)، vip صفر/واحد، والنصوص بلا مسافات طرفية.
+# تُقرأ الصفوف tuples وتُرمَّز JSON مباشرة دون حلقة تنسيق في بايثون.
+BOOKING_FIELDS = (
+    "id_ticket", "ticketId", "name", "date_ticket_time", "date_ticket_find",
+    "seat_number", "vip", "paid", "line", "departure_station", "arrival_station",
+)
+
+
+def booking_columns(table):
+    return f"""
+    {table}.id_ticket, {table}.id_ticket AS ticketId, {table}.name,
+    CAST({table}.date_ticket_time AS CHAR) AS date_ticket_time,
+    CAST({table}.date_ticket_find AS CHAR) AS date_ticket_find,
+    {table}.seat_number, IF({table}.vip, 1, 0) AS vip, {table}.paid,
+    TRIM({table}.line) AS line,
+    TRIM({table}.departure_station) AS departure_station,
+    TRIM({table}.arrival_station) AS arrival_station
+"""
+
+
+# LEFT JOIN من users يميّز "راكب غير موجود" (لا صفوف) عن "لا حجوزات" في استعلام واحد؛
+# العمود الأول passenger_id ثم BOOKING_FIELDS. الجزء الثاني يضم تذاكر بلا user_id باسم الراكب
+# (name_key): تطبيق Flutter لا يرسل passenger_id عند الحجز، والأسماء المكررة في migrations/003 بقيت NULL.
+# المعاملان كلاهما رقم الراكب.
+EMPLOYEE_ACTIVE_BOOKINGS = """
+    SELECT u.id AS passenger_id, """ + booking_columns("t") + """
+    FROM users u
+    LEFT JOIN tickets t
+        ON t.user_id = u.id
+        AND t.paid = 1
+        AND t.date_ticket_time > NOW()
+    WHERE u.id = %s
+    UNION ALL
+    SELECT u.id AS passenger_id, """ + booking_columns("t") + """
+    FROM users u
+    JOIN tickets t
+        ON t.name_key = TRIM(LOWER(u.name))
+        AND t.paid = 1
+        AND t.date_ticket_time > NOW()
+        AND t.user_id IS NULL
+    WHERE u.id = %s
+    ORDER BY date_ticket_time ASC
+"""
+
+# سجل الحجوزات: ترقيم بالمؤشر (date_ticket_time, id_ticket)
+BOOKING_COLUMNS = booking_columns("tickets")
+
+ACTIVE_BY_USER = "user_id = %s AND paid = 1 AND date_ticket_time > NOW()"
+COMPLETED_BY_USER = "user_id = %s AND (paid = 0 OR date_ticket_time <= NOW())"
+
+# الاستعلامات بالاسم باقية للعملاء القدامى الذين لا يرسلون passenger_id
+ACTIVE_BY_NAME = "name_key = %s AND paid = 1 AND date_ticket_time > NOW()"
+COMPLETED_BY_NAME = "name_key = %s AND (paid = 0 OR date_ticket_time <= NOW())"
+
+
+def booking_history(where, descending, after=False, limit=False):
+    """بناء استعلام السجل؛ after يضيف ثلاثة معاملات (الوقت، الوقت، رقم التذكرة) و limit معاملاً واحداً."""
+    direction = "DESC" if descending else "ASC"
+    sql = "SELECT " + BOOKING_COLUMNS + " FROM tickets WHERE " + where
+    if after:
+        op = "<" if descending else ">"
+        sql += f" AND (date_ticket_time {op} %s OR (date_ticket_time = %s AND id_ticket {op} %s))"
+    # مؤهَّلة باسم الجدول: date_ticket_time وحدها تعني العمود النصي المنسَّق في SELECT
+    sql += f" ORDER BY tickets.date_ticket_time {direction}, tickets.id_ticket {direction}"
+    if limit:
+        sql += " LIMIT %s"
+    return sql
+
+
+TICKET_INSERT_COLUMNS = """
+    name, user_id, date_ticket_time, date_ticket_find,
+    seat_number, vip, paid,
+    line, departure_station, arrival_station,
+    name_key, line_key, departure_key, arrival_key
+"""
+
+
+def insert_tickets(count):
+    """إدراج عدة تذاكر في جملة واحدة؛ 12 معاملاً لكل تذكرة بترتيب TICKET_INSERT_COLUMNS (عدا NOW و paid)."""
+    row = "(%s, %s, %s, NOW(), %s, %s, 1, %s, %s, %s, %s, %s, %s, %s)"
+    return "INSERT INTO tickets (" + TICKET_INSERT_COLUMNS + ") VALUES " + ", ".join([row] * count)
+
+
+# user_id و name_key لتوجيه قراءات صاحب الحجز إلى الأساسية بعد الإلغاء (sticky_reads)
+CANCEL_SELECT_COLUMNS = """
+    id_ticket, date_ticket_time, line, departure_station, arrival_station, vip, seat_number, user_id, name_key
+"""
+
+
+def cancellable_by_ids(count, by_user=False):
+    """by_user يضيف معاملاً أخيراً (user_id) ليقتصر الإلغاء على حجوزات الراكب نفسه."""
+    owner = " AND user_id = %s" if by_user else ""
+    return ("SELECT " + CANCEL_SELECT_COLUMNS + " FROM tickets WHERE id_ticket IN (" +
+            ", ".join(["%s"] * count) + ") AND paid = 1" + owner + " FOR UPDATE")
+
+
+# إلغاء رحلة كاملة: يستخدم idx_tickets_slot (date_ticket_time, line_key, ...)
+CANCELLABLE_BY_SLOT = ("SELECT " + CANCEL_SELECT_COLUMNS +
+                       " FROM tickets WHERE date_ticket_time = %s AND line_key = %s AND paid = 1 FOR UPDATE")
+
+CANCELLABLE_BY_SEGMENT = ("SELECT " + CANCEL_SELECT_COLUMNS +
+                          " FROM tickets WHERE date_ticket_time = %s AND line_key = %s"
+                          " AND departure_key = %s AND arrival_key = %s AND paid = 1 FOR UPDATE")
+
+
+BOOKED_SEATS_EXCLUDING_TICKET = """
+    SELECT seat_number
+    FROM tickets
+    WHERE date_ticket_time = %s
+    AND line_key = %s
+    AND departure_key = %s
+    AND arrival_key = %s
+    AND vip = %s
+    AND paid = 1
+    AND id_ticket != %s
+"""
+
+SLOT_SEAT_CLAIMS = """
+    SELECT seat_number
+    FROM seat_claims
+    WHERE slot_time = %s
+    AND line_key = %s
+    AND departure_key = %s
+    AND arrival_key = %s
+    AND vip = %s
+    AND (expires_at IS NULL OR expires_at > NOW())
+"""
+
+# أجزاء القطار المحجوزة لكل مقعد (seat_segments): بادئة المفتاح الأساسي لـ seat_leg_claims
+TRAIN_LEG_CLAIMS = """
+    SELECT seat_number, leg
+    FROM seat_leg_claims
+    WHERE slot_time = %s
+    AND line_key = %s
+    AND direction = %s
+    AND vip = %s
+    AND (expires_at IS NULL OR expires_at > NOW())
+"""
+
+# المقاعد المشغولة في أي جزء من [first_leg, end_leg) عدا تذكرة معينة (شاشة تعديل الحجز)
+TRAIN_SEATS_EXCLUDING_TICKET = """
+    SELECT DISTINCT seat_number
+    FROM seat_leg_claims
+    WHERE slot_time = %s
+    AND line_key = %s
+    AND direction = %s
+    AND vip = %s
+    AND leg >= %s
+    AND leg < %s
+    AND (ticket_id != %s OR ticket_id IS NULL)
+    AND (expires_at IS NULL OR expires_at > NOW())
+"""
+
+BOOKED_SEATS_BY_TIME = """
+    SELECT seat_number, vip FROM tickets WHERE date_ticket_time = %s AND paid = 1
+"""
+
+VERIFY_TICKET = """
+    SELECT id_ticket, name, seat_number, date_ticket_time, paid
+    FROM tickets
+    WHERE id_ticket = %s
+"""
+
+# تذاكر نافذة التحقق لليوم؛ id_ticket > %s يجعل التحديث التدريجي يقرأ الجديد فقط
+VERIFY_TICKET_WINDOW = """
+    SELECT id_ticket, name, seat_number, date_ticket_time, paid
+    FROM tickets
+    WHERE date_ticket_time >= %s
+    AND date_ticket_time < %s
+    AND id_ticket > %s
+"""
+
+# لوحة الموظف (booking_rollups): تقرأ جداول التجميع فقط، فالكلفة بعدد صفوفها لا بعدد التذاكر.
+# SUM يجمع الأجزاء (shard) لكل مفتاح؛ المدى على بادئة المفتاح الأساسي.
+def rollup_occupancy(by_line):
+    """معاملات: من، إلى، ثم line_key إن كان by_line."""
+    line = " AND line_key = %s" if by_line else ""
+    return ("SELECT CAST(slot_time AS CHAR), line_key, vip, SUM(booked), SUM(cancelled)"
+            " FROM rollup_trip_occupancy WHERE slot_time >= %s AND slot_time < %s" + line +
+            " GROUP BY slot_time, line_key, vip ORDER BY slot_time, line_key, vip")
+
+
+def rollup_minutes(by_line):
+    """معاملات: من، إلى، ثم line_key إن كان by_line."""
+    line = " AND line_key = %s" if by_line else ""
+    return ("SELECT CAST(minute AS CHAR), SUM(booked), SUM(cancelled)"
+            " FROM rollup_booking_minutes WHERE minute >= %s AND minute < %s" + line +
+            " GROUP BY minute ORDER BY minute")
+
+
+ROLLUP_CANCELLATIONS_BY_LINE = """
+    SELECT line_key, SUM(booked), SUM(cancelled)
+    FROM rollup_booking_minutes
+    WHERE minute >= %s AND minute < %s
+    GROUP BY line_key
+    ORDER BY line_key
+"""
@@ -0,0 +1,52 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+LOGIN_LIMIT_SETTINGS = {
+    "capacity": float(os.environ.get("LOGIN_RATE_BURST", 5)),
+    "refill_per_second": float(os.environ.get("LOGIN_RATE_PER_MINUTE", 10)) / 60,
+    "max_keys": int(os.environ.get("LOGIN_RATE_MAX_KEYS", 100000)),
+}
+
+
+class TokenBucketLimiter:
+    """Token bucket per key (e.g. "ip:1.2.3.4" or "account:ahmed").
+
+    Each key starts with `capacity` tokens and earns `refill_per_second`; the
+    least recently seen keys are forgotten beyond `max_keys`.
+    """
+
+    def __init__(self, capacity=5.0, refill_per_second=1 / 6, max_keys=100000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.rejected = 0
+
+    def allow(self, *keys):
+        """Take one token from every key; returns (allowed, retry_after_seconds)."""
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key in keys:
+                tokens, updated = self._buckets.get(key, (self.capacity, now))
+                tokens = min(self.capacity, tokens + (now - updated) * self.refill_per_second)
+                levels.append((key, tokens))
+
+            short = [tokens for _, tokens in levels if tokens < 1]
+            if short:
+                self.rejected += 1
+                retry_after = (1 - min(short)) / self.refill_per_second
+                return False, int(retry_after) + 1
+
+            for key, tokens in levels:
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return True, 0
+
+
+login_limiter = TokenBucketLimiter(**LOGIN_LIMIT_SETTINGS)
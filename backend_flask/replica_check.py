@@ -0,0 +1,98 @@
+import argparse
+import sys
+import time
+
+from db_config import REPLICA_SETTINGS, get_connection, get_read_connection, get_router
+
+# فحص إعداد النسخ المتماثلة (DB_REPLICAS) من سطر الأوامر:
+#   python replica_check.py                 تأخر كل نسخة وحالتها
+#   python replica_check.py --writes 20     + قراءة ما كُتب للتو: من الأساسية (sticky) ومن النسخة
+# يكتب صف id=2 في replication_heartbeat (migrations/008)؛ صف المراقب id=1 لا يُلمس.
+
+MARKER_ID = 2
+
+
+def show_lag(router):
+    print(f"max_lag {router.max_lag}s, lag source: {router.lag_source}")
+    for replica in router.replicas:
+        try:
+            lag = router.measure_lag(replica)
+        except Exception as e:
+            print(f"  {replica.name:<24} weight {replica.weight:<5} unreachable: {e}")
+            continue
+        if lag is None:
+            state = "not replicating"
+        elif lag > router.max_lag:
+            state = "ejected"
+        else:
+            state = "ok"
+        print(f"  {replica.name:<24} weight {replica.weight:<5} lag {lag}s  {state}")
+
+
+def read_marker(sticky):
+    conn = get_read_connection(sticky=sticky)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT ts FROM replication_heartbeat WHERE id = %s", (MARKER_ID,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def write_marker():
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("REPLACE INTO replication_heartbeat (id, ts) VALUES (%s, UTC_TIMESTAMP(6))", (MARKER_ID,))
+        conn.commit()
+        cursor.execute("SELECT ts FROM replication_heartbeat WHERE id = %s", (MARKER_ID,))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def check_read_your_writes(writes, timeout):
+    """Per write: does the sticky read see it at once, and how long until a replica read does."""
+    stale_sticky = 0
+    catch_up_ms = []
+    for _ in range(writes):
+        written = write_marker()
+        started = time.perf_counter()
+        if read_marker(sticky=True) != written:
+            stale_sticky += 1
+        while read_marker(sticky=False) != written:
+            if time.perf_counter() - started > timeout:
+                catch_up_ms.append(None)
+                break
+            time.sleep(0.001)
+        else:
+            catch_up_ms.append((time.perf_counter() - started) * 1000)
+    seen = sorted(ms for ms in catch_up_ms if ms is not None)
+    print(f"{writes} writes: sticky reads stale {stale_sticky}, replica never caught up "
+          f"within {timeout}s {writes - len(seen)}")
+    if seen:
+        print(f"replica catch-up ms: min {seen[0]:.1f}  p50 {seen[len(seen) // 2]:.1f}  max {seen[-1]:.1f}")
+    return stale_sticky == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="تأخر النسخ المتماثلة وقراءة ما كُتب للتو")
+    parser.add_argument("--writes", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    args = parser.parse_args()
+
+    router = get_router()
+    if not router.replicas:
+        print(f"DB_REPLICAS is empty ({REPLICA_SETTINGS['replicas']!r}); every read goes to the primary")
+        return 1
+    show_lag(router)
+    if args.writes and not check_read_your_writes(args.writes, args.timeout):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
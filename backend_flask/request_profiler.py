@@ -0,0 +1,258 @@
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+from werkzeug.exceptions import HTTPException
+
+from event_log import log_error
+from metrics import statement_timeline
+
+# تحليل أداء طلبات منفردة عند الطلب: ملف CPU بصيغة pstats وخط زمني لاستدعاءات
+# قاعدة البيانات بصيغة speedscope (https://www.speedscope.app)، وملخص JSON لكل طلب.
+#   curl -H "X-Profile: $PROFILE_TOKEN" ...     أو   PROFILE_SAMPLE_RATE=0.001
+#   python -m pstats profiles/<id>.prof          أو   snakeviz profiles/<id>.prof
+PROFILER_SETTINGS = {
+    "directory": os.environ.get("PROFILE_DIR", "profiles"),
+    "sample_rate": float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+    # بدون رمز لا يُقبل ترويسة X-Profile، فلا يستطيع أي عميل تشغيل المحلل على الخادم
+    "token": os.environ.get("PROFILE_TOKEN") or None,
+    "max_concurrent": int(os.environ.get("PROFILE_MAX_CONCURRENT", 1)),
+    "max_files": int(os.environ.get("PROFILE_MAX_FILES", 200)),
+}
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+TOP_FUNCTIONS = 15
+
+
+class RequestProfiler:
+    """WSGI middleware that profiles one request at a time, by header or by sampling.
+
+    Wrapping app.wsgi_app (rather than before/after_request) puts URL routing,
+    the view, jsonify and response building inside the profile. For every
+    captured request three files are written to `directory`:
+    <id>.prof (cProfile/pstats), <id>.speedscope.json (DB call timeline) and
+    <id>.summary.json, which slowest() reads back. The oldest captures are
+    deleted beyond `max_files`.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, token=None, max_concurrent=1, max_files=200):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.max_files = max_files
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+        self.captured = 0
+        self.skipped_busy = 0
+        self.failed = 0
+
+    def wrap(self, app):
+        wsgi_app = app.wsgi_app
+
+        def middleware(environ, start_response):
+            if not self._wanted(environ):
+                return wsgi_app(environ, start_response)
+            if not self._slots.acquire(blocking=False):
+                with self._lock:
+                    self.skipped_busy += 1
+                return wsgi_app(environ, start_response)
+            try:
+                return self._profile(app, wsgi_app, environ, start_response)
+            finally:
+                self._slots.release()
+
+        app.wsgi_app = middleware
+        return app
+
+    def _wanted(self, environ):
+        header = environ.get(PROFILE_HEADER)
+        if header and self.token:
+            return hmac.compare_digest(header.encode(), self.token.encode())
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _profile(self, app, wsgi_app, environ, start_response):
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured["status"] = int(status.split(" ", 1)[0])
+            headers = list(headers) + [("X-Profile-Id", profile_id)]
+            return start_response(status, headers, exc_info)
+
+        timeline = []
+        token = statement_timeline.set(timeline)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            return wsgi_app(environ, capture_start_response)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            statement_timeline.reset(token)
+            try:
+                self._save(profile_id, app, environ, captured.get("status"), started, elapsed, profiler, timeline)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                log_error("profile_write_failed", e, profile_id=profile_id)
+
+    def _route(self, app, environ):
+        try:
+            rule, _ = app.url_map.bind_to_environ(environ).match(return_rule=True)
+            return rule.rule
+        except HTTPException:
+            return "unmatched"
+
+    def _save(self, profile_id, app, environ, status, started, elapsed, profiler, timeline):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile_id)
+        profiler.dump_stats(base + ".prof")
+
+        route = self._route(app, environ)
+        with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(speedscope_timeline(f"{environ.get('REQUEST_METHOD')} {route}", started, elapsed, timeline), f)
+
+        db_seconds = sum(event[3] for event in timeline)
+        summary = {
+            "id": profile_id,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "method": environ.get("REQUEST_METHOD"),
+            "route": route,
+            "path": environ.get("PATH_INFO"),
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 3),
+            "db_ms": round(db_seconds * 1000, 3),
+            "db_calls": sum(1 for event in timeline if event[0] == "execute"),
+            "statements": statement_totals(timeline),
+            "top_functions": top_functions(profiler),
+            "files": [profile_id + ".prof", profile_id + ".speedscope.json"],
+        }
+        with open(base + ".summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            self.captured += 1
+        self._prune()
+
+    def _summaries(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.endswith(".summary.json")]
+
+    def _prune(self):
+        paths = sorted(self._summaries(), key=os.path.getmtime)
+        for path in paths[:max(0, len(paths) - self.max_files)]:
+            profile_id = os.path.basename(path)[:-len(".summary.json")]
+            for suffix in (".summary.json", ".prof", ".speedscope.json"):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def slowest(self, limit=20, route=None):
+        """Captured request summaries (all workers share the directory), slowest first."""
+        summaries = []
+        for path in self._summaries():
+            try:
+                with open(path, encoding="utf-8") as f:
+                    summary = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if route is None or summary.get("route") == route:
+                summaries.append(summary)
+        summaries.sort(key=lambda summary: summary.get("duration_ms", 0), reverse=True)
+        return summaries[:limit]
+
+    def file_path(self, filename):
+        """Path of a captured file, or None for names that are not ours."""
+        if os.path.basename(filename) != filename or not filename.endswith((".prof", ".speedscope.json", ".summary.json")):
+            return None
+        path = os.path.join(self.directory, filename)
+        return path if os.path.isfile(path) else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "header_enabled": self.token is not None,
+                "captured": self.captured,
+                "skipped_busy": self.skipped_busy,
+                "failed": self.failed,
+            }
+
+
+def statement_totals(timeline):
+    """Per statement: calls, execute and fetch time (ms) and rows, costliest first."""
+    totals = {}
+    for phase, statement, _, seconds, rows in timeline:
+        entry = totals.setdefault(statement, {"statement": statement, "calls": 0, "execute_ms": 0.0,
+                                              "fetch_ms": 0.0, "rows": 0})
+        if phase == "execute":
+            entry["calls"] += 1
+            entry["execute_ms"] += seconds * 1000
+        else:
+            entry["fetch_ms"] += seconds * 1000
+            entry["rows"] += rows or 0
+    for entry in totals.values():
+        entry["execute_ms"] = round(entry["execute_ms"], 3)
+        entry["fetch_ms"] = round(entry["fetch_ms"], 3)
+    return sorted(totals.values(), key=lambda entry: entry["execute_ms"] + entry["fetch_ms"], reverse=True)
+
+
+def top_functions(profiler, limit=TOP_FUNCTIONS):
+    """The `limit` functions with the highest cumulative time, as plain dicts."""
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({function})",
+            "calls": calls,
+            "own_ms": round(own * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:limit]
+
+
+def speedscope_timeline(name, started, elapsed, timeline):
+    """An evented speedscope profile: the request as the outer frame, each DB execute/fetch nested in it."""
+    frames = [{"name": name}]
+    frame_index = {}
+    events = [{"type": "O", "frame": 0, "at": 0.0}]
+    for phase, statement, at, seconds, _ in sorted(timeline, key=lambda event: event[2]):
+        label = f"{phase} {statement}"
+        index = frame_index.get(label)
+        if index is None:
+            index = frame_index[label] = len(frames)
+            frames.append({"name": label})
+        opened = max(0.0, (at - started) * 1000)
+        events.append({"type": "O", "frame": index, "at": round(opened, 3)})
+        events.append({"type": "C", "frame": index, "at": round(opened + seconds * 1000, 3)})
+    end = round(elapsed * 1000, 3)
+    events.append({"type": "C", "frame": 0, "at": end})
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "evented",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": end,
+            "events": events,
+        }],
+        "name": name,
+        "exporter": "reserve-and-ride request_profiler",
+    }
+
+
+request_profiler = RequestProfiler(**PROFILER_SETTINGS)
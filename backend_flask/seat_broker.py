@@ -0,0 +1,68 @@
+import argparse
+import socket
+import socketserver
+import struct
+import threading
+
+from event_log import log_event
+
+# وسيط محلي بسيط لأحداث المقاعد بين عمال الخادم: كل سطر يصل من عامل يُعاد
+# إرساله إلى بقية العمال. يقوم مقام وسيط حقيقي (مثل Redis pub/sub) في النشر المحلي:
+#   python seat_broker.py --port 7070
+#   SEAT_EVENTS_BROKER=127.0.0.1:7070 gunicorn -c gunicorn.conf.py wsgi:app
+
+SEND_TIMEOUT = 2.0
+
+
+class Relay(socketserver.StreamRequestHandler):
+    peers = set()
+    peers_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # مهلة للإرسال فقط؛ القراءة تبقى بلا مهلة لأن العامل قد يصمت طويلاً
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", int(SEND_TIMEOUT), 0))
+        self.send_lock = threading.Lock()
+        with self.peers_lock:
+            self.peers.add(self)
+        log_event("seat_broker_worker_connected", sample=1, peer=str(self.client_address))
+
+    def handle(self):
+        for line in self.rfile:
+            with self.peers_lock:
+                others = [peer for peer in self.peers if peer is not self]
+            for peer in others:
+                peer.send(line)
+
+    def send(self, line):
+        # العامل البطيء أو المتوقف يُفصل بدلاً من أن يوقف البقية
+        try:
+            with self.send_lock:
+                self.request.sendall(line)
+        except OSError:
+            self.drop()
+
+    def drop(self):
+        with self.peers_lock:
+            self.peers.discard(self)
+
+    def finish(self):
+        self.drop()
+        log_event("seat_broker_worker_disconnected", sample=1, peer=str(self.client_address))
+        super().finish()
+
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="وسيط أحداث المقاعد بين العمال")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7070)
+    args = parser.parse_args()
+
+    with BrokerServer((args.host, args.port), Relay) as server:
+        log_event("seat_broker_listening", sample=1, host=args.host, port=args.port)
+        server.serve_forever()
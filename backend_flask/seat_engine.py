@@ -0,0 +1,296 @@
+import os
+import threading
+import uuid
+
+SEAT_ENGINE_SETTINGS = {
+    "hold_seconds": int(os.environ.get("SEAT_HOLD_SECONDS", 300)),
+}
+
+_KEY_WHERE = """
+    slot_time = %s AND line_key = %s AND departure_key = %s
+    AND arrival_key = %s AND vip = %s AND seat_number = %s
+"""
+
+_INSERT_CLAIM = """
+    INSERT IGNORE INTO seat_claims (
+        slot_time, line_key, departure_key, arrival_key, vip, seat_number
+    )
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+_INSERT_HOLD = """
+    INSERT IGNORE INTO seat_claims (
+        slot_time, line_key, departure_key, arrival_key, vip, seat_number,
+        hold_token, expires_at
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW() + INTERVAL %s SECOND)
+"""
+
+_PURGE_EXPIRED_HOLD = (
+    "DELETE FROM seat_claims WHERE " + _KEY_WHERE +
+    " AND ticket_id IS NULL AND expires_at < NOW()"
+)
+
+_CONVERT_HOLD = (
+    "UPDATE seat_claims SET hold_token = NULL, expires_at = NULL WHERE " + _KEY_WHERE +
+    " AND hold_token = %s AND ticket_id IS NULL"
+)
+
+_ATTACH = "UPDATE seat_claims SET ticket_id = %s WHERE " + _KEY_WHERE
+
+_KEY_COLUMNS = "(slot_time, line_key, departure_key, arrival_key, vip, seat_number)"
+
+
+def _key_in(count):
+    return _KEY_COLUMNS + " IN (" + ", ".join(["(%s, %s, %s, %s, %s, %s)"] * count) + ")"
+
+
+class SeatReservationEngine:
+    """Claims seats through the seat_claims primary key.
+
+    A claim is a single INSERT IGNORE (or UPDATE IGNORE when a booking moves)
+    against the normalized (slot, line, segment, class, seat) key, so two
+    concurrent bookings can never both own a seat and the loser is told by the
+    affected row count instead of an exception. The claim methods take the
+    caller's cursor so the claim commits or rolls back with the ticket write.
+    """
+
+    def __init__(self, hold_seconds=300):
+        self.hold_seconds = hold_seconds
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.conflicts = 0
+        self.holds = 0
+        self.hold_conflicts = 0
+
+    def _count(self, won, hold=False):
+        with self._lock:
+            if hold:
+                self.holds += 1
+                if not won:
+                    self.hold_conflicts += 1
+            else:
+                self.attempts += 1
+                if not won:
+                    self.conflicts += 1
+
+    @staticmethod
+    def _params(key, seat_number):
+        return tuple(key) + (str(seat_number).strip(),)
+
+    def _purge_expired_hold(self, cursor, key, seat_number):
+        cursor.execute(_PURGE_EXPIRED_HOLD, self._params(key, seat_number))
+
+    def _execute_insert(self, cursor, key, seat_number, hold_token=None):
+        if hold_token:
+            cursor.execute(_INSERT_HOLD, self._params(key, seat_number) + (hold_token, self.hold_seconds))
+        else:
+            cursor.execute(_INSERT_CLAIM, self._params(key, seat_number))
+        return cursor.rowcount == 1
+
+    def _insert_claim(self, cursor, key, seat_number, hold_token=None):
+        if self._execute_insert(cursor, key, seat_number, hold_token):
+            return True
+        # المقعد مأخوذ؛ نعيد المحاولة مرة واحدة فقط إذا كان الحجز المؤقت منتهياً.
+        # الحذف يأتي بعد فشل الإدراج كي لا يأخذ المسار الناجح أقفال فجوات متعارضة.
+        self._purge_expired_hold(cursor, key, seat_number)
+        if cursor.rowcount == 0:
+            return False
+        return self._execute_insert(cursor, key, seat_number, hold_token)
+
+    def claim(self, cursor, key, seat_number, hold_token=None):
+        """Claim a seat inside the caller's transaction; False means someone else has it."""
+        won = False
+        if hold_token:
+            cursor.execute(_CONVERT_HOLD, self._params(key, seat_number) + (hold_token,))
+            won = cursor.rowcount == 1
+        if not won:
+            won = self._insert_claim(cursor, key, seat_number)
+        self._count(won)
+        return won
+
+    def attach(self, cursor, key, seat_number, ticket_id):
+        cursor.execute(_ATTACH, (ticket_id,) + self._params(key, seat_number))
+
+    async def claim_async(self, cursor, key, seat_number, hold_token=None):
+        """claim() for an aiomysql cursor; same statements, same ordering."""
+        params = self._params(key, seat_number)
+        won = False
+        if hold_token:
+            won = await cursor.execute(_CONVERT_HOLD, params + (hold_token,)) == 1
+        if not won:
+            won = await cursor.execute(_INSERT_CLAIM, params) == 1
+            if not won and await cursor.execute(_PURGE_EXPIRED_HOLD, params):
+                won = await cursor.execute(_INSERT_CLAIM, params) == 1
+        self._count(won)
+        return won
+
+    async def attach_async(self, cursor, key, seat_number, ticket_id):
+        await cursor.execute(_ATTACH, (ticket_id,) + self._params(key, seat_number))
+
+    def _execute_move(self, cursor, ticket_id, key, seat_number):
+        cursor.execute("""
+            UPDATE IGNORE seat_claims
+            SET slot_time = %s, line_key = %s, departure_key = %s,
+                arrival_key = %s, vip = %s, seat_number = %s
+            WHERE ticket_id = %s
+        """, self._params(key, seat_number) + (ticket_id,))
+        return cursor.rowcount == 1
+
+    def move(self, cursor, ticket_id, key, seat_number):
+        """Move a ticket's claim to another seat/slot; False if the target is taken."""
+        won = self._execute_move(cursor, ticket_id, key, seat_number)
+        if not won:
+            self._purge_expired_hold(cursor, key, seat_number)
+            if cursor.rowcount:
+                won = self._execute_move(cursor, ticket_id, key, seat_number)
+
+        if not won:
+            # صفر صفوف: إما أن المطالبة لم تتغير، أو المقعد محجوز، أو لا توجد مطالبة (تذكرة قديمة)
+            cursor.execute(
+                "SELECT slot_time, line_key, departure_key, arrival_key, vip, seat_number "
+                "FROM seat_claims WHERE ticket_id = %s",
+                (ticket_id,)
+            )
+            current = cursor.fetchone()
+            if current is None:
+                won = self._insert_claim(cursor, key, seat_number)
+                if won:
+                    self.attach(cursor, key, seat_number, ticket_id)
+            else:
+                current_key = (current[0].strftime("%Y-%m-%d %H:%M:%S"),) + tuple(current[1:])
+                won = current_key == self._params(key, seat_number)
+
+        self._count(won)
+        return won
+
+    def release(self, cursor, ticket_id):
+        cursor.execute("DELETE FROM seat_claims WHERE ticket_id = %s", (ticket_id,))
+
+    def _flat_params(self, seats):
+        params = ()
+        for key, seat_number in seats:
+            params += self._params(key, seat_number)
+        return params
+
+    def claim_many(self, cursor, seats, hold_tokens=None):
+        """Claim every (key, seat_number) pair of one trip, or none; False if any seat is taken.
+
+        Held seats are converted one by one, the rest go in a single multi-row
+        INSERT IGNORE. On a shortfall the caller rolls back the transaction.
+        """
+        hold_tokens = hold_tokens or {}
+        pending = []
+        for key, seat_number in seats:
+            token = hold_tokens.get((key, seat_number))
+            if token:
+                cursor.execute(_CONVERT_HOLD, self._params(key, seat_number) + (token,))
+                if cursor.rowcount == 1:
+                    continue
+            pending.append((key, seat_number))
+
+        won = True
+        if pending:
+            values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(pending))
+            insert = "INSERT IGNORE INTO seat_claims " + _KEY_COLUMNS + " VALUES " + values
+            params = self._flat_params(pending)
+            cursor.execute(insert, params)
+            inserted = cursor.rowcount
+            if inserted < len(pending):
+                cursor.execute(
+                    "DELETE FROM seat_claims WHERE " + _key_in(len(pending)) +
+                    " AND ticket_id IS NULL AND expires_at < NOW()",
+                    params
+                )
+                if cursor.rowcount:
+                    # الصفوف التي أدرجناها قبل قليل تُتجاهل كمكررة؛ نعدّ الجديد فقط
+                    cursor.execute(insert, params)
+                    inserted += cursor.rowcount
+            won = inserted == len(pending)
+
+        with self._lock:
+            self.attempts += len(seats)
+            if not won:
+                self.conflicts += 1
+        return won
+
+    def attach_many(self, cursor, seats, first_ticket_id):
+        """Link claims from claim_many to the tickets inserted from `first_ticket_id` on.
+
+        Matches on the normalized key instead of assuming consecutive
+        auto-increment ids; returns {(key, seat_number): ticket_id}.
+        """
+        params = self._flat_params(seats)
+        cursor.execute("""
+            UPDATE seat_claims c
+            JOIN tickets t
+                ON t.date_ticket_time = c.slot_time AND t.line_key = c.line_key
+                AND t.departure_key = c.departure_key AND t.arrival_key = c.arrival_key
+                AND t.vip = c.vip AND t.seat_number = c.seat_number
+            SET c.ticket_id = t.id_ticket
+            WHERE t.id_ticket >= %s AND t.paid = 1 AND c.ticket_id IS NULL
+            AND (c.slot_time, c.line_key, c.departure_key, c.arrival_key, c.vip, c.seat_number)
+                IN (""" + ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(seats)) + ")",
+            (first_ticket_id,) + params
+        )
+        cursor.execute(
+            "SELECT ticket_id, vip, seat_number FROM seat_claims WHERE " + _key_in(len(seats)),
+            params
+        )
+        by_seat = {(row[1], row[2]): row[0] for row in cursor.fetchall()}
+        return {(key, seat_number): by_seat.get((key[4], str(seat_number).strip()))
+                for key, seat_number in seats}
+
+    def taken_among(self, cursor, seats):
+        """The (key, seat_number) pairs of one trip that already have a live claim."""
+        cursor.execute(
+            "SELECT vip, seat_number FROM seat_claims "
+            "WHERE " + _key_in(len(seats)) + " AND (ticket_id IS NOT NULL OR expires_at >= NOW())",
+            self._flat_params(seats)
+        )
+        taken = {(row[0], row[1]) for row in cursor.fetchall()}
+        return {(key, seat_number) for key, seat_number in seats
+                if (key[4], str(seat_number).strip()) in taken}
+
+    def release_many(self, cursor, ticket_ids):
+        if ticket_ids:
+            cursor.execute(
+                "DELETE FROM seat_claims WHERE ticket_id IN (" + ", ".join(["%s"] * len(ticket_ids)) + ")",
+                tuple(ticket_ids)
+            )
+
+    def hold(self, cursor, key, seat_number):
+        """Hold a seat for `hold_seconds` while the passenger pays; returns a token or None."""
+        token = uuid.uuid4().hex
+        won = self._insert_claim(cursor, key, seat_number, hold_token=token)
+        self._count(won, hold=True)
+        return token if won else None
+
+    def release_hold(self, cursor, hold_token):
+        cursor.execute(
+            "SELECT slot_time, line_key, departure_key, arrival_key, vip, seat_number "
+            "FROM seat_claims WHERE hold_token = %s AND ticket_id IS NULL",
+            (hold_token,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute(
+            "DELETE FROM seat_claims WHERE hold_token = %s AND ticket_id IS NULL",
+            (hold_token,)
+        )
+        return row
+
+    def stats(self):
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "conflicts": self.conflicts,
+                "conflict_rate": round(self.conflicts / self.attempts, 4) if self.attempts else 0.0,
+                "holds": self.holds,
+                "hold_conflicts": self.hold_conflicts,
+                "hold_seconds": self.hold_seconds,
+            }
+
+
+seat_engine = SeatReservationEngine(**SEAT_ENGINE_SETTINGS)
@@ -0,0 +1,210 @@
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+
+from event_log import log_warning
+
+SEAT_EVENTS_SETTINGS = {
+    "max_pending": int(os.environ.get("SEAT_EVENTS_MAX_PENDING", 100)),
+    "max_subscribers": int(os.environ.get("SEAT_EVENTS_MAX_SUBSCRIBERS", 200)),
+    # عنوان وسيط الأحداث بين العمال (seat_broker.py) بصيغة host:port؛ فارغ = داخل العملية فقط
+    "broker": os.environ.get("SEAT_EVENTS_BROKER") or None,
+}
+
+# تعليق keep-alive كل بضع ثوانٍ، ويُغلق البث بعد مدة قصوى ليعيد العميل الاتصال ويتحرر الخيط
+STREAM_HEARTBEAT = float(os.environ.get("SEAT_EVENTS_HEARTBEAT", 15))
+STREAM_MAX_SECONDS = float(os.environ.get("SEAT_EVENTS_MAX_STREAM", 300))
+
+RESYNC = "resync"
+
+
+class TooManySubscribersError(Exception):
+    pass
+
+
+class Subscription:
+    """One open seat-map stream: a bounded queue of (event, seat_number) deltas.
+
+    A client that falls `max_pending` deltas behind loses its queue and gets a
+    single resync instead, so a slow reader costs a snapshot, never unbounded
+    memory.
+    """
+
+    def __init__(self, key, max_pending):
+        self.key = key
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._resync = False
+
+    def push(self, event, seat_number):
+        """Queue a delta; returns True when this push overflowed the queue."""
+        with self._cond:
+            if self._resync:
+                return False
+            overflowed = len(self._pending) >= self.max_pending
+            if overflowed:
+                self._pending.clear()
+                self._resync = True
+            else:
+                self._pending.append((event, seat_number))
+            self._cond.notify()
+            return overflowed
+
+    def next(self, timeout):
+        """Next (event, seat_number), (RESYNC, None), or None after `timeout` seconds of quiet."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending or self._resync, timeout)
+            if self._resync:
+                self._resync = False
+                return RESYNC, None
+            if self._pending:
+                return self._pending.popleft()
+            return None
+
+
+class SeatEventHub:
+    """Fans seat-taken / seat-freed deltas out to the streams subscribed to a trip slot.
+
+    attach() hooks the hub to a SeatOccupancyIndex, so every mark_taken /
+    mark_free made by the booking handlers is published. With a broker address
+    the deltas are also relayed to the other workers, which apply them to
+    their own index (without re-publishing) and to their own subscribers.
+    """
+
+    def __init__(self, max_pending=100, max_subscribers=200, broker=None):
+        self.max_pending = max_pending
+        self.max_subscribers = max_subscribers
+        self.broker = broker
+
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._count = 0
+        self._index = None
+
+        self._origin = uuid.uuid4().hex
+        self._broker_lock = threading.Lock()
+        self._broker_socket = None
+        self._broker_thread = None
+
+        self.published = 0
+        self.delivered = 0
+        self.relayed = 0
+        self.rejected = 0
+        self.overflows = 0
+
+    def attach(self, index):
+        self._index = index
+        index.add_listener(self.publish)
+        if self.broker and self._broker_thread is None:
+            self._broker_thread = threading.Thread(target=self._broker_loop, name="seat-events-broker", daemon=True)
+            self._broker_thread.start()
+
+    def subscribe(self, key):
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                self.rejected += 1
+                raise TooManySubscribersError("Too many open seat streams")
+            subscription = Subscription(key, self.max_pending)
+            self._subscriptions.setdefault(key, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.key)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscriptions[subscription.key]
+
+    def _deliver(self, key, seat_number, taken):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(key, ()))
+            self.delivered += len(subscribers)
+        event = "seat-taken" if taken else "seat-freed"
+        overflows = sum(subscription.push(event, seat_number) for subscription in subscribers)
+        if overflows:
+            with self._lock:
+                self.overflows += overflows
+
+    def publish(self, key, seat_number, taken):
+        with self._lock:
+            self.published += 1
+        self._deliver(key, seat_number, taken)
+        if self.broker:
+            self._send_to_broker({"o": self._origin, "k": list(key), "s": seat_number, "t": taken})
+
+    def _send_to_broker(self, message):
+        line = (json.dumps(message) + "\n").encode("utf-8")
+        with self._broker_lock:
+            if self._broker_socket is None:
+                return
+            try:
+                self._broker_socket.sendall(line)
+            except OSError as e:
+                log_warning("seat_events_broker_send_failed", broker=self.broker, error=str(e))
+                self._broker_socket.close()
+                self._broker_socket = None
+
+    def _receive(self, message):
+        if message.get("o") == self._origin:
+            return
+        key = tuple(message["k"])
+        with self._lock:
+            self.relayed += 1
+        if self._index is not None:
+            if message["t"]:
+                self._index.mark_taken(key, message["s"], notify=False)
+            else:
+                self._index.mark_free(key, message["s"], notify=False)
+        self._deliver(key, message["s"], message["t"])
+
+    def _broker_loop(self):
+        host, _, port = self.broker.rpartition(":")
+        backoff = 1.0
+        while True:
+            try:
+                sock = socket.create_connection((host, int(port)), timeout=5)
+                sock.settimeout(None)
+                # وسيط متوقف لا يجب أن يوقف خيط الحجز الذي ينشر الحدث
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", 2, 0))
+                with self._broker_lock:
+                    self._broker_socket = sock
+                backoff = 1.0
+                for line in sock.makefile("rb"):
+                    try:
+                        self._receive(json.loads(line))
+                    except (ValueError, KeyError, TypeError) as e:
+                        log_warning("seat_events_bad_broker_message", error=str(e))
+            except OSError as e:
+                log_warning("seat_events_broker_unavailable", broker=self.broker, error=str(e))
+            with self._broker_lock:
+                if self._broker_socket is not None:
+                    self._broker_socket.close()
+                    self._broker_socket = None
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": self._count,
+                "slots": len(self._subscriptions),
+                "published": self.published,
+                "delivered": self.delivered,
+                "relayed": self.relayed,
+                "rejected": self.rejected,
+                "overflows": self.overflows,
+                "broker": self.broker,
+                "broker_connected": self._broker_socket is not None,
+            }
+
+
+seat_events = SeatEventHub(**SEAT_EVENTS_SETTINGS)
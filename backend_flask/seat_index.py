@@ -0,0 +1,231 @@
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from event_log import log_warning
+
+SEAT_INDEX_SETTINGS = {
+    "ttl": float(os.environ.get("SEAT_INDEX_TTL", 30)),
+    "max_slots": int(os.environ.get("SEAT_INDEX_MAX_SLOTS", 5000)),
+    "consistency_check": os.environ.get("SEAT_INDEX_CONSISTENCY_CHECK", "false").lower() == "true",
+}
+
+
+def normalize_slot(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    text = str(value).strip()
+    try:
+        return datetime.datetime.fromisoformat(text).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return text
+
+
+def normalize_text(value):
+    return str(value or "").strip().lower()
+
+
+def slot_key(time_slot, line, departure_station, arrival_station, vip):
+    return (
+        normalize_slot(time_slot),
+        normalize_text(line),
+        normalize_text(departure_station),
+        normalize_text(arrival_station),
+        int(vip),
+    )
+
+
+class _SlotEntry:
+    __slots__ = ("bits", "loaded_at")
+
+    def __init__(self, bits, loaded_at):
+        self.bits = bits
+        self.loaded_at = loaded_at
+
+
+class SeatOccupancyIndex:
+    """Taken seats per trip slot, stored as an int bitset over interned seat labels.
+
+    Slots are loaded lazily through a loader callback, kept fresh by the booking
+    handlers and dropped after `ttl` seconds, once their departure has passed,
+    or when more than `max_slots` slots are cached (least recently used first).
+    """
+
+    def __init__(self, ttl=30.0, max_slots=5000, consistency_check=False):
+        self.ttl = ttl
+        self.max_slots = max_slots
+        self.consistency_check = consistency_check
+
+        self._lock = threading.Lock()
+        self._slots = OrderedDict()
+        self._seat_bits = {}
+        self._seat_labels = []
+        # عداد تغييرات لكل رحلة: قراءة من MySQL لا تُخزَّن إذا تغيرت رحلتها أثناءها، ولا تتأثر بحجوزات الرحلات الأخرى.
+        # يبقى للرحلة حتى موعد انطلاقها، ولو خرج مدخلها من الذاكرة المؤقتة، حتى لا يعود إلى الصفر أثناء قراءة جارية
+        self._generations = {}
+        self._last_sweep = time.monotonic()
+        self._listeners = []
+
+        self.hits = 0
+        self.misses = 0
+        self.mismatches = 0
+
+    def _bit(self, seat_number):
+        label = str(seat_number).strip()
+        bit = self._seat_bits.get(label)
+        if bit is None:
+            bit = len(self._seat_labels)
+            self._seat_bits[label] = bit
+            self._seat_labels.append(label)
+        return bit
+
+    def _to_bits(self, seat_numbers):
+        bits = 0
+        for seat_number in seat_numbers:
+            bits |= 1 << self._bit(seat_number)
+        return bits
+
+    def _to_labels(self, bits):
+        labels = []
+        bit = 0
+        while bits:
+            if bits & 1:
+                labels.append(self._seat_labels[bit])
+            bits >>= 1
+            bit += 1
+        return labels
+
+    def _is_fresh(self, key, entry, now):
+        if now - entry.loaded_at > self.ttl:
+            return False
+        return key[0] >= datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _store(self, key, bits, now):
+        self._slots[key] = _SlotEntry(bits, now)
+        self._slots.move_to_end(key)
+        while len(self._slots) > self.max_slots:
+            self._slots.popitem(last=False)
+        if now - self._last_sweep > 60:
+            self._last_sweep = now
+            self._evict_past_locked()
+
+    def _evict_past_locked(self):
+        now_slot = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        past = [key for key in self._slots if key[0] < now_slot]
+        for key in past:
+            del self._slots[key]
+        for key in [key for key in self._generations if key[0] < now_slot]:
+            del self._generations[key]
+        return len(past)
+
+    def _lookup(self, key):
+        """(labels, entry, generation): labels is set when the cached entry can be served as is."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._slots.get(key)
+            if entry is not None and self._is_fresh(key, entry, now):
+                self._slots.move_to_end(key)
+                self.hits += 1
+                if not self.consistency_check:
+                    return self._to_labels(entry.bits), entry, self._generations.get(key, 0)
+            else:
+                self.misses += 1
+                entry = None
+            return None, entry, self._generations.get(key, 0)
+
+    def _loaded(self, key, entry, generation, seats):
+        with self._lock:
+            bits = self._to_bits(seats)
+            if entry is not None and entry.bits != bits:
+                self.mismatches += 1
+                log_warning("seat_index_mismatch", key=key, index=self._to_labels(entry.bits),
+                            db=self._to_labels(bits))
+            # لا نخزن نتيجة قد تكون سبقت حجزاً أو إلغاءً تم أثناء القراءة
+            if self._generations.get(key, 0) == generation:
+                self._store(key, bits, time.monotonic())
+            return self._to_labels(bits)
+
+    def booked_seats(self, key, loader):
+        """Return the taken seat labels for `key`; `loader(key)` reads them from MySQL."""
+        labels, entry, generation = self._lookup(key)
+        if labels is not None:
+            return labels
+        return self._loaded(key, entry, generation, loader(key))
+
+    async def booked_seats_async(self, key, loader):
+        """Same as booked_seats for coroutine loaders (see async_app.py)."""
+        labels, entry, generation = self._lookup(key)
+        if labels is not None:
+            return labels
+        return self._loaded(key, entry, generation, await loader(key))
+
+    def add_listener(self, listener):
+        """Call `listener(key, seat_number, taken)` after every mark_taken / mark_free."""
+        self._listeners.append(listener)
+
+    def _notify(self, key, seat_number, taken):
+        for listener in self._listeners:
+            try:
+                listener(key, str(seat_number).strip(), taken)
+            except Exception as e:
+                log_warning("seat_index_listener_failed", key=key, error=str(e))
+
+    def mark_taken(self, key, seat_number, notify=True):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            entry = self._slots.get(key)
+            if entry is not None:
+                entry.bits |= 1 << self._bit(seat_number)
+        if notify:
+            self._notify(key, seat_number, True)
+
+    def mark_free(self, key, seat_number, notify=True):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            entry = self._slots.get(key)
+            if entry is not None:
+                entry.bits &= ~(1 << self._bit(seat_number))
+        if notify:
+            self._notify(key, seat_number, False)
+
+    def evict_past(self):
+        with self._lock:
+            return self._evict_past_locked()
+
+    def check(self, loader):
+        """Compare every cached slot with the database and repair any drift."""
+        with self._lock:
+            cached = [(key, entry.bits) for key, entry in self._slots.items()]
+        mismatched = []
+        for key, bits in cached:
+            with self._lock:
+                generation = self._generations.get(key, 0)
+            seats = loader(key)
+            with self._lock:
+                db_bits = self._to_bits(seats)
+                if db_bits != bits:
+                    self.mismatches += 1
+                    mismatched.append({
+                        "slot": list(key),
+                        "index": self._to_labels(bits),
+                        "db": self._to_labels(db_bits),
+                    })
+                    entry = self._slots.get(key)
+                    if entry is not None and self._generations.get(key, 0) == generation:
+                        entry.bits = db_bits
+        return {"checked": len(cached), "mismatched": mismatched}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "slots": len(self._slots),
+                "seat_labels": len(self._seat_labels),
+                "hits": self.hits,
+                "misses": self.misses,
+                "mismatches": self.mismatches,
+            }
+
+
+seat_index = SeatOccupancyIndex(**SEAT_INDEX_SETTINGS)
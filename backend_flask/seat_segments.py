@@ -0,0 +1,401 @@
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from seat_index import normalize_text
+
+# مخزون المقاعد حسب المقاطع: القطار الواحد (الموعد، المسار، الاتجاه، الفئة) يمر بمحطات مرتبة،
+# والمقعد يُباع لكل جزء (leg) بين محطتين متتاليتين. المقعد المحجوز من المحطة 2 إلى 5 يبقى
+# متاحاً من 0 إلى 2 ومن 5 فما بعد. لكل مقعد عدد صحيح: البت k = الجزء k مشغول.
+SEGMENT_SETTINGS = {
+    "topology_path": os.environ.get(
+        "LINE_TOPOLOGY_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "line_topology.json")),
+    "ttl": float(os.environ.get("SEAT_SEGMENTS_TTL", 30)),
+    "max_trains": int(os.environ.get("SEAT_SEGMENTS_MAX_TRAINS", 5000)),
+}
+
+# صف لكل جزء من رحلة الراكب؛ المفتاح الأساسي يمنع بيع الجزء نفسه من المقعد نفسه مرتين
+_INSERT_LEGS_ROW = "(%s, %s, %s, %s, %s, %s, %s)"
+_INSERT_LEGS = """
+    INSERT IGNORE INTO seat_leg_claims (
+        slot_time, line_key, direction, vip, seat_number, leg, ticket_id
+    )
+    VALUES
+"""
+
+# الحجز المؤقت: الصفوف نفسها بلا ticket_id، بـ hold_token ومهلة (migrations/010)
+_INSERT_HOLD_ROW = "(%s, %s, %s, %s, %s, %s, %s, NOW() + INTERVAL %s SECOND)"
+_INSERT_HOLDS = """
+    INSERT IGNORE INTO seat_leg_claims (
+        slot_time, line_key, direction, vip, seat_number, leg, hold_token, expires_at
+    )
+    VALUES
+"""
+
+_LEGS_WHERE = """
+    slot_time = %s AND line_key = %s AND direction = %s AND vip = %s
+    AND seat_number = %s AND leg >= %s AND leg < %s
+"""
+
+_PURGE_EXPIRED_HOLDS = (
+    "DELETE FROM seat_leg_claims WHERE " + _LEGS_WHERE +
+    " AND ticket_id IS NULL AND expires_at < NOW()"
+)
+
+_CONVERT_HOLD = (
+    "UPDATE seat_leg_claims SET ticket_id = %s, hold_token = NULL, expires_at = NULL WHERE " + _LEGS_WHERE +
+    " AND hold_token = %s AND ticket_id IS NULL"
+)
+
+
+class LineTopology:
+    """Ordered stations per line, keyed by normalized line and station names."""
+
+    def __init__(self, lines):
+        self._stations = {}
+        for line, stations in lines.items():
+            self._stations[normalize_text(line)] = {normalize_text(station): i for i, station in enumerate(stations)}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(json.load(f)["lines"])
+        except FileNotFoundError:
+            return cls({})
+
+    def legs(self, line_key, departure_key, arrival_key):
+        """(direction, first_leg, end_leg) for a journey, or None when the line/stations are unknown.
+
+        Direction 1 is the return train; its legs are numbered from its own
+        first station, so both directions use the low bits for early legs.
+        """
+        stations = self._stations.get(line_key)
+        if not stations:
+            return None
+        departure = stations.get(departure_key)
+        arrival = stations.get(arrival_key)
+        if departure is None or arrival is None or departure == arrival:
+            return None
+        if departure < arrival:
+            return 0, departure, arrival
+        last = len(stations) - 1
+        return 1, last - departure, last - arrival
+
+    def stats(self):
+        return {"lines": len(self._stations), "stations": sum(len(s) for s in self._stations.values())}
+
+
+def leg_mask(first_leg, end_leg):
+    return ((1 << (end_leg - first_leg)) - 1) << first_leg
+
+
+class _TrainEntry:
+    __slots__ = ("seats", "loaded_at")
+
+    def __init__(self, seats, loaded_at):
+        self.seats = seats
+        self.loaded_at = loaded_at
+
+
+class SegmentInventory:
+    """Occupied legs per seat for each train, as {seat_label: leg bitmap}.
+
+    A seat is free for a journey when `bitmap & leg_mask(journey) == 0`, so a
+    segment availability query is one AND per booked seat. Trains are loaded
+    lazily from seat_leg_claims and cached like SeatOccupancyIndex slots.
+    """
+
+    def __init__(self, ttl=30.0, max_trains=5000):
+        self.ttl = ttl
+        self.max_trains = max_trains
+        self._lock = threading.Lock()
+        self._trains = OrderedDict()
+        # عداد تغييرات لكل قطار، كما في SeatOccupancyIndex؛ يُحذف مع القطار بعد موعده
+        self._generations = {}
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, train):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._trains.get(train)
+            if entry is not None and now - entry.loaded_at <= self.ttl:
+                self._trains.move_to_end(train)
+                self.hits += 1
+                return entry.seats, self._generations.get(train, 0)
+            self.misses += 1
+            return None, self._generations.get(train, 0)
+
+    def _loaded(self, train, generation, rows):
+        seats = {}
+        for seat_number, leg in rows:
+            seat = str(seat_number).strip()
+            seats[seat] = seats.get(seat, 0) | (1 << leg)
+        with self._lock:
+            # لا نخزن قراءة قد تكون سبقت حجزاً أو إلغاءً تم أثناءها
+            if self._generations.get(train, 0) == generation:
+                now = time.monotonic()
+                self._trains[train] = _TrainEntry(seats, now)
+                self._trains.move_to_end(train)
+                while len(self._trains) > self.max_trains:
+                    self._trains.popitem(last=False)
+                if now - self._last_sweep > 60:
+                    self._last_sweep = now
+                    self._evict_past_locked()
+        return seats
+
+    def _evict_past_locked(self):
+        now_slot = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for train in [train for train in self._trains if train[0] < now_slot]:
+            del self._trains[train]
+        for train in [train for train in self._generations if train[0] < now_slot]:
+            del self._generations[train]
+
+    @staticmethod
+    def _overlapping(seats, mask):
+        return [seat for seat, legs in seats.items() if legs & mask]
+
+    def taken(self, train, mask, loader):
+        """Seat labels with at least one occupied leg inside `mask`; `loader(train)` yields (seat, leg) rows."""
+        seats, generation = self._lookup(train)
+        if seats is None:
+            seats = self._loaded(train, generation, loader(train))
+        with self._lock:
+            return self._overlapping(seats, mask)
+
+    async def taken_async(self, train, mask, loader):
+        seats, generation = self._lookup(train)
+        if seats is None:
+            seats = self._loaded(train, generation, await loader(train))
+        with self._lock:
+            return self._overlapping(seats, mask)
+
+    def mark_taken(self, train, seat_number, mask):
+        with self._lock:
+            self._generations[train] = self._generations.get(train, 0) + 1
+            entry = self._trains.get(train)
+            if entry is not None:
+                seat = str(seat_number).strip()
+                entry.seats[seat] = entry.seats.get(seat, 0) | mask
+
+    def mark_free(self, train, seat_number, mask):
+        with self._lock:
+            self._generations[train] = self._generations.get(train, 0) + 1
+            entry = self._trains.get(train)
+            if entry is not None:
+                seat = str(seat_number).strip()
+                remaining = entry.seats.get(seat, 0) & ~mask
+                if remaining:
+                    entry.seats[seat] = remaining
+                else:
+                    entry.seats.pop(seat, None)
+
+    def stats(self):
+        with self._lock:
+            return {"trains": len(self._trains), "hits": self.hits, "misses": self.misses}
+
+
+class SeatSegments:
+    """Overlap-free seat claims for journeys on lines with a known topology.
+
+    claim() writes one seat_leg_claims row per leg inside the caller's
+    transaction; the primary key turns any overlap into a short row count,
+    and the caller rolls back. hold() writes the same rows under a seat_engine
+    hold token, so a seat held for payment cannot be sold on an overlapping
+    segment. Journeys on unknown lines or stations return None from journey()
+    and keep the exact-segment seat_claims behaviour.
+    """
+
+    def __init__(self, topology_path, ttl=30.0, max_trains=5000):
+        self.topology = LineTopology.load(topology_path)
+        self.inventory = SegmentInventory(ttl, max_trains)
+        self._lock = threading.Lock()
+        self.claims = 0
+        self.conflicts = 0
+        self.holds = 0
+        self.hold_conflicts = 0
+
+    def journey(self, key):
+        """(train, mask, first_leg, end_leg) for a seat_index slot key, or None."""
+        legs = self.topology.legs(key[1], key[2], key[3])
+        if legs is None:
+            return None
+        direction, first_leg, end_leg = legs
+        return (key[0], key[1], direction, key[4]), leg_mask(first_leg, end_leg), first_leg, end_leg
+
+    @staticmethod
+    def _rows(train, seat_number, first_leg, end_leg, *values):
+        seat = str(seat_number).strip()
+        params = ()
+        for leg in range(first_leg, end_leg):
+            params += tuple(train) + (seat, leg) + values
+        return params
+
+    def _insert(self, journey, seat_number, ticket_id):
+        train, _, first_leg, end_leg = journey
+        legs = end_leg - first_leg
+        return (_INSERT_LEGS + ", ".join([_INSERT_LEGS_ROW] * legs),
+                self._rows(train, seat_number, first_leg, end_leg, ticket_id), legs)
+
+    def _insert_holds(self, journey, seat_number, hold_token, seconds):
+        train, _, first_leg, end_leg = journey
+        legs = end_leg - first_leg
+        return (_INSERT_HOLDS + ", ".join([_INSERT_HOLD_ROW] * legs),
+                self._rows(train, seat_number, first_leg, end_leg, hold_token, seconds), legs)
+
+    @staticmethod
+    def _legs_params(journey, seat_number):
+        train, _, first_leg, end_leg = journey
+        return tuple(train) + (str(seat_number).strip(), first_leg, end_leg)
+
+    def _count(self, won, hold=False):
+        with self._lock:
+            if hold:
+                self.holds += 1
+                if not won:
+                    self.hold_conflicts += 1
+            else:
+                self.claims += 1
+                if not won:
+                    self.conflicts += 1
+        return won
+
+    def _insert_legs(self, cursor, journey, seat_number, sql, params, legs, already=0):
+        cursor.execute(sql, params)
+        inserted = already + cursor.rowcount
+        if inserted == legs:
+            return True
+        # جزء مشغول؛ يُعاد الإدراج مرة واحدة فقط إذا حُذف حجز مؤقت منتهٍ عليه، كما في seat_engine.
+        # الصفوف التي أُدرجت قبل قليل تُتجاهل كمكررة، فيُعدّ الجديد فقط
+        cursor.execute(_PURGE_EXPIRED_HOLDS, self._legs_params(journey, seat_number))
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute(sql, params)
+        return inserted + cursor.rowcount == legs
+
+    def claim(self, cursor, journey, seat_number, ticket_id, hold_token=None):
+        """Claim every leg of `journey` for the ticket; False if any leg of that seat is sold.
+
+        With a hold_token the legs held by hold() are converted first; legs the
+        hold no longer covers (it expired and was purged) are claimed afresh.
+        """
+        sql, params, legs = self._insert(journey, seat_number, ticket_id)
+        converted = 0
+        if hold_token:
+            cursor.execute(_CONVERT_HOLD, (ticket_id,) + self._legs_params(journey, seat_number) + (hold_token,))
+            converted = cursor.rowcount
+        if converted == legs:
+            return self._count(True)
+        return self._count(self._insert_legs(cursor, journey, seat_number, sql, params, legs, converted))
+
+    async def claim_async(self, cursor, journey, seat_number, ticket_id, hold_token=None):
+        """claim() for an aiomysql cursor; same statements, same ordering."""
+        sql, params, legs = self._insert(journey, seat_number, ticket_id)
+        legs_params = self._legs_params(journey, seat_number)
+        converted = 0
+        if hold_token:
+            converted = await cursor.execute(_CONVERT_HOLD, (ticket_id,) + legs_params + (hold_token,))
+        inserted = converted
+        if inserted < legs:
+            inserted += await cursor.execute(sql, params)
+            if inserted < legs and await cursor.execute(_PURGE_EXPIRED_HOLDS, legs_params):
+                inserted += await cursor.execute(sql, params)
+        return self._count(inserted == legs)
+
+    def hold(self, cursor, journey, seat_number, hold_token, seconds):
+        """Hold every leg of `journey` under the seat_engine hold token; False if any leg is taken."""
+        sql, params, legs = self._insert_holds(journey, seat_number, hold_token, seconds)
+        return self._count(self._insert_legs(cursor, journey, seat_number, sql, params, legs), hold=True)
+
+    def release_hold(self, cursor, hold_token):
+        cursor.execute("DELETE FROM seat_leg_claims WHERE hold_token = %s AND ticket_id IS NULL", (hold_token,))
+
+    def release(self, cursor, ticket_id):
+        cursor.execute("DELETE FROM seat_leg_claims WHERE ticket_id = %s", (ticket_id,))
+
+    def release_many(self, cursor, ticket_ids):
+        if ticket_ids:
+            cursor.execute(
+                "DELETE FROM seat_leg_claims WHERE ticket_id IN (" + ", ".join(["%s"] * len(ticket_ids)) + ")",
+                tuple(ticket_ids)
+            )
+
+    def taken(self, journey, loader):
+        train, mask, _, _ = journey
+        return self.inventory.taken(train, mask, loader)
+
+    async def taken_async(self, journey, loader):
+        train, mask, _, _ = journey
+        return await self.inventory.taken_async(train, mask, loader)
+
+    def mark_taken(self, key, seat_number):
+        journey = self.journey(key)
+        if journey is not None:
+            self.inventory.mark_taken(journey[0], seat_number, journey[1])
+
+    def mark_free(self, key, seat_number):
+        journey = self.journey(key)
+        if journey is not None:
+            self.inventory.mark_free(journey[0], seat_number, journey[1])
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "claims": self.claims,
+                "conflicts": self.conflicts,
+                "holds": self.holds,
+                "hold_conflicts": self.hold_conflicts,
+            }
+        return {**counters, **self.topology.stats(), **self.inventory.stats()}
+
+
+seat_segments = SeatSegments(**SEGMENT_SETTINGS)
+
+
+def backfill(cursor):
+    """Write leg claims for upcoming paid tickets that predate seat_leg_claims; returns (written, overlaps)."""
+    from seat_index import slot_key
+
+    cursor.execute("""
+        SELECT id_ticket, date_ticket_time, line_key, departure_key, arrival_key, vip, seat_number
+        FROM tickets
+        WHERE paid = 1 AND date_ticket_time >= NOW()
+        AND id_ticket NOT IN (SELECT ticket_id FROM seat_leg_claims WHERE ticket_id IS NOT NULL)
+        ORDER BY id_ticket
+    """)
+    written, overlaps = 0, []
+    for ticket_id, slot, line_key, departure_key, arrival_key, vip, seat_number in cursor.fetchall():
+        journey = seat_segments.journey(slot_key(slot, line_key, departure_key, arrival_key, vip))
+        if journey is None:
+            continue
+        sql, params, legs = seat_segments._insert(journey, seat_number, ticket_id)
+        cursor.execute(sql, params)
+        written += 1
+        if cursor.rowcount != legs:
+            # بيعت مقاطع متداخلة قبل هذا التغيير؛ تُعرض للمراجعة ولا تُلغى تلقائياً
+            overlaps.append(ticket_id)
+    return written, overlaps
+
+
+if __name__ == "__main__":
+    # python seat_segments.py backfill   — بعد تطبيق 005_seat_leg_claims.sql
+    if sys.argv[1:] != ["backfill"]:
+        print("usage: python seat_segments.py backfill")
+        sys.exit(2)
+    from db_config import get_connection
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        written, overlaps = backfill(cursor)
+        conn.commit()
+        print(f"✅ {written} tickets backfilled; {len(overlaps)} overlap an earlier ticket: {overlaps[:50]}")
+    finally:
+        cursor.close()
+        conn.close()
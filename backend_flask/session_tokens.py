@@ -0,0 +1,157 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from signing import Signer, keys_from_env
+
+SESSION_SETTINGS = {
+    **keys_from_env("SESSION_TOKEN_KEYS", "SESSION_TOKEN_ACTIVE_KID", "reserve-and-ride-session-secret"),
+    "access_ttl": int(os.environ.get("SESSION_ACCESS_TTL", 900)),
+    "refresh_ttl": int(os.environ.get("SESSION_REFRESH_TTL", 30 * 86400)),
+    "cache_size": int(os.environ.get("SESSION_CACHE_SIZE", 50000)),
+}
+
+
+def _digest(secret):
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+class SessionTokens:
+    """Short-lived signed access tokens plus refresh tokens stored in `sessions`.
+
+    An access token carries the principal (role, subject id, name) and is
+    checked with one HMAC; the verified principal is then cached per token so
+    later requests are a dictionary lookup. Refresh tokens ("<session_id>.<secret>")
+    are kept hashed in the database and rotated on every use. Logging out
+    revokes the session in the database and in this process; other workers
+    stop accepting the session's access tokens when they expire.
+
+    Database methods take the caller's cursor, like seat_engine.
+    """
+
+    def __init__(self, keys, active_kid, access_ttl=900, refresh_ttl=30 * 86400, cache_size=50000):
+        self.signer = Signer(keys, active_kid)
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self.cache_size = cache_size
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._revoked_sessions = {}
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rejected = 0
+
+    def _access_token(self, session_id, principal):
+        claims = {
+            "sid": session_id,
+            "role": principal["role"],
+            "sub": str(principal["id"]),
+            "name": principal.get("name"),
+            "exp": int(time.time()) + self.access_ttl,
+        }
+        return self.signer.dumps(claims)
+
+    def _tokens(self, session_id, secret, principal):
+        return {
+            "access_token": self._access_token(session_id, principal),
+            "refresh_token": f"{session_id}.{secret}",
+            "expires_in": self.access_ttl,
+        }
+
+    def create_session(self, cursor, principal):
+        """Start a session for {"role", "id", "name"} and return its tokens."""
+        session_id = secrets.token_hex(16)
+        secret = secrets.token_urlsafe(32)
+        cursor.execute("""
+            INSERT INTO sessions (session_id, role, subject_id, name, refresh_hash, expires_at, revoked, created_at)
+            VALUES (%s, %s, %s, %s, %s, NOW() + INTERVAL %s SECOND, 0, NOW())
+        """, (session_id, principal["role"], str(principal["id"]), principal.get("name"),
+              _digest(secret), self.refresh_ttl))
+        return self._tokens(session_id, secret, principal)
+
+    def _split_refresh(self, refresh_token):
+        try:
+            session_id, secret = str(refresh_token).strip().split(".", 1)
+        except ValueError:
+            return None, None
+        return session_id, secret
+
+    def refresh(self, cursor, refresh_token):
+        """Rotate a refresh token; returns new tokens or None if it is invalid, expired or revoked."""
+        session_id, secret = self._split_refresh(refresh_token)
+        if not session_id:
+            return None
+        cursor.execute("""
+            SELECT role, subject_id, name, refresh_hash
+            FROM sessions
+            WHERE session_id = %s AND revoked = 0 AND expires_at > NOW()
+            FOR UPDATE
+        """, (session_id,))
+        row = cursor.fetchone()
+        if row is None or not hmac.compare_digest(row[3], _digest(secret)):
+            return None
+
+        new_secret = secrets.token_urlsafe(32)
+        cursor.execute("UPDATE sessions SET refresh_hash = %s WHERE session_id = %s",
+                       (_digest(new_secret), session_id))
+        principal = {"role": row[0], "id": row[1], "name": row[2]}
+        return self._tokens(session_id, new_secret, principal)
+
+    def revoke(self, cursor, session_id):
+        cursor.execute("UPDATE sessions SET revoked = 1 WHERE session_id = %s", (session_id,))
+        with self._lock:
+            self._revoked_sessions[session_id] = time.time() + self.access_ttl
+            for token in [t for t, (p, _) in self._cache.items() if p["sid"] == session_id]:
+                del self._cache[token]
+
+    def session_id_of_refresh(self, refresh_token):
+        return self._split_refresh(refresh_token)[0]
+
+    def authenticate(self, access_token):
+        """Return the principal of a valid access token, or None. No database access."""
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(access_token)
+            if cached is not None and cached[1] > now:
+                self._cache.move_to_end(access_token)
+                self.cache_hits += 1
+                return cached[0]
+            self.cache_misses += 1
+
+        claims = self.signer.loads(access_token)
+        if claims is None or claims.get("exp", 0) <= now:
+            with self._lock:
+                self.rejected += 1
+                self._cache.pop(access_token, None)
+            return None
+
+        principal = {"sid": claims["sid"], "role": claims["role"], "id": claims["sub"], "name": claims.get("name")}
+        with self._lock:
+            if self._revoked_sessions.get(claims["sid"], 0) > now:
+                self.rejected += 1
+                return None
+            self._cache[access_token] = (principal, claims["exp"])
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            if len(self._revoked_sessions) > 1000:
+                self._revoked_sessions = {sid: until for sid, until in self._revoked_sessions.items() if until > now}
+        return principal
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "rejected": self.rejected,
+                "revoked_sessions": len(self._revoked_sessions),
+            }
+
+
+session_tokens = SessionTokens(**SESSION_SETTINGS)
@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+
+
+def debug_mode():
+    """FLASK_DEBUG=true (default off): the one place the flag is read, for the signing keys and app.run."""
+    return os.environ.get("FLASK_DEBUG", "false").lower() == "true"
+
+
+def keys_from_env(keys_var, active_var, dev_secret):
+    """{"keys", "active_kid"} Signer settings from a JSON {"kid": "secret"} environment variable.
+
+    Without it the built-in development key is used, but only when
+    FLASK_DEBUG=true: anyone can read that key here and forge tokens with it.
+    """
+    raw = os.environ.get(keys_var)
+    if raw:
+        return {"keys": json.loads(raw), "active_kid": os.environ.get(active_var, "dev1")}
+    if not debug_mode():
+        raise RuntimeError(f"{keys_var} is not set; configure signing keys (the built-in "
+                           f"development key is only accepted with FLASK_DEBUG=true)")
+    return {"keys": {"dev1": dev_secret}, "active_kid": os.environ.get(active_var, "dev1")}
+
+
+def b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class Signer:
+    """HMAC-SHA256 signed JSON claims in the form "<kid>.<claims>.<signature>".
+
+    The active key signs new tokens; every configured key is accepted when
+    checking, so keys can be rotated without invalidating issued tokens.
+    """
+
+    def __init__(self, keys, active_kid):
+        if active_kid not in keys:
+            raise ValueError(f"Active signing key '{active_kid}' is not configured")
+        self.keys = {kid: secret.encode("utf-8") for kid, secret in keys.items()}
+        self.active_kid = active_kid
+
+    def _sign(self, kid, body):
+        digest = hmac.new(self.keys[kid], f"{kid}.{body}".encode("ascii"), hashlib.sha256).digest()
+        return b64encode(digest[:16])
+
+    def dumps(self, claims):
+        body = b64encode(json.dumps(claims, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+        return f"{self.active_kid}.{body}.{self._sign(self.active_kid, body)}"
+
+    def loads(self, token):
+        """Return the claims of a correctly signed token, or None."""
+        try:
+            kid, body, signature = str(token).strip().split(".")
+        except ValueError:
+            return None
+        if kid not in self.keys or not hmac.compare_digest(signature, self._sign(kid, body)):
+            return None
+        try:
+            return json.loads(b64decode(body))
+        except ValueError:
+            return None
@@ -0,0 +1,124 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from event_log import log_warning
+
+# قراءة ما كتبه المستخدم نفسه (read-your-writes): بعد الحجز أو الإلغاء تُقرأ مفاتيح الراكب والرحلة
+# من قاعدة البيانات الأساسية لمدة READ_YOUR_WRITES_SECONDS، لأن النسخ المتماثلة قد تتأخر عنها.
+# الجدول ملف مشترك عبر mmap بين كل عمال الخادم على الجهاز، فلا يهم أي عامل يستقبل القراءة التالية.
+STICKY_SETTINGS = {
+    "path": os.environ.get("READ_STICKY_FILE", os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "reserve-and-ride-sticky-reads")),
+    "seconds": float(os.environ.get("READ_YOUR_WRITES_SECONDS", 5)),
+    "slots": int(os.environ.get("READ_STICKY_SLOTS", 65536)),
+}
+
+
+def user_sticky_keys(passenger_id=None, name_key=None):
+    """Keys for a passenger's booking lists, by user id and by tickets.name_key."""
+    keys = []
+    if passenger_id:
+        keys.append(f"user:{passenger_id}")
+    if name_key:
+        keys.append(f"name:{name_key}")
+    return keys
+
+
+def slot_sticky_key(key):
+    """Key for one seat_index slot (slot, line, departure, arrival, vip)."""
+    return "slot:" + "|".join(str(part) for part in key)
+
+
+def train_sticky_key(train):
+    """Key for one seat_segments train (slot, line, direction, vip)."""
+    return "train:" + "|".join(str(part) for part in train)
+
+
+def time_sticky_key(slot_time):
+    """Key for every trip leaving at one normalized slot time."""
+    return f"time:{slot_time}"
+
+
+class StickyReads:
+    """Per-key "read from the primary until" deadlines in a fixed-size shared table.
+
+    Keys hash to one of `slots` int64 slots holding a deadline in
+    milliseconds. Two keys sharing a slot only make some reads go to the
+    primary a little longer, never the reverse, so the table needs no locks
+    across processes and never grows. If the shared file cannot be opened the
+    table falls back to this process's memory.
+    """
+
+    def __init__(self, path, seconds=5.0, slots=65536):
+        self.path = path
+        self.window_ms = int(seconds * 1000)
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._table = None
+        self._pid = None
+        self.marks = 0
+        self.sticky_reads = 0
+
+    def _slots(self):
+        if self._table is None or self._pid != os.getpid():
+            with self._lock:
+                if self._table is None or self._pid != os.getpid():
+                    self._table = self._open()
+                    self._pid = os.getpid()
+        return self._table
+
+    def _open(self):
+        size = self.slots * 8
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                shared = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            finally:
+                os.close(fd)
+            return memoryview(shared).cast("q")
+        except (OSError, ValueError) as e:
+            log_warning("sticky_reads_local_only", path=self.path, error=str(e))
+            return memoryview(bytearray(size)).cast("q")
+
+    def _slot(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.slots
+
+    def mark(self, *keys):
+        """Send reads of these keys to the primary for the next `seconds`."""
+        if self.window_ms <= 0:
+            return
+        table = self._slots()
+        until = int(time.time() * 1000) + self.window_ms
+        for key in keys:
+            slot = self._slot(key)
+            if table[slot] < until:
+                table[slot] = until
+        with self._lock:
+            self.marks += 1
+
+    def sticky(self, *keys):
+        """True when any key was written within the window."""
+        if self.window_ms <= 0 or not keys:
+            return False
+        table = self._slots()
+        now = int(time.time() * 1000)
+        if any(table[self._slot(key)] > now for key in keys):
+            with self._lock:
+                self.sticky_reads += 1
+            return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {"window_seconds": self.window_ms / 1000, "slots": self.slots,
+                    "marks": self.marks, "sticky_reads": self.sticky_reads}
+
+
+sticky_reads = StickyReads(**STICKY_SETTINGS)
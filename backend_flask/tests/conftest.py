@@ -0,0 +1,11 @@
+import os
+import sys
+
+# الوحدات في backend_flask/ تُستورد بأسمائها كما يفعل app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# مفاتيح التوقيع مطلوبة عند الاستيراد خارج وضع التطوير (signing.keys_from_env)
+os.environ.setdefault("TICKET_TOKEN_KEYS", '{"test": "test-ticket-secret"}')
+os.environ.setdefault("TICKET_TOKEN_ACTIVE_KID", "test")
+os.environ.setdefault("SESSION_TOKEN_KEYS", '{"test": "test-session-secret"}')
+os.environ.setdefault("SESSION_TOKEN_ACTIVE_KID", "test")
@@ -0,0 +1,130 @@
+import datetime
+import re
+import sqlite3
+
+# قاعدة SQLite في ملف تتصرف مثل اتصال mysql-connector بالقدر الذي تحتاجه الاختبارات:
+# %s، INSERT/UPDATE IGNORE، NOW()، GREATEST، LAST_INSERT_ID(expr)، FOR UPDATE.
+# الملف مشترك بين العمليات، فيبقى ما كُتب بعد قتل العملية كما في MySQL.
+
+SCHEMA = [
+    # المفتاح الأساسي بعد migrations/007؛ رقم تذكرة مكرر بنفس الرحلة يُتجاهل، ورقم مكرر لرحلة أخرى يظهر صفين
+    """
+    CREATE TABLE tickets (
+        id_ticket INTEGER NOT NULL, name TEXT, user_id INTEGER, date_ticket_time TEXT NOT NULL,
+        date_ticket_find TEXT, seat_number TEXT NOT NULL, vip INTEGER NOT NULL, paid INTEGER NOT NULL,
+        line TEXT, departure_station TEXT, arrival_station TEXT,
+        name_key TEXT, line_key TEXT, departure_key TEXT, arrival_key TEXT,
+        PRIMARY KEY (id_ticket, date_ticket_time)
+    )
+    """,
+    """
+    CREATE TABLE seat_claims (
+        slot_time TEXT NOT NULL, line_key TEXT NOT NULL, departure_key TEXT NOT NULL,
+        arrival_key TEXT NOT NULL, vip INTEGER NOT NULL, seat_number TEXT NOT NULL,
+        ticket_id INTEGER NULL, hold_token TEXT NULL, expires_at TEXT NULL,
+        PRIMARY KEY (slot_time, line_key, departure_key, arrival_key, vip, seat_number)
+    )
+    """,
+    """
+    CREATE TABLE seat_leg_claims (
+        slot_time TEXT NOT NULL, line_key TEXT NOT NULL, direction INTEGER NOT NULL, vip INTEGER NOT NULL,
+        seat_number TEXT NOT NULL, leg INTEGER NOT NULL,
+        ticket_id INTEGER NULL, hold_token TEXT NULL, expires_at TEXT NULL,
+        PRIMARY KEY (slot_time, line_key, direction, vip, seat_number, leg)
+    )
+    """,
+    "CREATE TABLE ticket_id_sequence (id INTEGER PRIMARY KEY, next_id INTEGER NOT NULL)",
+    "INSERT INTO ticket_id_sequence (id, next_id) VALUES (1, 1)",
+]
+
+_REWRITES = [
+    (re.compile(r"\bINSERT IGNORE\b"), "INSERT OR IGNORE"),
+    (re.compile(r"\bUPDATE IGNORE\b"), "UPDATE OR IGNORE"),
+    (re.compile(r"\bGREATEST\("), "MAX("),
+    (re.compile(r"NOW\(\) \+ INTERVAL %s SECOND"), "datetime('now', 'localtime', '+' || %s || ' seconds')"),
+    (re.compile(r"\s+FOR UPDATE\b"), ""),
+    (re.compile(r"%s"), "?"),
+]
+
+
+def create(path, statements=SCHEMA):
+    db = sqlite3.connect(path)
+    for statement in statements:
+        db.execute(statement)
+    db.commit()
+    db.close()
+
+
+class Cursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = conn._db.cursor()
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        if re.search(r"\bIN \(\s*\)", sql):
+            # SQLite يقبل IN () أما MySQL فيرفضه (1064)؛ الاختبار يجب أن يفشل كما يفشل الإنتاج
+            raise sqlite3.OperationalError("1064 (42000): You have an error in your SQL syntax near ')'")
+        for pattern, replacement in _REWRITES:
+            sql = pattern.sub(replacement, sql)
+        self._conn.before_execute(sql)
+        self._cursor.execute(sql, tuple(params))
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    """One sqlite3 connection with mysql-connector's cursor/commit/rollback/close surface.
+
+    on_commit(conn, stage) runs "before" and "after" each commit, so a test
+    can end the process at an exact point of a transaction.
+    """
+
+    def __init__(self, path, on_commit=None):
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.create_function("NOW", 0, lambda: datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self._db.create_function("LAST_INSERT_ID", -1, self._last_insert_id)
+        self._last_id = 0
+        self._on_commit = on_commit
+        self.statements = []
+
+    def _last_insert_id(self, *value):
+        # LAST_INSERT_ID(expr) يحفظ القيمة لهذا الاتصال ويعيدها، كما في MySQL
+        if value:
+            self._last_id = value[0]
+        return self._last_id
+
+    def before_execute(self, sql):
+        self.statements.append(sql)
+
+    @property
+    def in_transaction(self):
+        return self._db.in_transaction
+
+    def cursor(self, *args, **kwargs):
+        return Cursor(self)
+
+    def commit(self):
+        if self._on_commit:
+            self._on_commit(self, "before")
+        self._db.commit()
+        if self._on_commit:
+            self._on_commit(self, "after")
+        self.statements = []
+
+    def rollback(self):
+        self._db.rollback()
+        self.statements = []
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,33 @@
+import pytest
+
+# مسارات تُرفض قبل أي اتصال بقاعدة البيانات، فلا تحتاج MySQL؛ تحتاج Flask و mysql-connector فقط
+pytest.importorskip("flask")
+pytest.importorskip("mysql.connector")
+
+import app as app_module  # noqa: E402
+from session_tokens import session_tokens  # noqa: E402
+
+SLOT = {"time": "2030-01-01 08:00:00", "line": "Blue"}
+
+
+def bearer(role):
+    token = session_tokens._access_token("s" * 32, {"role": role, "id": "1", "name": "n"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def test_anonymous_slot_cancel_is_refused(client):
+    response = client.post("/bookings/cancel/batch", json=SLOT)
+    assert response.status_code == 403
+    response = client.post("/bookings/cancel/batch",
+                           json=dict(SLOT, departure_station="A", arrival_station="B"))
+    assert response.status_code == 403
+
+
+def test_passenger_slot_cancel_is_refused(client):
+    response = client.post("/bookings/cancel/batch", json=SLOT, headers=bearer("passenger"))
+    assert response.status_code == 403
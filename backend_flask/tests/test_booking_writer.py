@@ -0,0 +1,246 @@
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import sqlite_db
+from booking_writer import BookingWriter
+from seat_segments import SeatSegments
+
+# وضع الكتابة المؤجلة: تُقتل العملية في منتصف دفعة، ثم تعيد عملية جديدة تشغيل السجل.
+# كل حجز أُكِّد للعميل يجب أن يكون في tickets مرة واحدة فقط، بمطالبة مقعده، ومحسوباً مرة واحدة.
+
+SLOT = ("2030-01-01 08:00:00", "blue", "a", "b", 0)
+SEATS = 150
+ATTEMPTS_PER_SEAT = 2
+
+WRITTEN_LOG = "CREATE TABLE written_log (id_ticket INTEGER NOT NULL)"
+
+
+def ticket(seat):
+    return {
+        "name": f"p{seat}", "user_id": None, "date_ticket_time": SLOT[0], "date_ticket_find": SLOT[0],
+        "vip": 0, "paid": 1, "line": "Blue", "departure_station": "A", "arrival_station": "B",
+        "name_key": f"p{seat}", "line_key": SLOT[1], "departure_key": SLOT[2], "arrival_key": SLOT[3],
+    }
+
+
+def log_written(cursor, rows):
+    # بديل on_written (booking_rollups في app.py): أي تذكرة تُمرَّر مرتين تُحسب مرتين
+    for row in rows:
+        cursor.execute("INSERT INTO written_log (id_ticket) VALUES (%s)", (row["id_ticket"],))
+
+
+def make_writer(tmp, on_commit=None):
+    writer = BookingWriter(enabled=True, journal_path=os.path.join(tmp, "journal", "bookings.log"),
+                           batch_size=25, flush_interval=0.005, id_block=40)
+    writer.start(lambda: sqlite_db.Connection(os.path.join(tmp, "db.sqlite"), on_commit),
+                 on_written=log_written)
+    return writer
+
+
+def book_all(writer, seats, ack_fd):
+    """Accept every seat ATTEMPTS_PER_SEAT times from several threads; acknowledged ids go to ack_fd."""
+    def worker(numbers):
+        for seat in numbers:
+            ticket_id = writer.accept(SLOT, seat, ticket(seat), seat_taken=False)
+            if ticket_id is not None:
+                # يُكتب بعد عودة accept، أي بعد fsync السجل: هذا ما رآه العميل
+                os.write(ack_fd, f"{ticket_id} {seat}\n".encode())
+
+    numbers = [str(seat) for seat in seats] * ATTEMPTS_PER_SEAT
+    threads = [threading.Thread(target=worker, args=(numbers[i::8],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def crashing_run(tmp, ack_path, crash):
+    commits = {"tickets": 0}
+
+    def on_commit(conn, stage):
+        if not any("INTO tickets" in sql for sql in conn.statements):
+            return
+        if stage == "before":
+            commits["tickets"] += 1
+        if commits["tickets"] == 3 and stage == crash:
+            os._exit(9)
+
+    ack_fd = os.open(ack_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    writer = make_writer(tmp, on_commit)
+    book_all(writer, range(1, SEATS + 1), ack_fd)
+    writer.drain(timeout=30)
+    os._exit(0)
+
+
+def recovery_run(tmp, ack_path):
+    ack_fd = os.open(ack_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    writer = make_writer(tmp)
+    # حجوزات جديدة بعد إعادة التشغيل: أرقامها يجب ألا تتكرر مع أرقام السجل القديم
+    book_all(writer, range(SEATS + 1, SEATS + 21), ack_fd)
+    os._exit(0 if writer.drain(timeout=30) and writer.last_error is None else 1)
+
+
+def run(target, *args):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    return process
+
+
+def acknowledged(ack_path):
+    with open(ack_path) as f:
+        return [tuple(line.split()) for line in f if line.strip()]
+
+
+@pytest.mark.parametrize("crash", ["before", "after", "sigkill"])
+def test_kill_mid_batch_loses_and_duplicates_nothing(tmp_path, crash):
+    tmp = str(tmp_path)
+    ack_path = os.path.join(tmp, "acks")
+    sqlite_db.create(os.path.join(tmp, "db.sqlite"), sqlite_db.SCHEMA + [WRITTEN_LOG])
+
+    if crash == "sigkill":
+        process = run(crashing_run, tmp, ack_path, None)
+        deadline = time.monotonic() + 30
+        while (not os.path.exists(ack_path) or len(acknowledged(ack_path)) < SEATS // 2) \
+                and time.monotonic() < deadline:
+            time.sleep(0.002)
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+        assert process.exitcode == -signal.SIGKILL
+    else:
+        # before: يموت قبل COMMIT الدفعة الثالثة؛ after: بعده وقبل سطر "flushed" في السجل
+        process = run(crashing_run, tmp, ack_path, crash)
+        process.join(60)
+        assert process.exitcode == 9
+
+    before_restart = acknowledged(ack_path)
+    assert before_restart, "the process died before acknowledging any booking"
+
+    process = run(recovery_run, tmp, ack_path)
+    process.join(60)
+    assert process.exitcode == 0, "replay or the flush after it failed"
+
+    acks = acknowledged(ack_path)
+    db = sqlite3.connect(os.path.join(tmp, "db.sqlite"))
+    tickets = db.execute("SELECT id_ticket, seat_number, paid FROM tickets").fetchall()
+    claims = dict(db.execute("SELECT seat_number, ticket_id FROM seat_claims").fetchall())
+    written = [row[0] for row in db.execute("SELECT id_ticket FROM written_log").fetchall()]
+
+    ids = [row[0] for row in tickets]
+    assert len(ids) == len(set(ids)), "a ticket id was written twice"
+    assert len(written) == len(set(written)), "a replayed ticket was counted twice"
+
+    by_id = {row[0]: row for row in tickets}
+    acked_seats = [seat for _, seat in acks]
+    assert len(acked_seats) == len(set(acked_seats)), "two bookings were acknowledged for one seat"
+    for ticket_id, seat in acks:
+        row = by_id.get(int(ticket_id))
+        assert row is not None, f"acknowledged ticket {ticket_id} was lost"
+        assert row[1] == seat and row[2] == 1
+        assert claims[seat] == int(ticket_id)
+        assert int(ticket_id) in written
+
+
+def segment_writer(tmp, conflicts):
+    topology = os.path.join(tmp, "topology.json")
+    with open(topology, "w") as f:
+        json.dump({"lines": {"Blue": ["A", "B", "C", "D"]}}, f)
+    segments = SeatSegments(topology)
+    writer = BookingWriter(enabled=True, journal_path=os.path.join(tmp, "journal", "bookings.log"),
+                           batch_size=25, flush_interval=0.005, id_block=40)
+    writer.start(lambda: sqlite_db.Connection(os.path.join(tmp, "db.sqlite")),
+                 on_conflict=conflicts.append, journey=segments.journey)
+    return writer
+
+
+def journey_ticket(seat, departure, arrival):
+    return dict(ticket(seat), departure_station=departure, arrival_station=arrival,
+                departure_key=departure.lower(), arrival_key=arrival.lower())
+
+
+def test_write_behind_refuses_overlapping_legs_and_writes_leg_claims(tmp_path):
+    tmp = str(tmp_path)
+    sqlite_db.create(os.path.join(tmp, "db.sqlite"))
+    writer = segment_writer(tmp, [])
+
+    a_to_c = writer.accept((SLOT[0], "blue", "a", "c", 0), "1", journey_ticket("1", "A", "C"), seat_taken=False)
+    b_to_d = writer.accept((SLOT[0], "blue", "b", "d", 0), "1", journey_ticket("1", "B", "D"), seat_taken=False)
+    c_to_d = writer.accept((SLOT[0], "blue", "c", "d", 0), "1", journey_ticket("1", "C", "D"), seat_taken=False)
+    assert a_to_c is not None and b_to_d is None and c_to_d is not None
+    # /booking/update إلى مقطع يتداخل مع حجز مؤجل
+    assert not writer.claim_seat((SLOT[0], "blue", "b", "c", 0), "1")
+    assert writer.drain(timeout=10)
+
+    db = sqlite3.connect(os.path.join(tmp, "db.sqlite"))
+    legs = sorted(db.execute("SELECT leg, ticket_id FROM seat_leg_claims WHERE seat_number = '1'").fetchall())
+    assert legs == [(0, a_to_c), (1, a_to_c), (2, c_to_d)]
+
+    writer.release_seat((SLOT[0], "blue", "a", "c", 0), "1")
+    assert writer.claim_seat((SLOT[0], "blue", "b", "c", 0), "1")
+
+
+def test_write_behind_booking_loses_to_a_leg_claimed_in_mysql(tmp_path):
+    tmp = str(tmp_path)
+    sqlite_db.create(os.path.join(tmp, "db.sqlite"))
+    db = sqlite3.connect(os.path.join(tmp, "db.sqlite"))
+    # حجز مؤقت قائم على الجزء B→C لم يره الفهرس بعد
+    db.execute("INSERT INTO seat_leg_claims (slot_time, line_key, direction, vip, seat_number, leg, hold_token, "
+               "expires_at) VALUES (?, 'blue', 0, 0, '2', 1, 'h', '2999-01-01 00:00:00')", (SLOT[0],))
+    db.commit()
+    conflicts = []
+    writer = segment_writer(tmp, conflicts)
+
+    ticket_id = writer.accept((SLOT[0], "blue", "a", "c", 0), "2", journey_ticket("2", "A", "C"), seat_taken=False)
+    assert writer.drain(timeout=10)
+
+    assert conflicts == [ticket_id]
+    assert db.execute("SELECT paid FROM tickets WHERE id_ticket = ?", (ticket_id,)).fetchone() == (0,)
+    assert db.execute("SELECT COUNT(*) FROM seat_claims WHERE ticket_id = ?", (ticket_id,)).fetchone() == (0,)
+    assert db.execute("SELECT ticket_id, hold_token FROM seat_leg_claims").fetchall() == [(None, "h")]
+
+
+def test_replay_keeps_tickets_cancelled_or_moved_after_their_batch_was_written(tmp_path):
+    tmp = str(tmp_path)
+    sqlite_db.create(os.path.join(tmp, "db.sqlite"), sqlite_db.SCHEMA + [WRITTEN_LOG])
+    moved_to = "2030-01-01 09:00:00"
+    # الدفعة وصلت إلى MySQL لكن العملية ماتت قبل علامة "flushed"؛ بعدها أُلغيت التذكرة 1
+    # ونُقلت التذكرة 2 إلى رحلة أخرى، وحجز متزامن (3) أخذ مقعدها القديم
+    os.makedirs(os.path.join(tmp, "journal"))
+    with open(os.path.join(tmp, "journal", "bookings.log"), "w") as journal:
+        for ticket_id, seat in ((1, "1"), (2, "2")):
+            journal.write(json.dumps({"op": "book", "t": dict(ticket(seat), id_ticket=ticket_id,
+                                                              seat_number=seat)}) + "\n")
+    db = sqlite3.connect(os.path.join(tmp, "db.sqlite"))
+    insert_ticket = ("INSERT INTO tickets (id_ticket, name, date_ticket_time, seat_number, vip, paid, "
+                     "line_key, departure_key, arrival_key) VALUES (?, ?, ?, ?, 0, ?, 'blue', 'a', 'b')")
+    insert_claim = ("INSERT INTO seat_claims (slot_time, line_key, departure_key, arrival_key, vip, "
+                    "seat_number, ticket_id) VALUES (?, 'blue', 'a', 'b', 0, ?, ?)")
+    db.execute(insert_ticket, (1, "p1", SLOT[0], "1", 0))
+    db.execute(insert_ticket, (2, "p2", moved_to, "2", 1))
+    db.execute(insert_claim, (moved_to, "2", 2))
+    db.execute(insert_ticket, (3, "p3", SLOT[0], "2", 1))
+    db.execute(insert_claim, (SLOT[0], "2", 3))
+    db.commit()
+
+    conflicts = []
+    writer = BookingWriter(enabled=True, journal_path=os.path.join(tmp, "journal", "bookings.log"),
+                           batch_size=25, flush_interval=0.005, id_block=40)
+    writer.start(lambda: sqlite_db.Connection(os.path.join(tmp, "db.sqlite")),
+                 on_conflict=conflicts.append, on_written=log_written)
+    # المقعد الملغى يُباع من جديد، والدفتر لا يحجزه باسم التذكرة القديمة
+    rebooked = writer.accept(SLOT, "1", ticket("1"), seat_taken=False)
+    assert rebooked is not None
+    assert writer.drain(timeout=10)
+
+    assert conflicts == []
+    assert db.execute("SELECT date_ticket_time, paid FROM tickets WHERE id_ticket = 2").fetchall() == [(moved_to, 1)]
+    assert db.execute("SELECT paid FROM tickets WHERE id_ticket = 1").fetchall() == [(0,)]
+    claims = sorted(db.execute("SELECT slot_time, seat_number, ticket_id FROM seat_claims").fetchall())
+    assert claims == [(SLOT[0], "1", rebooked), (SLOT[0], "2", 3), (moved_to, "2", 2)]
+    assert [row[0] for row in db.execute("SELECT id_ticket FROM written_log")] == [rebooked]
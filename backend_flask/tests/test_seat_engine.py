@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import sqlite3
+import threading
+
+import sqlite_db
+from seat_engine import SeatReservationEngine
+
+# آلاف الحجوزات المتزامنة للمقعد نفسه من عدة عمليات (كعمال gunicorn) وعدة خيوط في كل منها.
+# كل محاولة هي معاملة /book كاملة: مطالبة، ثم إدراج التذكرة وربطها، ثم COMMIT أو ROLLBACK.
+# يجب أن يفوز حجز واحد فقط، وأن يُبلَّغ كل الخاسرين بعدد الصفوف لا باستثناء.
+
+KEY = ("2030-01-01 08:00:00", "blue", "a", "b", 0)
+SEAT = "7"
+PROCESSES = 8
+THREADS = 32
+ROUNDS = 10
+
+
+def book(engine, path, ticket_id):
+    conn = sqlite_db.Connection(path)
+    cursor = conn.cursor()
+    try:
+        if not engine.claim(cursor, KEY, SEAT):
+            conn.rollback()
+            return False
+        cursor.execute("""
+            INSERT INTO tickets (id_ticket, name, date_ticket_time, seat_number, vip, paid,
+                                 line_key, departure_key, arrival_key)
+            VALUES (%s, %s, %s, %s, 0, 1, 'blue', 'a', 'b')
+        """, (ticket_id, f"p{ticket_id}", KEY[0], SEAT))
+        engine.attach(cursor, KEY, SEAT, ticket_id)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def worker_process(path, process_index, start, results):
+    engine = SeatReservationEngine()
+    wins, errors = [], []
+    barrier = threading.Barrier(THREADS)
+
+    def attempts(thread_index):
+        barrier.wait()
+        for attempt in range(ROUNDS):
+            ticket_id = (process_index * THREADS + thread_index) * ROUNDS + attempt + 1
+            try:
+                if book(engine, path, ticket_id):
+                    wins.append(ticket_id)
+            except Exception as e:
+                errors.append(repr(e))
+
+    start.wait()
+    threads = [threading.Thread(target=attempts, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put({"wins": wins, "errors": errors, **engine.stats()})
+
+
+def run_rush(path):
+    context = multiprocessing.get_context("fork")
+    start, results = context.Event(), context.Queue()
+    processes = [context.Process(target=worker_process, args=(path, i, start, results)) for i in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    start.set()
+    reports = [results.get(timeout=300) for _ in processes]
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    return reports
+
+
+def test_thousands_of_simultaneous_bookings_for_one_seat_have_one_winner(tmp_path):
+    path = os.path.join(str(tmp_path), "db.sqlite")
+    sqlite_db.create(path)
+
+    reports = run_rush(path)
+
+    assert [error for report in reports for error in report["errors"]] == []
+    wins = [ticket_id for report in reports for ticket_id in report["wins"]]
+    total = PROCESSES * THREADS * ROUNDS
+    assert len(wins) == 1
+    assert sum(report["attempts"] for report in reports) == total
+    assert sum(report["conflicts"] for report in reports) == total - 1
+
+    db = sqlite3.connect(path)
+    assert db.execute("SELECT id_ticket FROM tickets").fetchall() == [(wins[0],)]
+    assert db.execute("SELECT seat_number, ticket_id FROM seat_claims").fetchall() == [(SEAT, wins[0])]
+
+
+def test_rush_on_a_seat_with_an_expired_hold_has_one_winner(tmp_path):
+    path = os.path.join(str(tmp_path), "db.sqlite")
+    sqlite_db.create(path)
+    db = sqlite3.connect(path)
+    # حجز مؤقت منتهٍ: كل المتسابقين يحاولون حذفه وإعادة الإدراج في اللحظة نفسها
+    db.execute("INSERT INTO seat_claims (slot_time, line_key, departure_key, arrival_key, vip, seat_number, "
+               "hold_token, expires_at) VALUES (?, 'blue', 'a', 'b', 0, ?, 'h', '2000-01-01 00:00:00')",
+               (KEY[0], SEAT))
+    db.commit()
+
+    reports = run_rush(path)
+
+    assert [error for report in reports for error in report["errors"]] == []
+    wins = [ticket_id for report in reports for ticket_id in report["wins"]]
+    assert len(wins) == 1
+    assert db.execute("SELECT seat_number, ticket_id, hold_token FROM seat_claims").fetchall() == \
+        [(SEAT, wins[0], None)]
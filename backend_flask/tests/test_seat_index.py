@@ -0,0 +1,31 @@
+from seat_index import SeatOccupancyIndex, slot_key
+
+TRIP = slot_key("2030-01-01 08:00:00", "Blue", "A", "B", 0)
+OTHER_TRIP = slot_key("2030-01-01 08:00:00", "Red", "C", "D", 0)
+
+
+def test_booking_on_another_trip_does_not_discard_a_load():
+    index = SeatOccupancyIndex()
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        # حجز على رحلة أخرى أثناء القراءة من MySQL
+        index.mark_taken(OTHER_TRIP, "9")
+        return ["1", "2"]
+
+    assert index.booked_seats(TRIP, loader) == ["1", "2"]
+    assert index.booked_seats(TRIP, loader) == ["1", "2"]
+    assert loads == [TRIP]
+
+
+def test_booking_on_the_same_trip_during_a_load_is_not_overwritten():
+    index = SeatOccupancyIndex()
+
+    def stale_loader(key):
+        index.mark_taken(TRIP, "3")
+        return ["1"]
+
+    index.booked_seats(TRIP, stale_loader)
+    assert sorted(index.booked_seats(TRIP, lambda key: ["1", "3"])) == ["1", "3"]
+    assert index.stats()["misses"] == 2
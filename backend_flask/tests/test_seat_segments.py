@@ -0,0 +1,77 @@
+import json
+
+import sqlite_db
+from seat_index import slot_key
+from seat_segments import SeatSegments, SegmentInventory
+
+TRAIN = ("2030-01-01 08:00:00", "blue", 0, 0)
+OTHER_TRAIN = ("2030-01-01 08:00:00", "red", 0, 0)
+
+
+def test_booking_on_another_train_does_not_discard_a_load():
+    inventory = SegmentInventory()
+    loads = []
+
+    def loader(train):
+        loads.append(train)
+        inventory.mark_taken(OTHER_TRAIN, "9", 0b1)
+        return [("1", 0), ("1", 1)]
+
+    assert inventory.taken(TRAIN, 0b10, loader) == ["1"]
+    assert inventory.taken(TRAIN, 0b100, loader) == []
+    assert loads == [TRAIN]
+
+
+def test_booking_on_the_same_train_during_a_load_is_not_overwritten():
+    inventory = SegmentInventory()
+
+    def stale_loader(train):
+        inventory.mark_taken(TRAIN, "3", 0b1)
+        return []
+
+    assert inventory.taken(TRAIN, 0b1, stale_loader) == []
+    assert inventory.taken(TRAIN, 0b1, lambda train: [("3", 0)]) == ["3"]
+    assert inventory.stats()["misses"] == 2
+
+
+def segments_db(tmp_path):
+    topology = tmp_path / "topology.json"
+    topology.write_text(json.dumps({"lines": {"Blue": ["A", "B", "C", "D"]}}))
+    sqlite_db.create(str(tmp_path / "db.sqlite"))
+    return SeatSegments(str(topology)), sqlite_db.Connection(str(tmp_path / "db.sqlite"))
+
+
+def journey(segments, departure, arrival):
+    return segments.journey(slot_key("2030-01-01 08:00:00", "Blue", departure, arrival, 0))
+
+
+def test_held_legs_block_overlapping_journeys_until_the_hold_is_converted(tmp_path):
+    segments, conn = segments_db(tmp_path)
+    cursor = conn.cursor()
+
+    assert segments.hold(cursor, journey(segments, "A", "C"), "1", "token", 300)
+    conn.commit()
+    # كما في app.py: المطالبة الخاسرة تُلغى مع معاملتها
+    assert not segments.claim(cursor, journey(segments, "B", "D"), "1", 20)
+    conn.rollback()
+    assert not segments.hold(cursor, journey(segments, "B", "D"), "1", "other", 300)
+    conn.rollback()
+    assert segments.claim(cursor, journey(segments, "C", "D"), "1", 21)
+    assert segments.claim(cursor, journey(segments, "A", "C"), "1", 10, hold_token="token")
+    conn.commit()
+
+    cursor.execute("SELECT leg, ticket_id, hold_token FROM seat_leg_claims ORDER BY leg")
+    assert cursor.fetchall() == [(0, 10, None), (1, 10, None), (2, 21, None)]
+
+
+def test_expired_leg_hold_is_purged_by_the_next_claim(tmp_path):
+    segments, conn = segments_db(tmp_path)
+    cursor = conn.cursor()
+    assert segments.hold(cursor, journey(segments, "A", "C"), "1", "token", 300)
+    cursor.execute("UPDATE seat_leg_claims SET expires_at = '2000-01-01 00:00:00'")
+    conn.commit()
+
+    assert segments.claim(cursor, journey(segments, "B", "C"), "1", 30)
+    conn.commit()
+    # الحجز المؤقت انتهى وفقد الجزء B→C؛ تحويله لا يغطي الرحلة كاملة
+    assert not segments.claim(cursor, journey(segments, "A", "C"), "1", 31, hold_token="token")
@@ -0,0 +1,24 @@
+import datetime
+import os
+
+from ticket_archive import TicketArchive, write_archive
+
+DAY = datetime.datetime(2030, 1, 5, 8, 0)
+
+
+def row(ticket_id, user_id, seat):
+    return (ticket_id, user_id, DAY, DAY, 0, 1, f"p{user_id}", f"p{user_id}", seat,
+            "Blue", "A", "B", "blue", "a", "b")
+
+
+def test_file_replaced_by_rename_is_mapped_again(tmp_path):
+    archive = TicketArchive(str(tmp_path))
+    path = os.path.join(str(tmp_path), "month-2030-01.tca")
+
+    write_archive(path, [row(1, 7, "1")])
+    assert [booking[0] for booking in archive.history(user_id=7)] == [1]
+
+    # compact_month يعيد كتابة ملف الشهر بالمسار نفسه: القراءة التالية يجب أن ترى الملف الجديد
+    write_archive(path, [row(1, 7, "1"), row(2, 7, "2"), row(3, 8, "3")])
+    assert [booking[0] for booking in archive.history(user_id=7)] == [2, 1]
+    assert archive.stats()["rows"] == 3
@@ -0,0 +1,114 @@
+import datetime
+import multiprocessing
+import os
+import threading
+import time
+
+from ticket_tokens import RevocationTable, TicketTokens
+from ticket_verifier import TicketVerifier
+
+NOW = datetime.datetime(2030, 1, 5, 12, 0)
+
+
+def row(ticket_id, paid=1):
+    return {"id_ticket": ticket_id, "name": f"p{ticket_id}", "seat_number": "1",
+            "date_ticket_time": NOW, "paid": paid}
+
+
+def verifier():
+    tokens = TicketTokens({"test": "secret"}, "test")
+    return TicketVerifier(tokens, refresh_seconds=0, full_refresh_seconds=0)
+
+
+def test_cancellation_during_a_full_refresh_is_not_undone():
+    gate = verifier()
+    gate.refresh(lambda start, end, after_id: [row(1), row(2)], NOW)
+
+    def slow_load(start, end, after_id):
+        # الصفوف قُرئت من MySQL قبل أن يُلغي هذا العامل التذكرة 1
+        rows = [row(1), row(2)]
+        gate.mark_cancelled(1)
+        gate.record(row(3))
+        return rows
+
+    gate.refresh(slow_load, NOW)
+    assert gate.verify("1", lambda ticket_id: None, NOW)[1] == 400
+    assert gate.verify("2", lambda ticket_id: None, NOW)[1] == 200
+    assert gate.verify("3", lambda ticket_id: None, NOW)[1] == 200
+    assert gate.stats()["fallbacks"] == 0
+
+
+def test_changes_are_not_replayed_after_a_failed_refresh():
+    gate = verifier()
+    gate.refresh(lambda start, end, after_id: [row(1)], NOW)
+
+    def failing_load(start, end, after_id):
+        gate.mark_cancelled(1)
+        raise OSError("database down")
+
+    try:
+        gate.refresh(failing_load, NOW)
+    except OSError:
+        pass
+    assert gate.verify("1", lambda ticket_id: None, NOW)[1] == 400
+    # التحميل التالي يبدأ بعد الإلغاء فيقرأ التذكرة من MySQL وقد أُعيد دفعها
+    gate.refresh(lambda start, end, after_id: [row(1, paid=1)], NOW)
+    assert gate.verify("1", lambda ticket_id: None, NOW)[1] == 200
+
+
+def test_scans_only_read_the_map_while_a_background_thread_refreshes_it():
+    gate = verifier()
+    gate.refresh_seconds = 0.01
+    loaded = threading.Event()
+
+    def load(start, end, after_id):
+        loaded.set()
+        return [row(1)]
+
+    gate.start(load)
+    assert loaded.wait(5)
+    deadline = time.monotonic() + 5
+    while gate.stats()["tickets"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # الخيط يعمل مرة واحدة لكل عملية؛ استدعاؤه من كل مسح لا يبدأ خيطاً آخر
+    threads = threading.active_count()
+    gate.start(load)
+    assert threading.active_count() == threads
+    assert gate.verify("1", lambda ticket_id: None)[1] in (200, 400)
+    assert gate.stats()["hits"] == 1
+
+
+def test_cancellation_in_another_worker_is_seen_before_the_next_full_reload(tmp_path):
+    path = str(tmp_path / "revocations")
+    gate = TicketVerifier(TicketTokens({"test": "secret"}, "test", RevocationTable(path, slots=64)),
+                          refresh_seconds=3600, full_refresh_seconds=3600)
+    gate.refresh(lambda start, end, after_id: [row(1), row(2)], NOW)
+    token = gate.tokens.issue(1, "p1", "1", NOW, "Blue", "A", "B")
+    assert gate.verify(token, None, NOW)[1] == 200
+
+    # عامل آخر (عملية أخرى) يلغي التذكرة 1: صف الخريطة هنا ما زال paid=1
+    def other_worker():
+        TicketTokens({"test": "secret"}, "test", RevocationTable(path, slots=64)).revoke(1, NOW)
+        os._exit(0)
+
+    process = multiprocessing.get_context("fork").Process(target=other_worker)
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+
+    assert gate.verify(token, None, NOW)[1] == 400
+    loads = []
+    body, status = gate.verify("1", lambda ticket_id: loads.append(ticket_id) or row(1, paid=0), NOW)
+    assert (status, loads) == (400, ["1"])
+    assert gate.verify("2", None, NOW)[1] == 200
+    assert gate.stats()["revoked"] == 1
+
+
+def test_revocation_table_reuses_expired_slots():
+    table = RevocationTable(slots=4)
+    past = int(time.time()) - 1
+    for ticket_id in range(1, 5):
+        assert table.add(ticket_id, 1000, past)
+    assert table.count() == 0 and table.get(1) is None
+    assert table.add(99, 2000, past + 3600)
+    assert table.get(99) == 2000 and table.count() == 1
@@ -0,0 +1,519 @@
+import array
+import bisect
+import datetime
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+
+from event_log import log_event, log_warning
+
+# أرشيف الرحلات السابقة: تذاكر الرحلات الأقدم من TICKET_ARCHIVE_AFTER_DAYS تُنقل ليلاً من tickets
+# إلى ملفات عمودية مضغوطة على القرص المحلي (ملف لكل يوم، ثم ملف لكل شهر مكتمل)، وتُقرأ عبر mmap.
+# الصفوف مرتبة حسب (user_id, date_ticket_time, id_ticket) فيكون سجل الراكب بحثاً ثنائياً في كل ملف.
+#   0 3 * * *  cd backend_flask && python ticket_archive.py run
+ARCHIVE_SETTINGS = {
+    "directory": os.environ.get("TICKET_ARCHIVE_DIR", "archive"),
+    "after_days": int(os.environ.get("TICKET_ARCHIVE_AFTER_DAYS", 30)),
+    "months_ahead": int(os.environ.get("TICKET_PARTITION_MONTHS_AHEAD", 3)),
+    "delete_batch": int(os.environ.get("TICKET_ARCHIVE_DELETE_BATCH", 1000)),
+}
+
+MAGIC = b"TKTARC01"
+EPOCH = datetime.datetime(1970, 1, 1)
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+NULL_INT = -1
+
+# (العمود، النوع): i64 أعداد صحيحة (التواريخ ثوانٍ منذ EPOCH)، u8 بايت، str نص بقاموس لكل عمود
+ARCHIVE_COLUMNS = [
+    ("id_ticket", "i64"), ("user_id", "i64"), ("date_ticket_time", "i64"), ("date_ticket_find", "i64"),
+    ("vip", "u8"), ("paid", "u8"),
+    ("name", "str"), ("name_key", "str"), ("seat_number", "str"),
+    ("line", "str"), ("departure_station", "str"), ("arrival_station", "str"),
+    ("line_key", "str"), ("departure_key", "str"), ("arrival_key", "str"),
+]
+COLUMN_NAMES = [name for name, _ in ARCHIVE_COLUMNS]
+DATETIME_COLUMNS = ("date_ticket_time", "date_ticket_find")
+TRIMMED_COLUMNS = ("line", "departure_station", "arrival_station")
+
+_ARCHIVE_DAY = ("SELECT " + ", ".join(COLUMN_NAMES) +
+                " FROM tickets WHERE date_ticket_time >= %s AND date_ticket_time < %s")
+_OLDEST_TRIP = "SELECT MIN(date_ticket_time) FROM tickets"
+_PARTITIONS = """
+    SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+    FROM INFORMATION_SCHEMA.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'tickets' AND PARTITION_NAME IS NOT NULL
+    ORDER BY PARTITION_ORDINAL_POSITION
+"""
+
+_FILE_NAME = re.compile(r"^(day|month)-(\d{4}-\d{2}(?:-\d{2})?)\.tca$")
+_TYPECODES = {"i64": "q", "u8": "B", "u32": "I"}
+
+
+def encode_datetime(value):
+    if value is None:
+        return NULL_INT
+    return (value - EPOCH) // datetime.timedelta(seconds=1)
+
+
+def decode_datetime(value):
+    if value == NULL_INT:
+        return None
+    return (EPOCH + datetime.timedelta(seconds=value)).strftime(DATETIME_FORMAT)
+
+
+def name_hash(name_key):
+    return int.from_bytes(hashlib.blake2b(name_key.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _align(out):
+    out.write(b"\0" * (-out.tell() % 8))
+
+
+def write_archive(path, rows):
+    """Write rows (tuples in COLUMN_NAMES order, datetimes as datetime) as one columnar file, atomically."""
+    rows = sorted(rows, key=lambda row: (row[1] if row[1] is not None else NULL_INT, row[2], row[0]))
+    header = {
+        "version": 1,
+        "byteorder": sys.byteorder,
+        "rows": len(rows),
+        "first": min(row[2] for row in rows).strftime(DATETIME_FORMAT) if rows else None,
+        "last": max(row[2] for row in rows).strftime(DATETIME_FORMAT) if rows else None,
+        "columns": {},
+    }
+    blocks = []
+    for index, (name, kind) in enumerate(ARCHIVE_COLUMNS):
+        values = [row[index] for row in rows]
+        if name in DATETIME_COLUMNS:
+            blocks.append((name, "i64", array.array("q", [encode_datetime(value) for value in values]).tobytes()))
+        elif kind == "i64":
+            blocks.append((name, kind, array.array("q", [NULL_INT if value is None else int(value)
+                                                         for value in values]).tobytes()))
+        elif kind == "u8":
+            blocks.append((name, kind, array.array("B", [int(value or 0) for value in values]).tobytes()))
+        else:
+            # قاموس لكل عمود: المسارات والمحطات قيم قليلة متكررة، فيكفي رمز 4 بايت لكل صف
+            codes, strings = {}, []
+            row_codes = array.array("I")
+            for value in values:
+                text = "" if value is None else str(value)
+                if name in TRIMMED_COLUMNS:
+                    text = text.strip()
+                code = codes.get(text)
+                if code is None:
+                    code = codes[text] = len(strings)
+                    strings.append(text.encode("utf-8"))
+                row_codes.append(code)
+            offsets = array.array("I", [0])
+            for encoded in strings:
+                offsets.append(offsets[-1] + len(encoded))
+            blocks.append((name, "str", row_codes.tobytes()))
+            blocks.append((name + ".offsets", "u32", offsets.tobytes()))
+            blocks.append((name + ".data", "bytes", b"".join(strings)))
+    # فهرس الأسماء للعملاء القدامى (البحث بـ name_key): بصمة 64 بت مرتبة + رقم الصف
+    name_column = COLUMN_NAMES.index("name_key")
+    by_hash = sorted((name_hash(str(row[name_column] or "")), i) for i, row in enumerate(rows))
+    blocks.append(("name_hash", "i64", array.array("q", [h for h, _ in by_hash]).tobytes()))
+    blocks.append(("name_rows", "u32", array.array("I", [i for _, i in by_hash]).tobytes()))
+
+    # الإزاحات نسبية إلى بداية البيانات (بعد الترويسة)، وكل كتلة تبدأ على حد 8 بايت
+    offset = 0
+    for name, kind, data in blocks:
+        header["columns"][name] = {"type": kind, "offset": offset, "length": len(data)}
+        offset += len(data) + (-len(data) % 8)
+    encoded_header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+    temp_path = path + ".part"
+    with open(temp_path, "wb") as out:
+        out.write(MAGIC)
+        out.write(struct.pack("<I", len(encoded_header)))
+        out.write(encoded_header)
+        _align(out)
+        for _, _, data in blocks:
+            out.write(data)
+            _align(out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    return len(rows)
+
+
+class ArchiveFile:
+    """One memory-mapped archive file; columns are memoryviews over the mapping, decoded per row on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a ticket archive")
+        header_length = struct.unpack_from("<I", self._map, len(MAGIC))[0]
+        header_end = len(MAGIC) + 4 + header_length
+        self.header = json.loads(self._map[len(MAGIC) + 4:header_end].decode("utf-8"))
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was written on a {self.header['byteorder']}-endian machine")
+        self.rows = self.header["rows"]
+        self.first = self.header["first"]
+        self.last = self.header["last"]
+        self.size = len(self._map)
+
+        base = header_end + (-header_end % 8)
+        view = memoryview(self._map)
+        self._columns = {}
+        for name, column in self.header["columns"].items():
+            block = view[base + column["offset"]:base + column["offset"] + column["length"]]
+            typecode = _TYPECODES.get(column["type"], "I" if column["type"] == "str" else None)
+            self._columns[name] = block.cast(typecode) if typecode else block
+
+    def _text(self, name, row):
+        code = self._columns[name][row]
+        offsets = self._columns[name + ".offsets"]
+        return bytes(self._columns[name + ".data"][offsets[code]:offsets[code + 1]]).decode("utf-8")
+
+    def value(self, name, row):
+        kind = self.header["columns"][name]["type"]
+        if kind == "str":
+            return self._text(name, row)
+        value = self._columns[name][row]
+        if name in DATETIME_COLUMNS:
+            return decode_datetime(value)
+        if name == "user_id" and value == NULL_INT:
+            return None
+        return value
+
+    def booking(self, row):
+        """The row as a tuple in queries.BOOKING_FIELDS order, formatted like queries.booking_columns()."""
+        ticket_id = self._columns["id_ticket"][row]
+        return (
+            ticket_id, ticket_id, self._text("name", row),
+            decode_datetime(self._columns["date_ticket_time"][row]),
+            decode_datetime(self._columns["date_ticket_find"][row]),
+            self._text("seat_number", row), 1 if self._columns["vip"][row] else 0, self._columns["paid"][row],
+            self._text("line", row), self._text("departure_station", row), self._text("arrival_station", row),
+        )
+
+    def rows_for_user(self, user_id):
+        users = self._columns["user_id"]
+        return range(bisect.bisect_left(users, user_id), bisect.bisect_right(users, user_id))
+
+    def rows_for_name(self, name_key):
+        hashes = self._columns["name_hash"]
+        target = name_hash(name_key)
+        candidates = self._columns["name_rows"][bisect.bisect_left(hashes, target):bisect.bisect_right(hashes, target)]
+        return [row for row in candidates if self._text("name_key", row) == name_key]
+
+    def all_rows(self):
+        """Every row in COLUMN_NAMES order with datetimes restored (for compaction and re-archiving)."""
+        rows = []
+        for row in range(self.rows):
+            values = []
+            for name in COLUMN_NAMES:
+                value = self.value(name, row)
+                if name in DATETIME_COLUMNS and value is not None:
+                    value = datetime.datetime.strptime(value, DATETIME_FORMAT)
+                values.append(value)
+            rows.append(tuple(values))
+        return rows
+
+
+class TicketArchive:
+    """Read side of the archive, shared by all requests of a worker.
+
+    The directory listing is re-read when its mtime changes (the archiver
+    publishes files by rename), so new nights appear without a restart. Open
+    files are cached by (path, inode, mtime), so a file replaced in place is
+    mapped again. A day file is ignored once the month file that replaced it
+    exists.
+    """
+
+    def __init__(self, directory, after_days=30, months_ahead=3, delete_batch=1000):
+        self.directory = directory
+        self.after_days = after_days
+        self.months_ahead = months_ahead
+        self.delete_batch = delete_batch
+        self._lock = threading.Lock()
+        self._files = []
+        self._open = {}
+        self._listed_mtime = None
+        self.lookups = 0
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if mtime == self._listed_mtime:
+                return self._files
+            names = {}
+            for filename in os.listdir(self.directory):
+                match = _FILE_NAME.match(filename)
+                if match:
+                    names[filename] = match.groups()
+            months = {period for kind, period in names.values() if kind == "month"}
+            opened = {}
+            for filename, (kind, period) in names.items():
+                if kind == "day" and period[:7] in months:
+                    continue
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                # المسار وحده لا يكفي: compact_month وإعادة الأرشفة تستبدلان الملف بـ rename،
+                # فيبقى الـ mmap القديم على inode الملف السابق. inode و mtime يميزان النسخة الجديدة.
+                identity = (path, stat.st_ino, stat.st_mtime_ns)
+                archive_file = self._open.get(identity)
+                if archive_file is None:
+                    try:
+                        archive_file = ArchiveFile(path)
+                    except (OSError, ValueError) as e:
+                        log_warning("ticket_archive_unreadable", path=path, error=str(e))
+                        continue
+                if archive_file.rows:
+                    opened[identity] = archive_file
+            # الملفات المحذوفة تُغلق عند تحرر آخر مرجع لها؛ الطلبات الجارية تكمل القراءة منها
+            self._open = opened
+            self._files = sorted(opened.values(), key=lambda archive_file: archive_file.first, reverse=True)
+            self._listed_mtime = mtime
+            return self._files
+
+    def history(self, user_id=None, name_key=None, after=None, limit=None):
+        """Archived bookings of a passenger, newest first, as queries.BOOKING_FIELDS tuples.
+
+        `after` is (date_ticket_time string, id_ticket) from a page cursor.
+        """
+        with self._lock:
+            self.lookups += 1
+        count = 0
+        for archive_file in self._refresh():
+            if after is not None and archive_file.first > after[0]:
+                continue
+            rows = archive_file.rows_for_user(user_id) if user_id is not None else archive_file.rows_for_name(name_key)
+            bookings = sorted((archive_file.booking(row) for row in rows),
+                              key=lambda booking: (booking[3], booking[0]), reverse=True)
+            for booking in bookings:
+                if after is not None and (booking[3], booking[0]) >= after:
+                    continue
+                yield booking
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+    def stats(self):
+        files = self._refresh()
+        with self._lock:
+            return {
+                "files": len(files),
+                "rows": sum(archive_file.rows for archive_file in files),
+                "bytes": sum(archive_file.size for archive_file in files),
+                "oldest": files[-1].first if files else None,
+                "newest": files[0].last if files else None,
+                "lookups": self.lookups,
+                "after_days": self.after_days,
+            }
+
+    # ---- الأرشفة الليلية ----
+
+    def _path(self, kind, period):
+        return os.path.join(self.directory, f"{kind}-{period}.tca")
+
+    def archive_day(self, conn, day):
+        """Copy one day of trips into its day file, then delete them (and their seat claims) from MySQL."""
+        start = datetime.datetime.combine(day, datetime.time())
+        end = start + datetime.timedelta(days=1)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_ARCHIVE_DAY, (start, end))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+            path = self._path("day", day.isoformat())
+            if os.path.exists(path):
+                # تشغيل سابق كتب الملف ثم توقف قبل الحذف: يُدمج معه بدل الكتابة فوقه
+                archived = {row[0]: row for row in ArchiveFile(path).all_rows()}
+                archived.update((row[0], row) for row in rows)
+                rows = list(archived.values())
+            write_archive(path, rows)
+
+            # الملف على القرص قبل الحذف؛ الحذف على دفعات صغيرة حتى لا تطول المعاملة
+            ids = [row[0] for row in rows]
+            for index in range(0, len(ids), self.delete_batch):
+                chunk = tuple(ids[index:index + self.delete_batch])
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute("DELETE FROM seat_leg_claims WHERE ticket_id IN (" + placeholders + ")", chunk)
+                cursor.execute("DELETE FROM seat_claims WHERE ticket_id IN (" + placeholders + ")", chunk)
+                cursor.execute("DELETE FROM tickets WHERE date_ticket_time >= %s AND date_ticket_time < %s"
+                               " AND id_ticket IN (" + placeholders + ")", (start, end) + chunk)
+                conn.commit()
+            return len(rows)
+        finally:
+            cursor.close()
+
+    def compact_month(self, month):
+        """Merge the day files of a finished month into one month file; returns the rows written."""
+        period = month.strftime("%Y-%m")
+        day_paths = sorted(os.path.join(self.directory, filename) for filename in os.listdir(self.directory)
+                           if filename.startswith(f"day-{period}-") and filename.endswith(".tca"))
+        if not day_paths:
+            return 0
+        rows = {}
+        month_path = self._path("month", period)
+        for path in ([month_path] if os.path.exists(month_path) else []) + day_paths:
+            rows.update((row[0], row) for row in ArchiveFile(path).all_rows())
+        written = write_archive(month_path, list(rows.values()))
+        for path in day_paths:
+            os.remove(path)
+        return written
+
+    def run(self, conn, today=None):
+        """The nightly job: archive every day before the cutoff, compact finished months, drop empty partitions."""
+        os.makedirs(self.directory, exist_ok=True)
+        today = today or datetime.date.today()
+        cutoff = today - datetime.timedelta(days=self.after_days)
+        summary = {"cutoff": cutoff.isoformat(), "days": 0, "tickets": 0, "months": 0, "partitions_dropped": []}
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_OLDEST_TRIP)
+            oldest = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+        day = oldest.date() if oldest is not None else cutoff
+        while day < cutoff:
+            archived = self.archive_day(conn, day)
+            if archived:
+                summary["days"] += 1
+                summary["tickets"] += archived
+            day += datetime.timedelta(days=1)
+
+        # الشهر مكتمل حين يكون آخر يوم فيه قبل حد الأرشفة
+        for filename in os.listdir(self.directory):
+            match = _FILE_NAME.match(filename)
+            if match and match.group(1) == "day":
+                month = datetime.date.fromisoformat(match.group(2)).replace(day=1)
+                if next_month(month) <= cutoff and self.compact_month(month):
+                    summary["months"] += 1
+
+        cursor = conn.cursor()
+        try:
+            summary["partitions_dropped"] = drop_archived_partitions(cursor, cutoff)
+            summary["partitions_added"] = ensure_partitions(cursor, today, self.months_ahead)
+        finally:
+            cursor.close()
+        log_event("ticket_archive_run", sample=1, **summary)
+        return summary
+
+
+def next_month(month):
+    return (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def partition_bounds(cursor):
+    """[(partition name, upper bound date or None for MAXVALUE)], or [] when tickets is not partitioned."""
+    cursor.execute(_PARTITIONS)
+    bounds = []
+    for name, description in cursor.fetchall():
+        bound = description.strip("'")
+        bounds.append((name, None if bound == "MAXVALUE" else datetime.date.fromisoformat(bound[:10])))
+    return bounds
+
+
+def drop_archived_partitions(cursor, cutoff):
+    """Drop month partitions that end before `cutoff` and are empty after archiving (instant, frees the space)."""
+    dropped = []
+    for name, bound in partition_bounds(cursor):
+        if bound is None or bound > cutoff:
+            continue
+        cursor.execute(f"SELECT 1 FROM tickets PARTITION ({name}) LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute(f"ALTER TABLE tickets DROP PARTITION {name}")
+            dropped.append(name)
+    return dropped
+
+
+def ensure_partitions(cursor, today, months_ahead):
+    """Split pmax so that every month up to `months_ahead` after today has its own partition."""
+    bounds = partition_bounds(cursor)
+    if not bounds:
+        log_warning("ticket_partitions_missing", hint="apply migrations/007_tickets_partitioning.sql")
+        return []
+    if bounds[-1][1] is not None:
+        return []
+    last = max((bound for _, bound in bounds if bound is not None), default=None)
+    if last is None:
+        # أول تقسيم: من شهر أقدم رحلة
+        cursor.execute(_OLDEST_TRIP)
+        oldest = cursor.fetchone()[0]
+        last = (oldest.date() if oldest is not None else today).replace(day=1)
+    target = next_month(today.replace(day=1))
+    for _ in range(months_ahead):
+        target = next_month(target)
+    added = []
+    while last < target:
+        month, last = last, next_month(last)
+        added.append(f"PARTITION p{month.strftime('%Y%m')} VALUES LESS THAN ('{last.isoformat()}')")
+    if added:
+        cursor.execute("ALTER TABLE tickets REORGANIZE PARTITION pmax INTO (" + ", ".join(added) +
+                       ", PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+    return [partition.split()[1] for partition in added]
+
+
+def merge_newest_first(hot, archived, limit=None):
+    """Merge two newest-first booking streams (hot rows from MySQL, archived rows) by (time, id).
+
+    A ticket present in both (read while the archiver was deleting it) is yielded once.
+    """
+    count = 0
+    previous = None
+    for booking in heapq.merge(hot, archived, key=lambda booking: (booking[3], booking[0]), reverse=True):
+        if booking[0] == previous:
+            continue
+        previous = booking[0]
+        yield booking
+        count += 1
+        if limit is not None and count >= limit:
+            return
+
+
+ticket_archive = TicketArchive(**ARCHIVE_SETTINGS)
+
+
+if __name__ == "__main__":
+    # python ticket_archive.py run          — الأرشفة الليلية (cron)
+    # python ticket_archive.py partitions   — مرة بعد migrations/007، ثم يتولاها run
+    command = sys.argv[1:]
+    if command not in (["run"], ["partitions"]):
+        print("usage: python ticket_archive.py run|partitions")
+        sys.exit(2)
+    from db_config import get_connection
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # قفل على مستوى الخادم: تشغيلان متداخلان (cron + يدوي) لا يؤرشفان اليوم نفسه معاً
+        cursor.execute("SELECT GET_LOCK('ticket_archive', 0)")
+        if cursor.fetchone()[0] != 1:
+            print("Another archiver run holds the lock")
+            sys.exit(1)
+        if command == ["partitions"]:
+            print(f"✅ partitions added: {ensure_partitions(cursor, datetime.date.today(), ticket_archive.months_ahead)}")
+        else:
+            summary = ticket_archive.run(conn)
+            print(f"✅ {json.dumps(summary)}")
+        cursor.execute("SELECT RELEASE_LOCK('ticket_archive')")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
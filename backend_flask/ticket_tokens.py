@@ -0,0 +1,188 @@
+import datetime
+import fcntl
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from event_log import log_warning
+from signing import Signer, keys_from_env
+
+# مفاتيح التوقيع بصيغة JSON {"kid": "secret"}؛ المفتاح النشط يوقّع التذاكر الجديدة
+# والمفاتيح الأخرى تبقى للتحقق من التذاكر الصادرة قبل تدوير المفتاح.
+# بلا TICKET_TOKEN_KEYS لا يبدأ الخادم إلا في وضع التطوير (FLASK_DEBUG=true).
+TOKEN_SETTINGS = keys_from_env("TICKET_TOKEN_KEYS", "TICKET_TOKEN_ACTIVE_KID", "reserve-and-ride-dev-secret")
+
+# قائمة الإلغاء مشتركة عبر mmap بين كل عمال الخادم على الجهاز (كما في sticky_reads):
+# التذكرة الملغاة في عامل تُرفض فوراً في البقية، لا بعد إعادة التحميل الكاملة التالية.
+REVOCATION_SETTINGS = {
+    "path": os.environ.get("TICKET_REVOCATIONS_FILE", os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "reserve-and-ride-ticket-revocations")),
+    "slots": int(os.environ.get("TICKET_REVOCATION_SLOTS", 65536)),
+}
+
+VALIDITY_WINDOW = datetime.timedelta(hours=1)
+
+# أقصى طول لسلسلة البحث الخطي عن خانة
+_PROBES = 64
+
+
+class RevocationTable:
+    """Ticket revocations in a fixed-size table shared by every worker on the host.
+
+    Each slot holds three int64s (ticket id, revoked at in ms, kept until in
+    s), found by linear probing from the id's hash; slots kept past their
+    ticket's validity window are reused, so the table never grows. Writers
+    take an flock on the file (cancellations are rare); readers take no lock.
+    With path=None, or if the file cannot be opened, the table lives in this
+    process only.
+    """
+
+    def __init__(self, path=None, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._table = None
+        self._fd = None
+        self._pid = None
+
+    def _slots(self):
+        if self._table is None or self._pid != os.getpid():
+            with self._lock:
+                if self._table is None or self._pid != os.getpid():
+                    self._table, self._fd = self._open()
+                    self._pid = os.getpid()
+        return self._table
+
+    def _open(self):
+        size = self.slots * 3 * 8
+        if self.path:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                shared = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+                return memoryview(shared).cast("q"), fd
+            except (OSError, ValueError) as e:
+                log_warning("ticket_revocations_local_only", path=self.path, error=str(e))
+        return memoryview(bytearray(size)).cast("q"), None
+
+    def _chain(self, ticket_id):
+        # تجزئة ضربية (فيبوناتشي): الأرقام المتتالية تتوزع على الجدول، وهي أرخص من blake2b في كل مسح
+        first = ((ticket_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % self.slots
+        for probe in range(min(_PROBES, self.slots)):
+            yield (first + probe) % self.slots * 3
+
+    def add(self, ticket_id, revoked_ms, until):
+        table = self._slots()
+        with self._lock:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now, free = int(time.time()), None
+                for base in self._chain(ticket_id):
+                    if table[base] == ticket_id:
+                        table[base + 1] = max(table[base + 1], revoked_ms)
+                        table[base + 2] = max(table[base + 2], until)
+                        return True
+                    if free is None and (table[base] == 0 or table[base + 2] < now):
+                        free = base
+                    if table[base] == 0:
+                        break
+                if free is None:
+                    log_warning("ticket_revocations_full", ticket_id=ticket_id, slots=self.slots)
+                    return False
+                # الأوقات قبل الرقم: القارئ الذي يرى الرقم يرى أوقاته
+                table[free + 1] = revoked_ms
+                table[free + 2] = until
+                table[free] = ticket_id
+                return True
+            finally:
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, ticket_id):
+        """Revocation time in ms of `ticket_id`, or None."""
+        table = self._slots()
+        for base in self._chain(ticket_id):
+            if table[base] == ticket_id:
+                return table[base + 1] if table[base + 2] >= int(time.time()) else None
+            if table[base] == 0:
+                return None
+        return None
+
+    def count(self):
+        table, now = self._slots(), int(time.time())
+        return sum(1 for base in range(0, self.slots * 3, 3) if table[base] and table[base + 2] >= now)
+
+
+class TicketTokens:
+    """Compact signed ticket tokens: "<kid>.<claims>.<signature>".
+
+    The claims carry everything a gate needs (ticket id, passenger name, seat,
+    departure, line, segment and the validity window), so a token is checked
+    with one HMAC and no database. Cancelled or edited tickets are refused
+    through a revocation table keyed by ticket id (shared by the workers on
+    the host, see RevocationTable): every token issued before the revocation
+    time is rejected until its window has passed.
+    """
+
+    def __init__(self, keys, active_kid, revocations=None):
+        self.signer = Signer(keys, active_kid)
+        self.revocations = revocations or RevocationTable()
+
+    def issue(self, ticket_id, name, seat_number, departure, line, departure_station, arrival_station):
+        claims = {
+            "t": int(ticket_id),
+            "n": name,
+            "s": seat_number,
+            "d": int(departure.timestamp()),
+            "l": line,
+            "f": departure_station,
+            "a": arrival_station,
+            "nb": int((departure - VALIDITY_WINDOW).timestamp()),
+            "na": int((departure + VALIDITY_WINDOW).timestamp()),
+            "i": int(time.time() * 1000),
+        }
+        return self.signer.dumps(claims)
+
+    @staticmethod
+    def looks_like_token(payload):
+        return str(payload).count(".") == 2
+
+    def decode(self, token):
+        """Return the claims of a correctly signed token, or None."""
+        return self.signer.loads(token)
+
+    def revoke(self, ticket_id, departure):
+        """Reject tokens issued for `ticket_id` until now; kept until the old window closes."""
+        until = int((departure + VALIDITY_WINDOW).timestamp()) if departure else int(time.time()) + 86400
+        self.revocations.add(int(ticket_id), int(time.time() * 1000), until)
+
+    def revoked_at(self, ticket_id):
+        """When `ticket_id` was last cancelled or edited by any worker (ms), or None."""
+        return self.revocations.get(int(ticket_id))
+
+    def is_revoked(self, claims):
+        revoked_at = self.revoked_at(claims["t"])
+        return revoked_at is not None and claims["i"] < revoked_at
+
+    def revoked_count(self):
+        return self.revocations.count()
+
+
+ticket_tokens = TicketTokens(**TOKEN_SETTINGS, revocations=RevocationTable(**REVOCATION_SETTINGS))
+
+
+def issue_ticket_token(ticket_id, name, seat_number, key, line, departure_station, arrival_station):
+    """إصدار رمز QR موقَّع بعد نجاح الحجز؛ لا يُفشل الطلب إذا تعذّر تحليل الموعد."""
+    try:
+        departure = datetime.datetime.fromisoformat(key[0])
+    except ValueError:
+        log_warning("ticket_token_bad_departure", ticket_id=ticket_id, time=key[0])
+        return None
+    return ticket_tokens.issue(
+        ticket_id, name, str(seat_number).strip(), departure,
+        str(line).strip(), str(departure_station).strip(), str(arrival_station).strip()
+    )
@@ -0,0 +1,312 @@
+import asyncio
+import datetime
+import os
+import threading
+import time
+
+from event_log import log_error
+from ticket_tokens import ticket_tokens
+
+VERIFIER_SETTINGS = {
+    "refresh_seconds": float(os.environ.get("TICKET_VERIFIER_REFRESH", 15)),
+    "full_refresh_seconds": float(os.environ.get("TICKET_VERIFIER_FULL_REFRESH", 60)),
+}
+
+VALIDITY_WINDOW = datetime.timedelta(hours=1)
+
+
+CANCELLED = {"valid": False, "message": "التذكرة غير مدفوعة (ملغاة أو لم تكتمل)"}
+
+
+def verification_result(ticket, at, valid_start=None, valid_end=None):
+    """نتيجة التحقق (الجسم، رمز HTTP) لتذكرة بصيغة القاموس، في اللحظة `at`."""
+    if not ticket:
+        return {"valid": False, "message": "التذكرة غير موجودة"}, 404
+
+    if ticket["paid"] != 1:
+        return dict(CANCELLED), 400
+
+    booking_time = ticket["date_ticket_time"]
+    valid_start = valid_start or booking_time - VALIDITY_WINDOW
+    valid_end = valid_end or booking_time + VALIDITY_WINDOW
+
+    if valid_start <= at <= valid_end:
+        return {
+            "valid": True,
+            "message": "التذكرة صالحة ومطابقة للوقت",
+            "details": {
+                "name": ticket['name'],
+                "seat": ticket['seat_number'],
+                "time": booking_time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+        }, 200
+
+    if at > valid_end:
+        return {"valid": False, "message": "التذكرة منتهية الصلاحية (تجاوزت وقت الحجز بساعة)"}, 400
+
+    return {"valid": False, "message": "التذكرة سابقة لأوانها (قبل ساعة من موعدها)"}, 400
+
+
+class TicketVerifier:
+    """Answers gate scans from an in-memory map of the tickets that can be valid today.
+
+    The map covers tickets departing between today 00:00 - 1h and tomorrow
+    00:00 + 1h. A background thread (or task, see start_async) pulls in new
+    bookings from other workers every `refresh_seconds` by id and reloads the
+    whole window every `full_refresh_seconds` (which is when edits and
+    cancellations made by other workers show up); scans only read the map,
+    so none of them waits for a reload. This process's own bookings, edits and
+    cancellations are applied immediately, and again on top of any refresh
+    that was loading while they happened. Tickets outside the window fall
+    back to the `load_ticket` callback.
+
+    Signed ticket tokens (see ticket_tokens.py) are validated from their own
+    claims and never touch the database; the map is only consulted to refuse
+    tokens of tickets that were cancelled or edited by another worker.
+    Cancellations and edits made by other workers on the host reach the
+    shared revocation table at once: a ticket revoked after the last full
+    reload started is not answered from its (stale) map row.
+    """
+
+    def __init__(self, tokens, refresh_seconds=15.0, full_refresh_seconds=60.0):
+        self.tokens = tokens
+        self.refresh_seconds = refresh_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+
+        self._tickets = {}
+        self._day = None
+        self._max_id = 0
+        self._last_attempt = float("-inf")
+        self._last_full_refresh = 0.0
+        # بداية آخر تحميل كامل (ms): إلغاء أو تعديل بعده في عامل آخر يجعل صف الخريطة قديماً
+        self._snapshot_ms = 0
+        self._loading_ms = 0
+        self._refresh_lock = threading.Lock()
+        # تغييرات هذه العملية أثناء تحميل النافذة: الصفوف المحمّلة قد تسبقها فتُعاد عليها
+        self._changes_lock = threading.Lock()
+        self._changes = None
+        self._refresher_pid = None
+        self._refresher_task = None
+
+        self.hits = 0
+        self.fallbacks = 0
+        self.offline = 0
+        self.forged = 0
+
+    @staticmethod
+    def window_bounds(day):
+        start = datetime.datetime.combine(day, datetime.time()) - VALIDITY_WINDOW
+        end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()) + VALIDITY_WINDOW
+        return start, end
+
+    def _begin_refresh(self, now):
+        """Take the refresh slot if one is due; returns (start, end, after_id) or None."""
+        if time.monotonic() - self._last_attempt < self.refresh_seconds:
+            return None
+        if not self._refresh_lock.acquire(blocking=False):
+            return None
+        clock = time.monotonic()
+        if clock - self._last_attempt < self.refresh_seconds:
+            self._refresh_lock.release()
+            return None
+        self._last_attempt = clock
+
+        day = now.date()
+        start, end = self.window_bounds(day)
+        full = self._day != day or clock - self._last_full_refresh > self.full_refresh_seconds
+        with self._changes_lock:
+            self._changes = []
+        self._loading_ms = int(time.time() * 1000)
+        return start, end, 0 if full else self._max_id
+
+    def _apply_refresh(self, rows, now, after_id):
+        day = now.date()
+        # الخريطة الجديدة تُبنى خارج القفل؛ المسح لا يأخذه أصلاً، والقفل يحمي الاستبدال وإعادة التغييرات فقط
+        tickets = {str(row["id_ticket"]): row for row in rows} if after_id == 0 else None
+        with self._changes_lock:
+            if after_id == 0:
+                self._tickets = tickets
+                self._day = day
+                self._last_full_refresh = self._last_attempt
+                self._snapshot_ms = self._loading_ms
+            else:
+                for row in rows:
+                    self._tickets[str(row["id_ticket"])] = row
+            for change, value in self._changes:
+                change(value)
+            self._changes = None
+        for row in rows:
+            self._max_id = max(self._max_id, int(row["id_ticket"]))
+
+    def _end_refresh(self):
+        with self._changes_lock:
+            self._changes = None
+        self._refresh_lock.release()
+
+    def refresh(self, load_window, now=None):
+        """Bring the map up to date; only one thread refreshes, the others keep serving.
+
+        Attempts are spaced `refresh_seconds` apart even when they fail, so a
+        database outage does not put a connection attempt on every scan.
+        """
+        now = now or datetime.datetime.now()
+        window = self._begin_refresh(now)
+        if window is None:
+            return
+        try:
+            self._apply_refresh(load_window(*window), now, window[2])
+        finally:
+            self._end_refresh()
+
+    async def refresh_async(self, load_window, now=None):
+        """refresh() for a coroutine loader; the lock is only ever taken without blocking."""
+        now = now or datetime.datetime.now()
+        window = self._begin_refresh(now)
+        if window is None:
+            return
+        try:
+            self._apply_refresh(await load_window(*window), now, window[2])
+        finally:
+            self._end_refresh()
+
+    def start(self, load_window):
+        """Keep the map fresh from a daemon thread in this process; cheap to call on every scan.
+
+        Threads do not survive fork, so each gunicorn worker starts its own on
+        its first scan, like the replica monitor in db_config.
+        """
+        if self._refresher_pid == os.getpid():
+            return
+        with self._changes_lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh_loop, args=(load_window,), name="ticket-verifier",
+                         daemon=True).start()
+
+    def _refresh_loop(self, load_window):
+        while True:
+            try:
+                self.refresh(load_window)
+            except Exception as e:
+                # فشل التحديث لا يوقف البوابات؛ تستمر الخريطة الحالية والمحاولة التالية بعد refresh_seconds
+                log_error("ticket_verifier_refresh_error", e)
+            time.sleep(self.refresh_seconds)
+
+    def start_async(self, load_window):
+        """start() for a coroutine loader: one task on the running event loop."""
+        if self._refresher_task is None or self._refresher_task.done():
+            self._refresher_task = asyncio.get_running_loop().create_task(self._refresh_loop_async(load_window))
+
+    async def _refresh_loop_async(self, load_window):
+        while True:
+            try:
+                await self.refresh_async(load_window)
+            except Exception as e:
+                log_error("ticket_verifier_refresh_error", e)
+            await asyncio.sleep(self.refresh_seconds)
+
+    def _track(self, change, value):
+        with self._changes_lock:
+            if self._changes is not None:
+                self._changes.append((change, value))
+            change(value)
+
+    def record(self, ticket):
+        """Apply a booking or edit made by this process."""
+        self._track(self._record, ticket)
+
+    def mark_cancelled(self, ticket_id):
+        self._track(self._mark_cancelled, ticket_id)
+
+    def _record(self, ticket):
+        if self._day is None:
+            return
+        key = str(ticket["id_ticket"])
+        departure = ticket["date_ticket_time"]
+        if not isinstance(departure, datetime.datetime):
+            try:
+                departure = datetime.datetime.fromisoformat(str(departure).strip())
+            except ValueError:
+                # لا نعرف موعدها بدقة؛ نتركها لقاعدة البيانات
+                self._tickets.pop(key, None)
+                return
+        start, end = self.window_bounds(self._day)
+        if start <= departure < end:
+            self._tickets[key] = dict(ticket, date_ticket_time=departure)
+        else:
+            self._tickets.pop(key, None)
+
+    def _mark_cancelled(self, ticket_id):
+        ticket = self._tickets.get(str(ticket_id))
+        if ticket is not None:
+            self._tickets[str(ticket_id)] = dict(ticket, paid=0)
+
+    def verify_cached(self, payload, at):
+        """(body, status) when the scan can be answered from memory, else None."""
+        if self.tokens.looks_like_token(payload):
+            return self.verify_token(payload, at)
+
+        key = str(payload).strip()
+        ticket = self._tickets.get(key)
+        if ticket is not None and (ticket["paid"] != 1 or not self._changed_elsewhere(key)):
+            self.hits += 1
+            return verification_result(ticket, at)
+
+        self.fallbacks += 1
+        return None
+
+    def _changed_elsewhere(self, ticket_id):
+        """True when any worker revoked the ticket after the map's last full reload started."""
+        try:
+            revoked_at = self.tokens.revoked_at(int(ticket_id))
+        except ValueError:
+            return False
+        return revoked_at is not None and revoked_at >= self._snapshot_ms
+
+    def verify(self, payload, load_ticket, at=None):
+        """Return (body, status) for one scan at time `at` (defaults to now)."""
+        at = at or datetime.datetime.now()
+        result = self.verify_cached(payload, at)
+        if result is not None:
+            return result
+        return verification_result(load_ticket(str(payload).strip()), at)
+
+    def verify_token(self, token, at):
+        claims = self.tokens.decode(token)
+        if claims is None:
+            self.forged += 1
+            return {"valid": False, "message": "رمز التذكرة غير صالح"}, 400
+
+        if self.tokens.is_revoked(claims):
+            return dict(CANCELLED), 400
+
+        departure = datetime.datetime.fromtimestamp(claims["d"])
+        cached = self._tickets.get(str(claims["t"]))
+        if cached is not None and not self._changed_elsewhere(claims["t"]):
+            if cached["paid"] != 1:
+                return dict(CANCELLED), 400
+            if cached["date_ticket_time"] != departure or str(cached["seat_number"]).strip() != claims["s"].strip():
+                return {"valid": False, "message": "تم تعديل هذه التذكرة، يرجى استخدام الرمز الجديد"}, 400
+
+        self.offline += 1
+        ticket = {"name": claims["n"], "seat_number": claims["s"], "date_ticket_time": departure, "paid": 1}
+        return verification_result(
+            ticket, at,
+            datetime.datetime.fromtimestamp(claims["nb"]),
+            datetime.datetime.fromtimestamp(claims["na"])
+        )
+
+    def stats(self):
+        return {
+            "tickets": len(self._tickets),
+            "day": str(self._day) if self._day else None,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "offline": self.offline,
+            "forged": self.forged,
+            "revoked": self.tokens.revoked_count(),
+        }
+
+
+ticket_verifier = TicketVerifier(ticket_tokens, **VERIFIER_SETTINGS)
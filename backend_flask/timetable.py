@@ -0,0 +1,94 @@
+import bisect
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+# ساعات الخدمة لكل مسار (HH:MM)؛ "*" هو الافتراضي لأي مسار غير مذكور.
+# يمكن تجاوزها بمتغير البيئة TIMETABLE_SERVICE_HOURS بصيغة JSON، مثلاً:
+# {"*": ["06:00", "23:59"], "المسار الأزرق": ["05:30", "23:59"]}
+DEFAULT_SERVICE_HOURS = {"*": ("00:00", "23:59")}
+
+
+def load_service_hours():
+    raw = os.environ.get("TIMETABLE_SERVICE_HOURS")
+    if not raw:
+        return dict(DEFAULT_SERVICE_HOURS)
+    hours = {line.strip(): tuple(span) for line, span in json.loads(raw).items()}
+    hours.setdefault("*", DEFAULT_SERVICE_HOURS["*"])
+    return hours
+
+
+class Timetable:
+    """Departure slots per (day, interval, service hours), built once a day.
+
+    Slot lists are rebuilt lazily on the first request after midnight; the
+    first upcoming slot is found with a binary search over the day's list.
+    """
+
+    def __init__(self, service_hours=None):
+        self.service_hours = service_hours or dict(DEFAULT_SERVICE_HOURS)
+        self._lock = threading.Lock()
+        self._day = None
+        self._slots = {}
+
+    def hours_for(self, line):
+        if line:
+            hours = self.service_hours.get(line.strip())
+            if hours:
+                return tuple(hours)
+        return tuple(self.service_hours["*"])
+
+    def _build(self, day, interval_minutes, hours):
+        start_h, start_m = map(int, hours[0].split(":"))
+        end_h, end_m = map(int, hours[1].split(":"))
+        current = datetime.datetime(day.year, day.month, day.day, start_h, start_m)
+        end = datetime.datetime(day.year, day.month, day.day, end_h, end_m)
+        step = datetime.timedelta(minutes=interval_minutes)
+
+        departures = []
+        while current <= end:
+            departures.append(current)
+            current += step
+        return departures, [d.strftime("%Y-%m-%d %H:%M:%S") for d in departures]
+
+    def day_slots(self, day, interval_minutes, hours):
+        key = (interval_minutes, hours)
+        with self._lock:
+            if self._day != day:
+                self._day = day
+                self._slots = {}
+            slots = self._slots.get(key)
+            if slots is None:
+                slots = self._build(day, interval_minutes, hours)
+                self._slots[key] = slots
+        return slots
+
+    def times(self, now, interval_minutes, line=None, all_day=False):
+        """Return (times, etag, max_age_seconds) for the /times response."""
+        # أي فاصل أطول من يوم يعطي الرحلة الأولى فقط؛ التقييد يحد من عدد القوائم المخزنة
+        interval_minutes = min(interval_minutes, 24 * 60)
+        hours = self.hours_for(line)
+        departures, labels = self.day_slots(now.date(), interval_minutes, hours)
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+
+        if all_day:
+            first = 0
+            expires = midnight
+        else:
+            # الرحلات التي بدأت قبل أقل من دقيقة ما زالت تُعرض كما في السابق
+            threshold = now - datetime.timedelta(minutes=1)
+            first = bisect.bisect_right(departures, threshold)
+            if first < len(departures):
+                expires = min(departures[first] + datetime.timedelta(minutes=1), midnight)
+            else:
+                expires = midnight
+
+        tag_source = f"{now.date()}|{interval_minutes}|{hours}|{'all' if all_day else first}"
+        etag = hashlib.sha1(tag_source.encode("utf-8")).hexdigest()[:16]
+        max_age = max(int((expires - now).total_seconds()), 0)
+        return labels[first:], etag, max_age
+
+
+timetable = Timetable(load_service_hours())
@@ -0,0 +1,5 @@
+# نقطة الدخول لخوادم WSGI متعددة العمال، مثلاً:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+from app import app
+
+application = app